@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""Benchmark the Soundmondo downloader against the local stand-in server.
+
+tools.soundmondo_standin is started in a child process, serving the voices
+of the given sources with the given latency and error rates. For every
+concurrency, voices are downloaded twice with a fresh session from
+tools.get_soundmondo_voice.make_http_session() and the authors looked up
+through a UserCache: a cold pass and a warm one, which is answered from the
+HTTP cache where cachecontrol is installed. Voices per second, latency
+percentiles, cache hits, retries and failures are reported, next to the
+requests the server saw.
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONCURRENCY = "1,4,8,16"
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def start_standin(args):
+    command = [sys.executable, "-m", "tools.soundmondo_standin", "-p", "0", "-l", str(args.latency),
+               "-j", str(args.jitter), "-e", str(args.error_rate), "-r", str(args.reset_rate), "-s", "1"]
+    proc = subprocess.Popen(command + args.sources, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    url = proc.stdout.readline().strip()
+    if not url:
+        proc.wait()
+        raise RuntimeError("The stand-in server did not start.")
+    return proc, url
+
+
+def server_stats(session, base_url):
+    root = base_url.split("/api/", 1)[0]
+    return session.get(root + "/stats").json()
+
+
+def run_pass(gsv, session, base_url, voice_ids, workers):
+    users = gsv.UserCache()
+    lock = threading.Lock()
+    result = {"latencies": [], "cache_hits": 0, "retries": 0, "failed": 0}
+
+    def fetch(voice_id):
+        started = time.perf_counter()
+        retries = 0
+        try:
+            resp = gsv.request_voice(voice_id, session, base_url)
+            history = getattr(getattr(resp.raw, "retries", None), "history", ())
+            retries = len(history or ())
+            data = gsv.parse_voice_response(resp)
+            users.get(data["user"], session)
+        except Exception as exc:
+            with lock:
+                result["failed"] += 1
+            logging.debug("Voice %s failed: %s", voice_id, exc)
+            return
+
+        with lock:
+            result["latencies"].append(time.perf_counter() - started)
+            result["cache_hits"] += bool(getattr(resp, "from_cache", False))
+            result["retries"] += retries
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(fetch, voice_ids))
+    result["elapsed"] = time.perf_counter() - started
+    result["user_hits"] = users.hits
+    result["user_misses"] = users.misses
+    return result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    padd = parser.add_argument
+    padd("-c", "--concurrency", default=DEFAULT_CONCURRENCY,
+         help="Comma-separated numbers of concurrent downloads (default: %(default)s)")
+    padd("-n", "--count", type=int, default=500, help="Voices downloaded per pass (default: %(default)s)")
+    padd("-l", "--latency", type=float, default=20.0, metavar="MS",
+         help="Latency of the stand-in server in milliseconds (default: %(default)s)")
+    padd("-j", "--jitter", type=float, default=10.0, metavar="MS",
+         help="Random extra latency in milliseconds (default: %(default)s)")
+    padd("-e", "--error-rate", type=float, default=0.02, metavar="FRACTION",
+         help="Fraction of requests answered with 503 (default: %(default)s)")
+    padd("-r", "--reset-rate", type=float, default=0.01, metavar="FRACTION",
+         help="Fraction of connections dropped (default: %(default)s)")
+    padd("--no-cache", action="store_true", help="Don't use the HTTP cache even if cachecontrol is installed")
+    padd("--json", action="store_true", help="Print results as JSON")
+    padd("-v", "--debug", action="store_true", help="Enable debug logging")
+    padd("sources", nargs="*", default=["Sysex"], metavar="SOURCE",
+         help="Folders of SysEx files or voice packs to serve (default: Sysex)")
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING, format="%(levelname)s: %(message)s")
+    if not args.debug:
+        # Retries are counted, not logged one by one
+        logging.getLogger("urllib3").setLevel(logging.ERROR)
+    sys.path.insert(0, ROOT)
+    from tools import get_soundmondo_voice as gsv
+    from tools.soundmondo_standin import load_voices
+
+    voice_ids = sorted(load_voices([os.path.join(ROOT, source) for source in args.sources]))[:args.count]
+    if not voice_ids:
+        print("No voices found.", file=sys.stderr)
+        return 1
+
+    proc, base_url = start_standin(args)
+    tmpdir = tempfile.mkdtemp(prefix="bench-download-")
+    stats_session = gsv.make_http_session()
+    results = []
+    try:
+        for workers in [int(n) for n in args.concurrency.split(",") if n]:
+            cache_dir = None if args.no_cache else os.path.join(tmpdir, "cache-%i" % workers)
+            session = gsv.make_http_session(cache_dir, pool_size=workers)
+            for name in ("cold", "warm"):
+                before = server_stats(stats_session, base_url)
+                result = run_pass(gsv, session, base_url, voice_ids, workers)
+                after = server_stats(stats_session, base_url)
+                served = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+                latencies = result.pop("latencies")
+                result.update(
+                    workers=workers, name=name, voices=len(voice_ids),
+                    rate=len(latencies) / result["elapsed"] if result["elapsed"] else 0.0,
+                    p50=percentile(latencies, 0.5), p95=percentile(latencies, 0.95),
+                    requests=served.get("requests", 0), errors=served.get("503", 0), resets=served.get("reset", 0))
+                results.append(result)
+            session.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print("HTTP cache: %s" % ("off" if args.no_cache or not gsv.cachecontrol else "cachecontrol"))
+    print("%-5s %7s %8s %8s %8s %9s %8s %6s %8s %9s %5s %6s" % (
+        "pass", "workers", "voices/s", "p50 ms", "p95 ms", "cache hit", "retries", "failed", "requests", "user hits",
+        "503s", "resets"))
+    for r in results:
+        print("%-5s %7i %8.1f %8.1f %8.1f %8.0f%% %8i %6i %8i %9i %5i %6i" % (
+            r["name"], r["workers"], r["rate"], (r["p50"] or 0) * 1000, (r["p95"] or 0) * 1000,
+            100.0 * r["cache_hits"] / r["voices"], r["retries"], r["failed"], r["requests"], r["user_hits"],
+            r["errors"], r["resets"]))
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
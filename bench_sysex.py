@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Benchmark decoding the SysEx data of Soundmondo voice responses.
+
+The voice API returns every SysEx message as a JSON object of byte index to
+byte value, e.g. {"0": 240, "1": 67, ...}. The payloads benchmarked are
+recorded API responses (*.json, e.g. saved with curl) from --responses
+folders and, to make up the count, responses rebuilt from the .syx files
+under --folder. Each payload is decoded with the original sort-per-message
+decoder and with tools.get_soundmondo_voice.parse_sysex_messages, and the
+results are checked to be identical.
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SYSTEM_EXCLUSIVE = 0xF0
+END_OF_EXCLUSIVE = 0xF7
+
+
+def reference_parse(data):
+    """The decoder as it was, including its eager debug formatting."""
+    log = logging.getLogger("bench-sysex")
+    messages = []
+
+    for i, part in enumerate(data):
+        msg = bytearray(v for _, v in sorted(part.items(), key=lambda i: int(i[0])))
+        log.debug("SysEx msg #%02i: %s", i, " ".join("%02X" % b for b in msg))
+        messages.append(msg)
+
+    return messages
+
+
+def split_messages(data):
+    messages = []
+    start = data.find(SYSTEM_EXCLUSIVE)
+    while start >= 0:
+        end = data.find(END_OF_EXCLUSIVE, start)
+        if end < 0:
+            break
+        messages.append(data[start:end + 1])
+        start = data.find(SYSTEM_EXCLUSIVE, end + 1)
+    return messages
+
+
+def payload_from_syx(path, voice_id):
+    with open(path, "rb") as fp:
+        messages = split_messages(fp.read())
+
+    if not messages:
+        return None
+
+    return json.dumps({
+        "id": voice_id,
+        "name": os.path.splitext(os.path.basename(path))[0],
+        "updated": "2020-01-01T00:00:00.000000Z",
+        "data": {"sysex": [{str(i): b for i, b in enumerate(msg)} for msg in messages]},
+    })
+
+
+def load_payloads(count, folders, response_folders):
+    payloads = []
+
+    for folder in response_folders:
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(".json") and len(payloads) < count:
+                with open(os.path.join(folder, name)) as fp:
+                    payloads.append(fp.read())
+
+    syx_files = []
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(folder):
+            dirnames.sort()
+            syx_files += [os.path.join(dirpath, name) for name in sorted(filenames) if name.lower().endswith(".syx")]
+
+    for voice_id, path in enumerate(syx_files):
+        if len(payloads) >= count:
+            break
+        payload = payload_from_syx(path, voice_id)
+        if payload is not None:
+            payloads.append(payload)
+
+    return payloads
+
+
+def timed(decode, sysex_lists, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for sysex in sysex_lists:
+            decode(sysex)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    padd = parser.add_argument
+    padd("-c", "--count", type=int, default=3000, help="Number of payloads (default: %(default)s)")
+    padd("-f", "--folder", action="append", help="Folder of .syx files to rebuild payloads from, may be repeated "
+         "(default: Sysex)")
+    padd("-r", "--responses", action="append", default=[], metavar="FOLDER",
+         help="Folder of recorded voice API responses (*.json), may be repeated")
+    padd("-n", "--repeat", type=int, default=5, help="Runs of each decoder, the best is reported (default: %(default)s)")
+    args = parser.parse_args(args)
+
+    # The decoders are timed as they run in the tools, with debug logging off
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    sys.path.insert(0, ROOT)
+    from tools.get_soundmondo_voice import parse_sysex_messages
+
+    payloads = load_payloads(args.count, args.folder or [os.path.join(ROOT, "Sysex")], args.responses)
+    if not payloads:
+        print("No payloads found.", file=sys.stderr)
+        return 1
+
+    sysex_lists = [json.loads(payload)["data"]["sysex"] for payload in payloads]
+    for sysex in sysex_lists:
+        if parse_sysex_messages(sysex) != reference_parse(sysex):
+            print("Decoders disagree on a payload.", file=sys.stderr)
+            return 1
+
+    messages = sum(len(sysex) for sysex in sysex_lists)
+    size = sum(sum(len(part) for part in sysex) for sysex in sysex_lists)
+    print("%i payloads, %i messages, %i bytes of SysEx data" % (len(payloads), messages, size))
+
+    start = time.perf_counter()
+    for payload in payloads:
+        json.loads(payload)
+    json_time = time.perf_counter() - start
+
+    reference = timed(reference_parse, sysex_lists, args.repeat)
+    fast = timed(parse_sysex_messages, sysex_lists, args.repeat)
+    print("%-22s %10s %12s" % ("decoder", "total ms", "us/payload"))
+    for name, elapsed in (("json.loads", json_time), ("sorted (original)", reference), ("parse_sysex_messages", fast)):
+        print("%-22s %10.2f %12.2f" % (name, elapsed * 1000, elapsed * 1e6 / len(payloads)))
+    print("Speed-up: %.1fx" % (reference / fast if fast else float("inf")))
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
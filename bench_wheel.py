@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""Benchmark the wheel browser renderers with scripted drags, flings and settles.
+
+Every renderer variant is run in its own child process against synthetic
+folders of the given sizes (and optionally a real folder), and p50/p95/p99
+frame times plus peak memory are reported. With --xvfb (or when no DISPLAY is
+set) a virtual X server is started for the run.
+
+Variants: the renderers of midimenukb.FileSelector ("canvas", "sprites",
+"skia") and the older Skia browser in midimenu.py ("midimenu-skia").
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from types import SimpleNamespace
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = "100,10000,100000"
+LEGACY_VARIANT = "midimenu-skia"
+
+
+def make_folder(parent, entries):
+    folder = os.path.join(parent, "synthetic-%i" % entries)
+    os.makedirs(folder, exist_ok=True)
+
+    for i in range(entries):
+        open(os.path.join(folder, "DX-%08i-Voice_%i.syx" % (i * 7, i)), "wb").close()
+
+    return folder
+
+
+def available_variants():
+    import midimenukb
+
+    variants = ["canvas", "sprites"]
+    if midimenukb.import_skia() is not None:
+        variants += ["skia", LEGACY_VARIANT]
+    return variants
+
+
+def pump(app, seconds=0.0):
+    deadline = time.perf_counter() + seconds
+    app.update()
+    while time.perf_counter() < deadline:
+        app.update()
+
+
+def settle(app, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    pump(app)
+    while app.is_animating and time.perf_counter() < deadline:
+        pump(app, 0.002)
+
+
+def drag(app, x, y1, y2, steps, pause):
+    app.on_click(SimpleNamespace(x=x, y=y1))
+    for step in range(1, steps + 1):
+        app.on_drag(SimpleNamespace(x=x, y=y1 + (y2 - y1) * step // steps))
+        pump(app, pause)
+    app.on_release(SimpleNamespace(x=x, y=y2))
+
+
+def script(app, rounds):
+    """Drive the wheel through slow drags, fast flings and settles."""
+    pump(app, 0.2)
+    # Let midimenukb finish streaming the folder listing in
+    while getattr(app, "loader", None) is not None:
+        pump(app, 0.01)
+    x = app.canvas.winfo_width() // 3
+    height = app.canvas.winfo_height()
+
+    for i in range(rounds):
+        direction = 1 if i % 4 == 3 else -1
+        # Slow drag over most of the canvas
+        drag(app, x, height // 2, height // 2 + direction * height // 3, 30, 0.004)
+        settle(app)
+        # Fling: a short, fast drag released mid-motion
+        drag(app, x, height // 2, height // 2 + direction * height // 2, 4, 0.0)
+        settle(app)
+
+
+def run_child(variant, folder, rounds, data_directory):
+    from tools.framestats import FrameStats
+
+    stats = FrameStats(size=100000)
+    os.chdir(ROOT)
+
+    if variant == LEGACY_VARIANT:
+        # midimenu.py browses the current directory and has no instrumentation
+        os.chdir(folder)
+        sys.path.insert(0, ROOT)
+        import midimenu
+        logging.getLogger().setLevel(logging.WARNING)
+        app = midimenu.FileSelector()
+        update_canvas = app.update_canvas
+
+        def timed_update_canvas():
+            start = time.perf_counter()
+            update_canvas()
+            stats.record_frame(start, time.perf_counter() - start)
+
+        app.update_canvas = timed_update_canvas
+    else:
+        import midimenukb
+        logging.getLogger().setLevel(logging.WARNING)
+        # Home, the usage log and the bookmarks go to the benchmark's temporary folder, not the working tree
+        app = midimenukb.FileSelector(renderer=variant, start_path=folder, stats=stats, data_directory=data_directory)
+
+    script(app, rounds)
+    app.destroy()
+
+    summary = stats.summary()["draw_ms"]
+    return {
+        "frames": stats.frames,
+        "p50": summary[50],
+        "p95": summary[95],
+        "p99": summary[99],
+        "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def start_xvfb(display):
+    if shutil.which("Xvfb") is None:
+        raise RuntimeError("Xvfb not found, install it or run with a DISPLAY.")
+
+    proc = subprocess.Popen(["Xvfb", display, "-screen", "0", "480x640x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0)
+    if proc.poll() is not None:
+        raise RuntimeError("Xvfb failed to start on display %s." % display)
+
+    os.environ["DISPLAY"] = display
+    return proc
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    padd = parser.add_argument
+    padd("--sizes", default=DEFAULT_SIZES,
+         help="Comma-separated entry counts of the synthetic folders (default: %(default)s)")
+    padd("-f", "--folder", action="append", default=[], help="Also benchmark this existing folder, may be repeated")
+    padd("-r", "--variant", action="append", help="Variant to benchmark, may be repeated (default: all available)")
+    padd("-n", "--rounds", type=int, default=5, help="Drag/fling rounds per run (default: %(default)s)")
+    padd("--xvfb", action="store_true", help="Start a virtual X server even if DISPLAY is set")
+    padd("--display", default=":99", help="Display for the virtual X server (default: %(default)s)")
+    padd("--fail-p95", type=float, metavar="MS", help="Exit with status 1 if any p95 frame time exceeds MS")
+    padd("--json", action="store_true", help="Print results as JSON")
+    padd("--child", nargs=3, metavar=("VARIANT", "FOLDER", "DATA"), help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+
+    if args.child:
+        variant, folder, data_directory = args.child
+        print(json.dumps(run_child(variant, folder, args.rounds, data_directory)))
+        return 0
+
+    xvfb = None
+    if args.xvfb or not os.environ.get("DISPLAY"):
+        xvfb = start_xvfb(args.display)
+
+    tmpdir = tempfile.mkdtemp(prefix="bench-wheel-")
+    results = []
+    try:
+        data_directory = os.path.join(tmpdir, "data")
+        folders = [make_folder(tmpdir, int(size)) for size in args.sizes.split(",") if size]
+        folders += [os.path.abspath(folder) for folder in args.folder]
+
+        for variant in args.variant or available_variants():
+            for folder in folders:
+                proc = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--rounds", str(args.rounds),
+                     "--child", variant, folder, data_directory],
+                    cwd=ROOT, capture_output=True, text=True)
+
+                if proc.returncode != 0:
+                    print("%s on %s failed:\n%s" % (variant, folder, proc.stderr), file=sys.stderr)
+                    continue
+
+                result = json.loads(proc.stdout.strip().splitlines()[-1])
+                result.update(variant=variant, folder=folder, entries=len(os.listdir(folder)))
+                results.append(result)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        if xvfb:
+            xvfb.terminate()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("%-14s %8s %7s %9s %9s %9s %10s" % ("variant", "entries", "frames", "p50 ms", "p95 ms", "p99 ms", "maxrss MB"))
+        for r in results:
+            print("%-14s %8i %7i %9.2f %9.2f %9.2f %10.1f" % (
+                r["variant"], r["entries"], r["frames"], r["p50"] or 0, r["p95"] or 0, r["p99"] or 0, r["maxrss_mb"]))
+
+    if args.fail_p95 is not None and any((r["p95"] or 0) > args.fail_p95 for r in results):
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -1,28 +1,407 @@
+import time
+STARTED = time.perf_counter()  # --profile-startup counts the imports below too
+
 import os
+import re
+import math
+import atexit
+import argparse
 import logging
 import platform
+import shlex
 import subprocess
-import shutil
 import tkinter as tk
+from bisect import bisect_right
 from PIL import ImageTk, Image
 from tkinter import messagebox
 from ttkbootstrap import Style
-from ttkbootstrap.widgets import Frame, Combobox, Button, Label
+from ttkbootstrap.widgets import Frame, Combobox, Button, Label, Progressbar
+
+from tools.batchops import BatchJob
+from tools.bookmarks import BookmarkListing, BookmarkResolver, BookmarkStore
+from tools.framestats import FrameStats, PhaseTimer
+from tools import daemon, session, voicepack
+from tools.ports import PortRegistry, port_identity
+from tools.request_patch import EXIT_PATCH_EXISTS
+from tools.listing import IS_DIR, SORT_ORDERS, Listing, ListingCache, ListingLoader, ListingView, PathListing, create_watcher
+from tools.sprites import SpriteCache, SpriteWarmer, render_label
+from tools.thumbnails import ThumbnailCache
+from tools.usagelog import UsageLog
+
+skia = None
+
+
+def import_skia():
+    """Import skia-python on first use, it is slow to import and only the skia renderer needs it."""
+    global skia
+    if skia is None:
+        try:
+            import skia as module
+        except ImportError:
+            return None
+        skia = module
+    return skia
 
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 
+# Soundmondo file names start with a zero-padded voice ID, e.g. DX-00098699-...
+SOUNDMONDO_ID_RX = re.compile(r"DX-(\d{4,})")
+
+
+def jump_key(name):
+    """Return the fast-scroll rail bucket a file name belongs to.
+
+    Soundmondo voices are bucketed per thousand IDs, everything else by its
+    first character.
+    """
+    match = SOUNDMONDO_ID_RX.match(name)
+    if match:
+        return "DX-" + match.group(1)[:-3]
+
+    first = name[:1].upper()
+    return first if first.isalnum() else "#"
+
+
+class CanvasRenderer:
+    """Draw the wheel as Tk canvas items, rebuilding them on every frame."""
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.icons = {}
+        self.photos = SpriteCache(2 * 1024 * 1024)
+
+    def begin(self, width, height):
+        self.canvas.delete("all")
+
+    def line(self, x1, y1, x2, y2, color):
+        self.canvas.create_line(x1, y1, x2, y2, fill=color)
+
+    def rect(self, x1, y1, x2, y2, fill, outline=""):
+        self.canvas.create_rectangle(x1, y1, x2, y2, fill=fill, outline=outline)
+
+    def text(self, x, y, text, color, size, bold=False):
+        font = ("Helvetica", size, "bold" if bold else "normal")
+        self.canvas.create_text(x, y, text=text, fill=color, font=font)
+
+    def icon(self, x, y, path):
+        self.canvas.create_image(x, y, image=self.load_icon(path))
+
+    def image(self, x, y, key, image):
+        """Draw a PIL image that is identified by key, e.g. a thumbnail."""
+        self.canvas.create_image(x, y, image=self.photo(key, image))
+
+    def load_icon(self, path):
+        if path not in self.icons:
+            self.icons[path] = tk.PhotoImage(file=path)
+        return self.icons[path]
+
+    def photo(self, key, image):
+        photo = self.photos.get(key)
+        if photo is None:
+            photo = ImageTk.PhotoImage(image)
+            self.photos.put(key, photo, image.width * image.height * 4)
+        return photo
+
+    def prefetch(self, texts, sizes, color):
+        pass
+
+    def present(self):
+        pass
+
+
+class SpriteRenderer(CanvasRenderer):
+    """Draw the wheel by moving pooled canvas items showing cached label images.
+
+    Every (text, size, weight, colour) label is rasterised once with PIL and
+    kept in a memory-bounded LRU cache, so scrolling only moves and swaps
+    existing canvas items. Labels of rows about to scroll into view are
+    rasterised ahead of time on a background thread.
+    """
+
+    def __init__(self, canvas, max_bytes=8 * 1024 * 1024):
+        super().__init__(canvas)
+        self.cache = SpriteCache(max_bytes)
+        self.warmer = SpriteWarmer()
+        self.warmer.start()
+        self.pending = set()
+        self.pools = {"line": [], "rect": [], "image": []}
+        self.used = dict.fromkeys(self.pools, 0)
+        self.shown = dict.fromkeys(self.pools, 0)
+        self.stack = []
+        self.frame_photos = []
+        self.pool_grew = False
+        self.colors = {}
+        self.point_scale = canvas.winfo_fpixels("1p")
+
+    def begin(self, width, height):
+        self.used = dict.fromkeys(self.pools, 0)
+        self.stack = []
+        self.frame_photos = []
+        self.pool_grew = False
+
+        for key, image in self.warmer.finished():
+            self.pending.discard(key)
+            if key not in self.cache:
+                self.store(key, image)
+
+    def item(self, kind, create):
+        pool = self.pools[kind]
+        index = self.used[kind]
+        self.used[kind] += 1
+
+        if index == len(pool):
+            pool.append(create())
+            self.pool_grew = True
+
+        self.stack.append(pool[index])
+        return pool[index]
+
+    def line(self, x1, y1, x2, y2, color):
+        item = self.item("line", lambda: self.canvas.create_line(0, 0, 0, 0))
+        self.canvas.coords(item, x1, y1, x2, y2)
+        self.canvas.itemconfigure(item, fill=color, state="normal")
+
+    def rect(self, x1, y1, x2, y2, fill, outline=""):
+        item = self.item("rect", lambda: self.canvas.create_rectangle(0, 0, 0, 0))
+        self.canvas.coords(item, x1, y1, x2, y2)
+        self.canvas.itemconfigure(item, fill=fill, outline=outline, state="normal")
+
+    def text(self, x, y, text, color, size, bold=False):
+        photo = self.sprite(text, size, bold, color)
+        # Keep this frame's images alive even if the cache evicts them meanwhile
+        self.frame_photos.append(photo)
+        item = self.item("image", lambda: self.canvas.create_image(0, 0))
+        self.canvas.coords(item, x, y)
+        self.canvas.itemconfigure(item, image=photo, state="normal")
+
+    def icon(self, x, y, path):
+        item = self.item("image", lambda: self.canvas.create_image(0, 0))
+        self.canvas.coords(item, x, y)
+        self.canvas.itemconfigure(item, image=self.load_icon(path), state="normal")
+
+    def image(self, x, y, key, image):
+        photo = self.photo(key, image)
+        self.frame_photos.append(photo)
+        item = self.item("image", lambda: self.canvas.create_image(0, 0))
+        self.canvas.coords(item, x, y)
+        self.canvas.itemconfigure(item, image=photo, state="normal")
+
+    def prefetch(self, texts, sizes, color):
+        rgb = self.color(color)
+        for text in texts:
+            for size in sizes:
+                key = (text, size, False, color)
+                if key not in self.cache and key not in self.pending:
+                    self.pending.add(key)
+                    self.warmer.requests.put((key, text, self.pixels(size), False, rgb))
+
+    def present(self):
+        for kind, pool in self.pools.items():
+            for item in pool[self.used[kind]:self.shown[kind]]:
+                self.canvas.itemconfigure(item, state="hidden")
+        self.shown = self.used
+
+        # New items are created on top, restore the drawing order once
+        if self.pool_grew:
+            for item in self.stack:
+                self.canvas.tag_raise(item)
+
+    def sprite(self, text, size, bold, color):
+        key = (text, size, bold, color)
+        photo = self.cache.get(key)
+        if photo is None:
+            photo = self.store(key, render_label(text, self.pixels(size), bold, self.color(color)))
+        return photo
+
+    def store(self, key, image):
+        photo = ImageTk.PhotoImage(image)
+        self.cache.put(key, photo, image.width * image.height * 4)
+        return photo
+
+    def pixels(self, size):
+        return max(1, round(size * self.point_scale))
+
+    def color(self, name):
+        if name not in self.colors:
+            self.colors[name] = tuple(value >> 8 for value in self.canvas.winfo_rgb(name))
+        return self.colors[name]
+
+
+class SkiaRenderer:
+    """Draw the wheel offscreen with Skia and blit it into a single PhotoImage.
+
+    The surface and the PhotoImage are reused between frames. Drawing calls
+    are only recorded until present(), which compares them per horizontal
+    band with the previous frame and repaints and blits just the bands that
+    changed.
+    """
+
+    band_height = 8
+
+    def __init__(self, canvas):
+        if import_skia() is None:
+            raise RuntimeError("The skia renderer requires the skia-python package.")
+
+        self.canvas = canvas
+        self.size = (0, 0)
+        self.surface = None
+        self.photo = None
+        self.image_item = None
+        self.ops = []
+        self.last_bands = {}
+        self.colors = {}
+        self.typefaces = {}
+        self.icons = {}
+        self.images = SpriteCache(2 * 1024 * 1024)
+        self.point_scale = canvas.winfo_fpixels("1p")
+
+    def prefetch(self, texts, sizes, color):
+        pass
+
+    def begin(self, width, height):
+        width, height = max(1, width), max(1, height)
+        if (width, height) != self.size:
+            self.size = (width, height)
+            self.surface = skia.Surface(width, height)
+            self.photo = tk.PhotoImage(width=width, height=height)
+            self.canvas.delete("all")
+            self.image_item = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+            self.last_bands = {}
+
+        self.ops = []
+
+    def line(self, x1, y1, x2, y2, color):
+        self.ops.append((min(y1, y2) - 1, max(y1, y2) + 1, ("line", x1, y1, x2, y2, color)))
+
+    def rect(self, x1, y1, x2, y2, fill, outline=""):
+        self.ops.append((y1 - 1, y2 + 1, ("rect", x1, y1, x2, y2, fill, outline)))
+
+    def text(self, x, y, text, color, size, bold=False):
+        pixels = size * self.point_scale
+        self.ops.append((y - pixels, y + pixels, ("text", x, y, text, color, size, bold)))
+
+    def icon(self, x, y, path):
+        half_height = self.load_icon(path).height() / 2
+        self.ops.append((y - half_height, y + half_height, ("icon", x, y, path)))
+
+    def image(self, x, y, key, image):
+        if key not in self.images:
+            self.images.put(key, skia.Image.frombytes(image.convert("RGBA").tobytes(), image.size, skia.kRGBA_8888_ColorType),
+                            image.width * image.height * 4)
+        self.ops.append((y - image.height / 2, y + image.height / 2, ("image", x, y, key)))
+
+    def present(self):
+        bands = {}
+        for top, bottom, op in self.ops:
+            for band in range(int(top) // self.band_height, int(bottom) // self.band_height + 1):
+                bands.setdefault(band, []).append(op)
+
+        dirty = sorted(band for band in bands.keys() | self.last_bands.keys()
+                       if bands.get(band) != self.last_bands.get(band))
+        self.last_bands = bands
+
+        # Merge neighbouring dirty bands into spans so each is blitted once
+        spans = []
+        for band in dirty:
+            if spans and spans[-1][1] == band:
+                spans[-1][1] = band + 1
+            else:
+                spans.append([band, band + 1])
+
+        # Keep the original drawing order, later calls paint over earlier ones
+        order = {op: index for index, (_, _, op) in enumerate(self.ops)}
+
+        for first, last in spans:
+            y1 = max(0, first * self.band_height)
+            y2 = min(self.size[1], last * self.band_height)
+            if y1 < y2:
+                ops = {op for band in range(first, last) for op in bands.get(band, ())}
+                self.paint_span(y1, y2, sorted(ops, key=order.get))
+
+    def paint_span(self, y1, y2, ops):
+        width = self.size[0]
+        canvas = self.surface.getCanvas()
+        canvas.save()
+        canvas.clipRect(skia.Rect.MakeLTRB(0, y1, width, y2))
+        canvas.clear(skia.ColorBLACK)
+
+        for op in ops:
+            getattr(self, "paint_" + op[0])(canvas, *op[1:])
+
+        canvas.restore()
+
+        snapshot = self.surface.makeImageSnapshot(skia.IRect.MakeLTRB(0, y1, width, y2))
+        band = Image.frombytes("RGBA", (width, y2 - y1), snapshot.tobytes()).convert("RGB")
+        header = f"P6 {width} {y2 - y1} 255\n".encode("ascii")
+        self.photo.put(header + band.tobytes(), to=(0, y1))
+
+    def paint_line(self, canvas, x1, y1, x2, y2, color):
+        canvas.drawLine(x1, y1, x2, y2, skia.Paint(AntiAlias=True, Color=self.color(color)))
+
+    def paint_rect(self, canvas, x1, y1, x2, y2, fill, outline):
+        rect = skia.Rect.MakeLTRB(x1, y1, x2, y2)
+        if fill:
+            canvas.drawRect(rect, skia.Paint(Color=self.color(fill)))
+        if outline:
+            canvas.drawRect(rect, skia.Paint(Color=self.color(outline), Style=skia.Paint.kStroke_Style))
+
+    def paint_icon(self, canvas, x, y, path):
+        image = self.load_icon(path)
+        canvas.drawImage(image, x - image.width() / 2, y - image.height() / 2)
+
+    def paint_image(self, canvas, x, y, key):
+        image = self.images.get(key)
+        if image is not None:
+            canvas.drawImage(image, x - image.width() / 2, y - image.height() / 2)
+
+    def paint_text(self, canvas, x, y, text, color, size, bold):
+        font = skia.Font(self.typeface(bold), size * self.point_scale)
+        metrics = font.getMetrics()
+        baseline = y - (metrics.fAscent + metrics.fDescent) / 2
+        canvas.drawString(text, x - font.measureText(text) / 2, baseline, font,
+                          skia.Paint(AntiAlias=True, Color=self.color(color)))
+
+    def load_icon(self, path):
+        if path not in self.icons:
+            self.icons[path] = skia.Image.open(path)
+        return self.icons[path]
+
+    def color(self, name):
+        if name not in self.colors:
+            r, g, b = (value >> 8 for value in self.canvas.winfo_rgb(name))
+            self.colors[name] = skia.Color(r, g, b)
+        return self.colors[name]
+
+    def typeface(self, bold):
+        if bold not in self.typefaces:
+            style = skia.FontStyle.Bold() if bold else skia.FontStyle.Normal()
+            self.typefaces[bold] = skia.Typeface("Helvetica", style)
+        return self.typefaces[bold]
+
+
+RENDERERS = {
+    "canvas": CanvasRenderer,
+    "skia": SkiaRenderer,
+    "sprites": SpriteRenderer,
+}
+
 
 class FileSelector(tk.Tk):
-    def __init__(self):
+    def __init__(self, renderer="canvas", start_path=None, stats=None, thumbnails=False, session_file=None,
+                 profile=None, data_directory=None):
+        self.profile = profile       # Optional PhaseTimer timing the startup
         super().__init__()
 
         self.style = Style('solar')
+        self.profile_phase("tk and style")
         self.title("File Selector")
         self.root_directory = os.path.dirname(os.path.abspath(__file__))
+        # Home, the usage log, bookmarks and caches live here, next to the tools by default
+        self.data_directory = data_directory or self.root_directory
 
-        self.home_folder = os.path.join(self.root_directory, "Home")
+        self.home_folder = os.path.join(self.data_directory, "Home")
         self.bookmarks_folder = os.path.join(self.home_folder, "Bookmarks")
 
         os.makedirs(self.bookmarks_folder, exist_ok=True)
@@ -31,6 +410,25 @@ class FileSelector(tk.Tk):
 
         os.makedirs(self.downloads_folder, exist_ok=True)
 
+        # Virtual folders listing the files recorded in the usage log, shown in Home without a directory
+        self.recent_folder = os.path.join(self.home_folder, "Recent")
+        self.most_played_folder = os.path.join(self.home_folder, "Most played")
+        self.virtual_folder_size = 50
+        self.virtual_folders = {
+            self.recent_folder: lambda: self.usage.recent(self.virtual_folder_size),
+            self.most_played_folder: lambda: self.usage.most_played(self.virtual_folder_size),
+        }
+
+        self.usage = UsageLog(os.path.join(self.data_directory, "midipi-usage.log")).load()
+        atexit.register(self.usage.close)
+
+        # Bookmarks are references kept in a database, the Bookmarks folder is listed from it
+        self.bookmarks = BookmarkStore(os.path.join(self.data_directory, "midipi-bookmarks.db"))
+        if not self.bookmarks.imported:
+            self.bookmarks.import_tree(self.bookmarks_folder)
+        atexit.register(self.bookmarks.close)
+        self.profile_phase("usage log and bookmarks")
+
         self.attributes('-fullscreen', True)
         self.bind("&lt;Escape&gt;", self.toggle_fullscreen)
 
@@ -39,17 +437,18 @@ class FileSelector(tk.Tk):
 
         self.config(cursor="none")
 
-        self.midi_devices = self.list_midi_devices()
+        # MIDI ports are enumerated in the background once the first frame is shown
+        self.ports = None
+        self.midi_devices = []
+        self.preferred_midi_device = None  # Device of the last session
+        self.selected_midi_device = tk.StringVar(value="No MIDI Device")
 
-        # Select the default MIDI device that starts with "reface"
-        default_midi_device = next((device for device in self.midi_devices if device.lower().startswith("reface")), None)
-
-        # Set the selected MIDI device to the default "reface" device, or the first device if no such device is found
-        self.selected_midi_device = tk.StringVar(value=default_midi_device if default_midi_device else (self.midi_devices[0] if self.midi_devices else "No MIDI Device"))
-
-        self.current_path = self.home_folder
-        self.file_names = []         # Array to store file names
-        self.file_paths = []         # Array to store full file paths
+        self.current_path = start_path or self.home_folder
+        self.sort_order = "natural"
+        self.last_played = self.usage.last_played  # Path -> time the file was last sent
+        self.listing = Listing(None) # Entries shown in the wheel
+        self.view = ListingView(self.listing, self.sort_order, self.last_played)
+        self.file_names = self.view.names
 
         self.selected_index = 0
         self.canvas_size = (self.winfo_width(), self.winfo_height())
@@ -57,12 +456,32 @@ class FileSelector(tk.Tk):
         self.max_font_size = 20
         self.offset_y = 0
         self.item_height = 45
+        self.prefetch_rows = 10
+        self.folder_icon = "res/drawable-mdpi/ic_folder.png"
+        self.folder_icon_min_font_size = 10
+
+        # Optional algorithm and envelope glyphs of the voices next to their names
+        self.thumbnails = ThumbnailCache(os.path.join(self.data_directory, "cache", "thumbnails")) if thumbnails else None
+        self.thumbnail_poll = None
+
+        self.rail_width = 36
+        self.jump_indices = []       # Index of the first item of each rail bucket
+        self.jump_labels = []        # Prefix shown in the bubble for each bucket
+        self.is_rail_active = False
 
         self.selection_color = "red"
         self.active_color = "green"
         self.default_color = "black"
         self.clicked_index = -1
 
+        self.marked = set()          # Paths marked for a batch operation
+        self.marked_color = "orange"
+        self.long_press_ms = 600
+        self.long_press_job = None
+        self.long_pressed = False
+        self.batch_job = None        # BatchJob still running
+        self.bookmark_search = None  # BookmarkResolver looking for a moved bookmarked file
+
         self.configure(bg="black")
 
         self.control_frame = Frame(self, bootstyle="default")
@@ -84,9 +503,6 @@ class FileSelector(tk.Tk):
         )
         self.midi_dropdown.pack(side=tk.LEFT, padx=(5, 5), pady=5)
 
-        # Bind the event to update MIDI devices when the dropdown is clicked
-        self.midi_dropdown.bind("&lt;Button-1&gt;", self.update_midi_devices_list)
-
         self.path_label = Label(
             self.control_frame,
             text=self.current_path,
@@ -96,33 +512,24 @@ class FileSelector(tk.Tk):
         )
         self.path_label.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(3, 0), pady=0)
 
+        # Tapping the folder name cycles through the sort orders
+        self.path_label.bind("<Button-1>", self.cycle_sort_order)
+
         self.button_frame = Frame(self, bootstyle="default")
         self.button_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=False)
 
-        self.parent_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_undo.png"))
-        self.home_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_home.png"))
-        self.bookmarks_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_bookmarks.png"))
-        self.bookmark_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_grade.png"))
-        self.new_folder_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_create_new_folder.png"))
-        self.delete_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_delete.png"))
-        self.patch_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_save.png"))
-        self.downloads_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_get_app.png"))
-        self.edit_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_edit.png"))
-
-        # Search icon for the search button
-        self.search_icon = ImageTk.PhotoImage(Image.open("res/drawable-mdpi/ic_search.png"))
-
+        # The icons are decoded after the first frame, see load_button_icons()
         buttons = [
-            (self.parent_icon, "Parent", self.go_to_parent_folder),
-            (self.home_icon, "Home", self.go_to_home_folder),
-            (self.bookmarks_icon, "Bookmarks", self.go_to_bookmarks),
-            (self.bookmark_icon, "Add Bookmark", self.add_to_bookmarks),
-            (self.new_folder_icon, "New Folder", self.create_new_folder),
-            (self.delete_icon, "Delete", self.delete_selected_item),
-            (self.patch_icon, "Request Patch", self.request_patch),
-            (self.downloads_icon, "Saved Patches", self.go_to_downloads),
-            (self.edit_icon, "Rename", self.rename),
-            (self.search_icon, "Search", self.search_files)
+            ("ic_undo.png", "Parent", self.go_to_parent_folder),
+            ("ic_home.png", "Home", self.go_to_home_folder),
+            ("ic_bookmarks.png", "Bookmarks", self.go_to_bookmarks),
+            ("ic_grade.png", "Add Bookmark", self.add_to_bookmarks),
+            ("ic_create_new_folder.png", "New Folder", self.create_new_folder),
+            ("ic_delete.png", "Delete", self.delete_selected_item),
+            ("ic_save.png", "Request Patch", self.request_patch),
+            ("ic_get_app.png", "Saved Patches", self.go_to_downloads),
+            ("ic_edit.png", "Rename", self.rename),
+            ("ic_search.png", "Search", self.search_files)
         ]
 
         self.style.configure(
@@ -130,6 +537,7 @@ class FileSelector(tk.Tk):
             font=('Courier bold', 10)
         )
 
+        self.toolbar_buttons = []
         for i in range(2):
             for j in range(5):
                 icon, text, command = buttons[i * 5 + j]
@@ -137,19 +545,25 @@ class FileSelector(tk.Tk):
                     self.button_frame,
                     text=text,
                     compound="top",
-                    image=icon,
                     command=command,
                     bootstyle="info-outline-button"
                 )
                 button.grid(row=i, column=j, padx=2, pady=2, ipady=0, ipadx=0, sticky="nsew")
+                self.toolbar_buttons.append((button, "res/drawable-mdpi/" + icon))
+        self.toolbar_icons = []
 
         for i in range(2):
             self.button_frame.grid_rowconfigure(i, weight=1)
         for j in range(5):
             self.button_frame.grid_columnconfigure(j, weight=1, minsize=90)
 
-        self.canvas = tk.Canvas(self, bg="black", cursor="none")
+        # Shown while items are marked, built the first time it is needed
+        self.batch_frame = None
+        self.profile_phase("toolbar")
+
+        self.canvas = tk.Canvas(self, bg="black", cursor="none", highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.renderer = RENDERERS[renderer](self.canvas)
 
         self.bind("<MouseWheel>", self.on_mouse_wheel)
         self.canvas.bind("<Button-1>", self.on_click)
@@ -162,6 +576,13 @@ class FileSelector(tk.Tk):
         self.bind("<BackSpace>", self.go_to_parent_folder)
         self.bind("<Configure>", self.on_resize)
 
+        self.stats = stats           # Optional FrameStats collecting frame timings
+        self.show_stats = False
+        self.coalesced_events = 0
+        self.redraw_pending = None
+        self.tap_started = None
+        self.bind("<F2>", self.toggle_stats_overlay)
+
         self.is_dragging = False
         self.is_animating = False
         self.start_y = 0
@@ -171,29 +592,98 @@ class FileSelector(tk.Tk):
 
         self.search_results = []  # To store search results
 
-        self.update_file_list()  # Initial population
-
-    def update_midi_devices_list(self, event):
-        """Update the MIDI devices list just before showing the dropdown."""
-        new_midi_devices = self.list_midi_devices()
-        if new_midi_devices:
-            self.midi_devices = new_midi_devices
-            self.midi_dropdown['values'] = self.midi_devices
-
-            current_selection = self.selected_midi_device.get()
-            if current_selection not in self.midi_devices:
-                # Auto-select the first available device if the current selection is no longer valid
-                self.selected_midi_device.set(self.midi_devices[0])
-
-        logging.debug(f"Updated MIDI devices list: {self.midi_devices}")
+        # Listings of visited folders stay cached and are kept fresh by the watcher
+        self.watcher = create_watcher()
+        self.listing_cache = ListingCache(on_evict=self.watcher.unwatch)
+        self.loader = None           # ListingLoader of a folder still being scanned
+        self.watcher.start()
+        self.after(250, self.poll_directory_changes)
+
+        # The view is saved when it changes and restored at the next start
+        self.session_file = session_file
+        self.session_save = None
+        self.session_listing_changed = False
+        self.session_state = {}
+        self.selected_midi_device.trace_add("write", lambda *args: self.schedule_session_save())
+        atexit.register(self.save_session)
+
+        self.profile_phase("canvas and watcher")
+
+        if start_path or not self.restore_session():
+            self.update_file_list()  # Initial population
+        self.profile_phase("listing")
+
+        self.after_idle(self.on_first_frame)
+
+    def profile_phase(self, name):
+        if self.profile is not None:
+            self.profile.mark(name)
+
+    def on_first_frame(self):
+        """Finish starting up once the window and the wheel are shown."""
+        if self.profile is not None:
+            self.update_idletasks()
+            self.profile_phase("first frame")
+            print(f"Startup phases:\n{self.profile.format()}", flush=True)
+
+        self.load_button_icons()
+        self.start_midi_scan()
+
+    def load_button_icons(self):
+        for button, path in self.toolbar_buttons:
+            try:
+                icon = tk.PhotoImage(file=path)
+            except tk.TclError as e:
+                logging.error(f"Could not load icon {path}: {e}")
+                continue
+            self.toolbar_icons.append(icon)
+            button.config(image=icon)
+
+        if self.profile is not None:
+            print(f"toolbar icons shown after {self.profile.elapsed() * 1000:.1f} ms", flush=True)
+
+    def start_midi_scan(self):
+        """Start the port registry, which lists the MIDI ports on a background thread."""
+        self.ports = PortRegistry()
+        self.ports.start()
+        self.after(50, self.poll_midi_ports)
+
+    def poll_midi_ports(self):
+        devices = None
+        for devices in self.ports.changed():
+            pass
+
+        if devices is not None:
+            if self.profile is not None and not self.midi_devices:
+                print(f"MIDI devices listed after {self.profile.elapsed() * 1000:.1f} ms", flush=True)
+            logging.debug(f"MIDI devices: {devices}")
+            self.set_midi_devices(devices)
+        self.after(250, self.poll_midi_ports)
+
+    def set_midi_devices(self, devices):
+        current = self.selected_midi_device.get()
+        if current in self.midi_devices and current not in devices:
+            # Switch back to the device when it is plugged in again
+            self.preferred_midi_device = current
+
+        self.midi_devices = devices
+        self.midi_dropdown['values'] = devices
+        if current in devices:
+            return
 
-    def list_midi_devices(self):
-        try:
-            import mido
-            return mido.get_input_names()
-        except Exception as e:
-            logging.error("Could not list MIDI devices: " + str(e))
-            return []
+        # Prefer the device of the last session, then one whose name starts with "reface", then the first one
+        preferred = self.preferred_midi_device and port_identity(self.preferred_midi_device)
+        default = next((device for device in devices if device.lower().startswith("reface")), None)
+        if preferred in devices:
+            default = preferred
+        self.selected_midi_device.set(default or (devices[0] if devices else "No MIDI Device"))
+
+    def midi_port_names(self):
+        """Return the current (input, output) port names of the selected MIDI device."""
+        if self.ports is None:
+            return None, None
+        midi_device = self.selected_midi_device.get()
+        return self.ports.input_name(midi_device), self.ports.output_name(midi_device)
 
     def search_files(self):
         """Prompt for a search query and display matching files."""
@@ -209,9 +699,9 @@ class FileSelector(tk.Tk):
                     matches.append(os.path.join(root, file))
 
         if matches:
-            self.populate_files(matches)
+            self.populate_files(PathListing(matches))
             self.update_canvas()
-            self.path_label.config(text="Search Results")
+            self.update_path_label()
             messagebox.showinfo("Search Results", f"Found {len(matches)} matching files.")
         else:
             self.search_results = []
@@ -219,19 +709,35 @@ class FileSelector(tk.Tk):
 
     def rename(self):
         """Rename the selected file, folder, or link."""
-        if 0 <= self.selected_index < len(self.file_paths):
+        if 0 <= self.selected_index < len(self.file_names):
             selected_file_name = self.file_names[self.selected_index]
-            selected_file_path = self.file_paths[self.selected_index]
+            selected_file_path = self.view.path_of(self.selected_index)
+
+            if selected_file_path in self.virtual_folders:
+                messagebox.showinfo("Virtual Folder", f"'{selected_file_name}' is listed from the usage log and cannot be renamed.")
+                return
+            if isinstance(self.listing, BookmarkListing) and not self.is_bookmark_folder(selected_file_path):
+                # Deleting a bookmark only removes the reference, so renaming must not touch the file either
+                messagebox.showinfo("Bookmark", f"'{selected_file_name}' is a bookmark. Rename it in its own folder.")
+                return
 
             # Ask for the new name
             new_name = self.create_dialog("Rename Item", f"Enter a new name for '{selected_file_name}':")
 
-            if new_name:
+            if new_name and self.is_bookmark_folder(selected_file_path):
+                self.bookmarks.rename_folder(selected_file_name, new_name)
+                logging.info(f"Renamed bookmark folder '{selected_file_name}' to '{new_name}'")
+                self.update_file_list()
+            elif new_name:
                 new_file_path = os.path.join(os.path.dirname(selected_file_path), new_name)
                 try:
                     os.rename(selected_file_path, new_file_path)
                     logging.info(f"Renamed '{selected_file_name}' to '{new_name}'")
-                    self.update_file_list()  # Update the file list
+                    self.bookmarks.moved(selected_file_path, new_file_path)
+                    self.apply_listing_change(os.path.dirname(selected_file_path), removed=[selected_file_name])
+                    self.apply_listing_change(os.path.dirname(new_file_path), added=[os.path.basename(new_file_path)])
+                    if self.listing.path is None:
+                        self.update_file_list()  # Leave the search results
                 except Exception as e:
                     logging.error(f"Failed to rename '{selected_file_name}': {e}")
                     messagebox.showerror("Error", f"Could not rename '{selected_file_name}': {e}")
@@ -249,6 +755,13 @@ class FileSelector(tk.Tk):
             logging.info(f"Navigating to parent folder: {self.current_path}")
             self.update_file_list()
 
+    def is_bookmark_folder(self, path):
+        """Return whether path is the Bookmarks folder or one of the bookmark folders in it."""
+        if path == self.bookmarks_folder:
+            return True
+        # Bookmarked files may lie in the Bookmarks folder too, where they were imported from
+        return os.path.dirname(path) == self.bookmarks_folder and os.path.basename(path) in self.bookmarks.folders()
+
     def go_to_bookmarks(self):
         self.current_path = self.bookmarks_folder
         self.selected_file = 0
@@ -273,26 +786,228 @@ class FileSelector(tk.Tk):
     def update_file_list(self):
         # Restore files to display initial directory files instead of search results
         try:
-            self.populate_files(list(map(lambda x: os.path.join(self.current_path, x), sorted(os.listdir(self.current_path)))))
+            if self.current_path in self.virtual_folders:
+                listing = self.virtual_listing(self.current_path)
+            elif self.is_bookmark_folder(self.current_path):
+                folder = "" if self.current_path == self.bookmarks_folder else os.path.basename(self.current_path)
+                listing = self.bookmarks.listing(folder, self.bookmarks_folder)
+            elif voicepack.split_pack_path(self.current_path):
+                listing = voicepack.pack_listing(self.current_path)
+            else:
+                listing = self.listing_cache.get(self.current_path)
+            if listing is None:
+                listing = self.start_loading(self.current_path)
+            self.populate_files(listing)
             self.update_path_label()
             self.update_canvas()
-            logging.debug(f"Updated files list: {self.file_names}")
+            self.schedule_session_save(listing_changed=True)
+            logging.debug(f"Updated files list: {len(self.file_names)} entries")
         except Exception as e:
             logging.error(f"Failed to list files in {self.current_path}: {e}")
 
-    def update_path_label(self):
-        self.path_label.config(text=os.path.basename(self.current_path))
+    def virtual_listing(self, path):
+        paths = [p for p in self.virtual_folders[path]() if voicepack.exists(p)]
+        return PathListing(paths, title=os.path.basename(path), keep_order=True)
+
+    def get_listing(self, path):
+        """Return the listing of path, scanning and watching it only if it is not cached."""
+        listing = self.listing_cache.get(path)
+        if listing is None:
+            listing = self.listing_cache.load(path)
+            self.watcher.watch(path, listing.names)
+        return listing
+
+    def start_loading(self, path):
+        """Scan path in the background and return its listing, filled in as chunks arrive."""
+        self.loader = ListingLoader(path, first_chunk=max(16, 2 * self.canvas_size[1] // self.item_height))
+        self.loader.start()
+        self.after(10, self.poll_loader)
+        return self.loader.listing
+
+    def cancel_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+
+    def poll_loader(self):
+        loader = self.loader
+        if loader is None:
+            return
+
+        selected_name = self.selected_name()
+        merged = done = False
+        for chunk in loader.ready():
+            if chunk is None:
+                done = True
+                break
+            loader.listing.merge(chunk)
+            merged = True
+
+        if done:
+            self.loader = None
+            if loader.error:
+                logging.error(f"Failed to list files in {loader.path}: {loader.error}")
+            else:
+                self.listing_cache.put(loader.path, loader.listing)
+                self.watcher.watch(loader.path, loader.listing.names)
+                logging.debug(f"Loaded {len(loader.listing)} entries of {loader.path}")
+        else:
+            self.after(15, self.poll_loader)
+
+        if merged or done:
+            self.restore_selection(selected_name)
 
-    def list_midi_devices(self):
+    def poll_directory_changes(self):
+        for path, added, removed in self.watcher.changed():
+            if added is None:
+                self.reload_listing(path)
+            else:
+                self.apply_listing_change(path, added, removed)
+
+        self.after(250, self.poll_directory_changes)
+
+    def reload_listing(self, path):
+        self.listing_cache.invalidate(path)
+        if path != self.listing.path:
+            return
+
+        selected_name = self.selected_name()
         try:
-            import mido
-            return mido.get_input_names()
-        except Exception as e:
-            logging.error("Could not list MIDI devices: " + str(e))
-            return []
+            listing = self.listing_cache.load(path)
+            self.watcher.watch(path, listing.names)
+        except OSError as e:
+            logging.error(f"Failed to list files in {path}: {e}")
+            self.current_path = os.path.dirname(path)
+            self.update_file_list()
+        else:
+            self.set_listing(listing)
+            self.restore_selection(selected_name)
+
+    def apply_listing_change(self, path, added=(), removed=()):
+        """Update the cached listing of path and, if it is shown, the wheel."""
+        selected_name = self.selected_name()
+        listing = self.listing_cache.apply(path, added, removed)
+        if listing is not None and listing is self.listing:
+            self.restore_selection(selected_name)
+
+    def selected_name(self):
+        return self.file_names[self.selected_index] if 0 <= self.selected_index < len(self.file_names) else None
+
+    def set_listing(self, listing):
+        if listing.path == self.home_folder:
+            for folder in self.virtual_folders:
+                if listing.index(os.path.basename(folder)) < 0:
+                    listing.put(os.path.basename(folder), IS_DIR, 0, 0.0)
+        self.listing = listing
+        self.view = ListingView(listing, self.sort_order, self.last_played)
+        self.file_names = self.view.names
+
+    def cycle_sort_order(self, event=None):
+        self.sort_order = SORT_ORDERS[(SORT_ORDERS.index(self.sort_order) + 1) % len(SORT_ORDERS)]
+        logging.info(f"Sorting by {self.sort_order}")
+        selected_name = self.selected_name()
+        self.view.set_order(self.sort_order)
+        self.restore_selection(selected_name, refresh=False)
+        self.update_path_label()
+
+    def restore_selection(self, selected_name, refresh=True):
+        """Redraw a changed listing of the current folder, keeping the selected item in place."""
+        if refresh:
+            self.view.refresh()
+        self.build_jump_table()
+
+        old_index = self.selected_index
+        new_index = self.view.index(selected_name) if selected_name is not None else -1
+        if new_index < 0:
+            new_index = old_index
+
+        self.selected_index = max(0, min(new_index, len(self.file_names) - 1))
+        self.offset_y += (old_index - self.selected_index) * self.item_height
+        self.target_offset_y = -self.selected_index * self.item_height
+        self.update_canvas()
+        self.schedule_session_save(listing_changed=True)
+
+    def restore_session(self):
+        """Show the view of the last session, returning False if there is none."""
+        if not self.session_file:
+            return False
+
+        state, listing, mtime = session.load(self.session_file)
+        if state is None or not (os.path.isdir(state["path"]) or state["path"] in self.virtual_folders
+                                 or voicepack.is_pack_folder(state["path"])):
+            return False
+
+        logging.info(f"Restoring the last session in {state['path']}")
+        self.session_state = state
+        self.current_path = state["path"]
+        if state.get("sort_order") in SORT_ORDERS:
+            self.sort_order = state["sort_order"]
+        self.preferred_midi_device = state.get("midi_device")
+
+        if listing is not None:
+            self.listing_cache.put(listing.path, listing)
+            self.watcher.watch(listing.path, listing.names)
+            # The folder may have changed while the browser was not running
+            self.after(500, self.revalidate_session_listing, listing, mtime)
+
+        self.update_file_list()
+        index = self.view.index(state["selected_name"]) if state.get("selected_name") else -1
+        if index < 0:
+            index = state.get("selected_index", 0)
+        self.selected_index = max(0, min(int(index), len(self.file_names) - 1))
+        self.offset_y = self.target_offset_y = -self.selected_index * self.item_height
+        self.update_canvas()
+        return True
+
+    def revalidate_session_listing(self, listing, mtime):
+        try:
+            changed = os.stat(listing.path).st_mtime != mtime
+        except OSError:
+            changed = True
+
+        if changed:
+            logging.info(f"{listing.path} changed since the last session, listing it again")
+            self.reload_listing(listing.path)
+
+    def schedule_session_save(self, listing_changed=False):
+        self.session_listing_changed |= listing_changed
+        if self.session_file and self.session_save is None:
+            self.session_save = self.after(1000, self.save_session)
+
+    def save_session(self):
+        if not self.session_file:
+            return
+
+        self.session_save = None
+        try:
+            midi_device = self.selected_midi_device.get()
+        except tk.TclError:
+            # The window is gone already when saving at exit
+            midi_device = self.session_state.get("midi_device")
+        if midi_device not in self.midi_devices and self.preferred_midi_device:
+            # The ports have not been listed yet
+            midi_device = self.preferred_midi_device
+
+        self.session_state = {
+            "path": self.current_path,
+            "selected_index": self.selected_index,
+            "selected_name": self.selected_name(),
+            "sort_order": self.sort_order,
+            "midi_device": midi_device,
+        }
+        session.save_view(self.session_file, self.session_state)
+
+        # Listings of folders still being scanned are saved once they are complete
+        if self.session_listing_changed and self.loader is None:
+            self.session_listing_changed = False
+            if self.listing.path == self.current_path:
+                session.save_listing(self.session_file, self.listing)
+
+    def update_path_label(self):
+        self.path_label.config(text=f"{self.listing.title} [{self.sort_order}]")
 
     def draw(self):
-        self.canvas.delete("all")
+        self.renderer.begin(self.canvas_size[0], self.canvas.winfo_height())
 
         center_y = self.canvas_size[1] // 2 - 150
         num_items = len(self.file_names)
@@ -300,39 +1015,166 @@ class FileSelector(tk.Tk):
         line_x1 = 0
         line_x2 = self.canvas_size[0]
 
-        self.canvas.create_line(line_x1, center_y - self.item_height // 2, line_x2, center_y - self.item_height // 2, fill="#81a2b8")
-        self.canvas.create_line(line_x1, center_y + self.item_height // 2, line_x2, center_y + self.item_height // 2, fill="#81a2b8")
+        self.renderer.line(line_x1, center_y - self.item_height // 2, line_x2, center_y - self.item_height // 2, "#81a2b8")
+        self.renderer.line(line_x1, center_y + self.item_height // 2, line_x2, center_y + self.item_height // 2, "#81a2b8")
 
         if num_items == 0:
             x = self.canvas_size[0] // 2
-            font = ("Helvetica", 14, "bold")
-            self.canvas.create_text(x, center_y, text="Empty Folder", fill="red", font=font)
+            self.renderer.text(x, center_y, "Loading..." if self.loader else "Empty Folder", "red", 14, bold=True)
 
-        for index in range(num_items):
+        first, last = self.visible_range(center_y)
+        for index in range(first, last + 1):
             x = self.canvas_size[0] // 2
             y = (index) * self.item_height + center_y + self.offset_y
 
-            if 0 <= y <= self.canvas_size[1]:
-                distance_from_center = abs(y - center_y)
-                normalized_distance = max(1, self.canvas_size[1] // 2)
-                font_size = self.base_font_size + (self.max_font_size - self.base_font_size) * (1 - min(distance_from_center / normalized_distance, 1))
-                font = ("Helvetica", int(font_size), "bold" if index == self.selected_index else "normal")
+            distance_from_center = abs(y - center_y)
+            normalized_distance = max(1, self.canvas_size[1] // 2)
+            font_size = self.base_font_size + (self.max_font_size - self.base_font_size) * (1 - min(distance_from_center / normalized_distance, 1))
+
+            if index == self.clicked_index:
+                color = self.active_color
+            elif self.marked and self.view.path_of(index) in self.marked:
+                color = self.marked_color
+            elif index == self.selected_index:
+                color = "#edf0f2"
+            else:
+                color = "#81a2b8"
+
+            self.renderer.text(x, y + 5, self.file_names[index], color, int(font_size), bold=index == self.selected_index)
+
+            if font_size < self.folder_icon_min_font_size:
+                continue
+            if self.view.is_dir(index):
+                self.renderer.icon(24, y + 5, self.folder_icon)
+            elif self.thumbnails is not None and self.file_names[index].lower().endswith(".syx"):
+                self.draw_thumbnail(index, 26, y + 5)
+
+        # Let the renderer prepare the rows just outside the canvas
+        neighbours = self.file_names[max(0, first - self.prefetch_rows):first] + self.file_names[last + 1:last + 1 + self.prefetch_rows]
+        self.renderer.prefetch(neighbours, range(self.base_font_size, self.max_font_size + 1), "#81a2b8")
+
+        self.draw_rail()
+        self.draw_stats_overlay()
+        self.renderer.present()
+
+    def draw_thumbnail(self, index, x, y):
+        thumbnail = self.thumbnails.get(self.view.path_of(index), self.view.mtime(index))
+        if thumbnail is not None:
+            self.renderer.image(x, y, *thumbnail)
+        elif self.thumbnail_poll is None:
+            self.thumbnail_poll = self.after(50, self.poll_thumbnails)
+
+    def poll_thumbnails(self):
+        self.thumbnail_poll = None
+        if self.thumbnails.collect():
+            self.update_canvas()
+        elif self.thumbnails.pending:
+            self.thumbnail_poll = self.after(50, self.poll_thumbnails)
 
-                if index == self.clicked_index:
-                    color = self.active_color
-                elif index == self.selected_index:
-                    color = "#edf0f2"
-                else:
-                    color = "#81a2b8"
+    def visible_range(self, center_y):
+        """Return the first and last item index whose row lies on the canvas."""
+        first = math.ceil((-center_y - self.offset_y) / self.item_height)
+        last = math.floor((self.canvas_size[1] - center_y - self.offset_y) / self.item_height)
+        return max(0, first), min(len(self.file_names) - 1, last)
+
+    def draw_rail(self):
+        if len(self.jump_indices) < 2:
+            return
+
+        height = self.canvas.winfo_height()
+        rail_x1 = self.canvas_size[0] - self.rail_width
+        rail_x2 = self.canvas_size[0]
+        self.renderer.rect(rail_x1, 0, rail_x2, height, "#002b36", "#81a2b8")
+
+        bucket = self.current_jump_bucket()
+        bucket_height = height / len(self.jump_indices)
+        marker_y = bucket * bucket_height
+        self.renderer.rect(rail_x1 + 4, marker_y, rail_x2 - 4, marker_y + max(bucket_height, 4), "#81a2b8")
+
+        if self.is_rail_active:
+            bubble_y = min(max(marker_y, 20), height - 20)
+            self.renderer.rect(rail_x1 - 130, bubble_y - 18, rail_x1 - 10, bubble_y + 18, "#073642", "#edf0f2")
+            self.renderer.text(rail_x1 - 70, bubble_y, self.jump_labels[bucket], "#edf0f2", 14, bold=True)
+
+    def draw_stats_overlay(self):
+        if not (self.show_stats and self.stats):
+            return
+
+        draw_times = self.stats.draw_times
+        latencies = self.stats.latencies
+        lines = [
+            f"draw {draw_times[-1] * 1000:.1f} ms" if draw_times else "draw -",
+            f"fps {self.stats.fps():.0f}",
+            f"coalesced {self.stats.coalesced[-1] if self.stats.coalesced else 0}",
+            f"tap-send {latencies[-1] * 1000:.0f} ms" if latencies else "tap-send -",
+        ]
+
+        self.renderer.rect(4, 4, 154, 8 + 18 * len(lines), "#073642", "#edf0f2")
+        for row, line in enumerate(lines):
+            self.renderer.text(79, 16 + 18 * row, line, "#edf0f2", 9)
+
+    def toggle_stats_overlay(self, event=None):
+        if self.stats is None:
+            logging.info("Frame statistics are disabled, start with --stats to enable them.")
+            return
+
+        self.show_stats = not self.show_stats
+        self.update_canvas()
+
+    def build_jump_table(self):
+        """Record where each fast-scroll bucket starts in the current listing."""
+        self.jump_indices = []
+        self.jump_labels = []
+        if self.sort_order != "natural":
+            # Buckets are only contiguous in name order, other orders have no rail
+            return
+
+        for index, name in enumerate(self.file_names):
+            key = jump_key(name)
+            if not self.jump_labels or key != self.jump_labels[-1]:
+                self.jump_indices.append(index)
+                self.jump_labels.append(key)
+
+    def current_jump_bucket(self):
+        return max(0, bisect_right(self.jump_indices, self.selected_index) - 1)
+
+    def in_rail(self, x):
+        return len(self.jump_indices) > 1 and x >= self.canvas.winfo_width() - self.rail_width
 
-                self.canvas.create_text(x, y + 5, text=self.file_names[index], fill=color, font=font)
+    def rail_jump(self, y):
+        """Jump the wheel straight to the bucket under the given rail position."""
+        height = max(1, self.canvas.winfo_height())
+        bucket = int(y / height * len(self.jump_indices))
+        bucket = max(0, min(bucket, len(self.jump_indices) - 1))
+
+        self.selected_index = self.jump_indices[bucket]
+        self.offset_y = self.target_offset_y = -self.selected_index * self.item_height
+        self.update_canvas()
 
     def on_resize(self, event):
         self.update_canvas()
 
     def update_canvas(self):
         self.canvas_size = (self.winfo_width(), self.winfo_height())
-        self.draw()
+
+        if self.stats is None:
+            self.draw()
+        else:
+            start = time.perf_counter()
+            self.draw()
+            self.stats.record_frame(start, time.perf_counter() - start, max(0, self.coalesced_events - 1))
+
+        self.coalesced_events = 0
+
+    def schedule_redraw(self):
+        """Redraw once the pending input events are handled, folding them into one frame."""
+        self.coalesced_events += 1
+        if self.redraw_pending is None:
+            self.redraw_pending = self.after_idle(self.redraw)
+
+    def redraw(self):
+        self.redraw_pending = None
+        self.update_canvas()
 
     def on_mouse_wheel(self, event):
         scroll_amount = 3
@@ -342,38 +1184,66 @@ class FileSelector(tk.Tk):
             self.move_selection_down(event)
 
     def on_click(self, event):
+        if self.in_rail(event.x):
+            self.is_rail_active = True
+            self.rail_jump(event.y)
+            return
+
         self.start_y = event.y
         self.is_dragging = True
         self.drag_start_y = event.y
+        self.long_pressed = False
+        self.long_press_job = self.after(self.long_press_ms, self.on_long_press)
 
         logging.debug(f"Click started at y={event.y}")
 
+    def cancel_long_press(self):
+        if self.long_press_job is not None:
+            self.after_cancel(self.long_press_job)
+            self.long_press_job = None
+
+    def on_long_press(self):
+        """Mark the item under a press that was held without dragging."""
+        self.long_press_job = None
+        center_y = self.canvas_size[1] // 2 - 150
+        if abs(self.drag_start_y - center_y) >= self.item_height:
+            return
+
+        self.long_pressed = True
+        self.is_dragging = False
+        self.update_selected_through_closest_item()
+        # Voices in a pack and the virtual folders cannot be copied, moved or deleted one by one
+        if not isinstance(self.listing, voicepack.PackListing) and self.view.path_of(self.selected_index) not in self.virtual_folders:
+            self.toggle_mark(self.selected_index)
+
     def on_item_chosen(self):
         logging.debug(f"Item chosen: {self.file_names[self.selected_index]}")
 
         if 0 <= self.selected_index < len(self.file_names):
             selected_file = self.file_names[self.selected_index]
-            selected_file_path = self.file_paths[self.selected_index]
+            selected_file_path = self.view.path_of(self.selected_index)
             logging.debug(f"Selected file path: {selected_file_path}")
 
-            if os.path.isdir(selected_file_path):
+            if self.view.is_dir(self.selected_index):
                 logging.info(f"Selected item is a folder: {selected_file_path}")
                 self.current_path = selected_file_path
                 try:
-                    os.chdir(self.current_path)
+                    if not (self.is_bookmark_folder(self.current_path) or self.current_path in self.virtual_folders
+                            or isinstance(self.listing, voicepack.PackListing)):
+                        os.chdir(self.current_path)
                     self.update_file_list()
-                    logging.debug(f"Updated files list: {self.file_names}")
                 except Exception as e:
                     logging.error(f"Failed to change directory to {self.current_path}: {e}")
+            elif selected_file.endswith(voicepack.PACK_EXTENSION):
+                logging.info(f"Selected item is a voice pack: {selected_file_path}")
+                self.current_path = selected_file_path
+                self.update_file_list()
             elif selected_file.lower().endswith('.syx'):
-                midi_device = self.selected_midi_device.get()
-                port_number = self.midi_devices.index(midi_device) if midi_device in self.midi_devices else 0
-                logging.debug(f"Executing command: python -m tools.get_soundmondo_voice -m {selected_file_path} -p {port_number}")
-                try:
-                    os.chdir(self.root_directory)
-                    subprocess.call(f"python -m tools.get_soundmondo_voice -m {selected_file_path} -p {port_number}", shell=True)
-                except Exception as e:
-                     logging.error(f"Failed to execute command for file {selected_file_path}: {e}")
+                if isinstance(self.listing, BookmarkListing) and not os.path.exists(selected_file_path):
+                    self.start_bookmark_search(selected_file_path)
+                    return
+
+                self.send_voice_file(selected_file_path)
             # else:
             #     try:
             #         if platform.system() == "Windows":
@@ -385,7 +1255,24 @@ class FileSelector(tk.Tk):
             #     except Exception as e:
             #         logging.error(f"Failed to open file {selected_file_path}: {e}")
 
+    def record_send_latency(self):
+        if self.stats is not None and self.tap_started is not None:
+            self.stats.record_latency(time.perf_counter() - self.tap_started)
+        self.tap_started = None
+
     def on_release(self, event):
+        self.cancel_long_press()
+        if self.is_rail_active:
+            self.is_rail_active = False
+            self.update_canvas()
+            return
+
+        if self.long_pressed:
+            self.long_pressed = False
+            if not self.is_animating:
+                self.animate_settle()
+            return
+
         self.is_dragging = False
         delta_y = event.y - self.drag_start_y
 
@@ -393,10 +1280,15 @@ class FileSelector(tk.Tk):
         distance_from_center = event.y - center_y
 
         if abs(delta_y) < self.drag_threshold and (distance_from_center < (self.item_height) and distance_from_center > -(self.item_height)):
+            self.tap_started = time.perf_counter()
             self.update_selected_through_closest_item()
-            self.clicked_index = self.selected_index
-            self.update_canvas()
-            self.on_item_chosen()
+            if self.marked and not self.view.is_dir(self.selected_index):
+                # While items are marked, tapping a file marks it instead of sending it
+                self.toggle_mark(self.selected_index)
+            else:
+                self.clicked_index = self.selected_index
+                self.update_canvas()
+                self.on_item_chosen()
         else:
             if abs(delta_y) < self.drag_threshold:
                 self.selected_index = self.selected_index + int(((distance_from_center + 20) // self.item_height))
@@ -426,13 +1318,18 @@ class FileSelector(tk.Tk):
             self.offset_y = self.target_offset_y
             self.update_canvas()
             self.is_animating = False
+            self.schedule_session_save()
 
     def on_drag(self, event):
-        if self.is_dragging:
+        if self.is_rail_active:
+            self.rail_jump(event.y)
+        elif self.is_dragging:
+            if abs(event.y - self.drag_start_y) >= self.drag_threshold:
+                self.cancel_long_press()
             delta_y = event.y - self.start_y
             self.offset_y += delta_y
             self.start_y = event.y
-            self.update_canvas()
+            self.schedule_redraw()
 
     def update_selected_through_closest_item(self):
         center_y = self.canvas_size[1] // 2 - 150
@@ -471,6 +1368,7 @@ class FileSelector(tk.Tk):
         self.target_offset_y = 0
         if not self.is_animating:
             self.animate_settle()
+        self.tap_started = time.perf_counter()
         self.on_item_chosen()
         self.update_canvas()
 
@@ -480,6 +1378,12 @@ class FileSelector(tk.Tk):
         if not new_folder_name:
             return
 
+        if isinstance(self.listing, BookmarkListing):
+            self.bookmarks.add_folder(new_folder_name)
+            logging.info(f"Created bookmark folder: {new_folder_name}")
+            self.update_file_list()
+            return
+
         new_folder_path = os.path.join(self.current_path, new_folder_name)
 
         counter = 1
@@ -492,7 +1396,9 @@ class FileSelector(tk.Tk):
         try:
             os.mkdir(new_folder_path)
             logging.info(f"Created new folder: {new_folder_path}")
-            self.update_file_list()
+            self.apply_listing_change(self.current_path, added=[new_folder_name])
+            if self.listing.path is None:
+                self.update_file_list()
         except Exception as e:
             logging.error(f"Failed to create folder: {e}")
             messagebox.showerror("Error", f"Could not create folder: {e}")
@@ -500,39 +1406,235 @@ class FileSelector(tk.Tk):
     def delete_selected_item(self):
         if 0 <= self.selected_index < len(self.file_names):
             selected_file = self.file_names[self.selected_index]
-            selected_file_path = self.file_paths[self.selected_index]
+            selected_file_path = self.view.path_of(self.selected_index)
 
-            if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete '{selected_file}'?"):
-                try:
-                    if os.path.isdir(selected_file_path):
-                        if os.path.islink(selected_file_path):
-                            os.unlink(selected_file_path)
-                        else:
-                            shutil.rmtree(selected_file_path)
+            if isinstance(self.listing, BookmarkListing):
+                if messagebox.askyesno("Confirm Remove", f"Remove the bookmark '{selected_file}'?"):
+                    if self.is_bookmark_folder(selected_file_path):
+                        self.bookmarks.remove_folder(selected_file)
                     else:
-                        os.remove(selected_file_path)
-
-                    logging.info(f"Deleted: {selected_file_path}")
+                        self.bookmarks.remove(selected_file_path, self.listing.folder)
+                    logging.info(f"Removed bookmark: {selected_file_path}")
                     self.update_file_list()
-                except Exception as e:
-                    logging.error(f"Failed to delete {selected_file}: {e}")
-                    messagebox.showerror("Error", f"Could not delete {selected_file}: {e}")
+                return
+
+            if isinstance(self.listing, voicepack.PackListing):
+                messagebox.showinfo("Voice Pack", f"'{selected_file}' is in a voice pack and cannot be deleted.")
+                return
+
+            if selected_file_path in self.virtual_folders:
+                messagebox.showinfo("Virtual Folder", f"'{selected_file}' is listed from the usage log and cannot be deleted.")
+                return
+
+            if self.marked:
+                self.delete_marked_items()
+            elif messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete '{selected_file}'?"):
+                self.start_batch("delete", [selected_file_path])
+
+    def delete_marked_items(self):
+        if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete {len(self.marked)} marked items?"):
+            self.start_batch("delete", self.marked)
+
+    def toggle_mark(self, index):
+        path = self.view.path_of(index)
+        if path in self.marked:
+            self.marked.discard(path)
+        else:
+            self.marked.add(path)
+        self.update_batch_bar()
+        self.update_canvas()
+
+    def clear_marks(self):
+        self.marked.clear()
+        self.update_batch_bar()
+        self.update_canvas()
+
+    def build_batch_bar(self):
+        """Create the bar shown while items are marked: long-press an item to mark it, then tap to mark more."""
+        if self.batch_frame is not None:
+            return
+
+        self.batch_frame = Frame(self, bootstyle="default")
+        self.batch_label = Label(self.batch_frame, font="Verdana 10", bootstyle="warning")
+        self.batch_label.pack(side=tk.LEFT, padx=5)
+        self.batch_buttons = [
+            Button(self.batch_frame, text=text, command=command, bootstyle="warning-outline")
+            for text, command in (
+                ("Copy here", lambda: self.start_batch("copy", self.marked)),
+                ("Move here", lambda: self.start_batch("move", self.marked)),
+                ("Delete", self.delete_marked_items),
+                ("Bookmark", self.add_to_bookmarks),
+            )
+        ]
+        for button in self.batch_buttons:
+            button.pack(side=tk.LEFT, padx=2, pady=2)
+        self.batch_cancel = Button(self.batch_frame, text="Clear", command=self.clear_marks, bootstyle="danger-outline")
+        self.batch_cancel.pack(side=tk.RIGHT, padx=2, pady=2)
+        self.batch_progress = Progressbar(self.batch_frame, bootstyle="warning-striped")
+
+    def update_batch_bar(self):
+        self.build_batch_bar()
+        if self.batch_job is not None:
+            self.batch_label.config(text=f"{self.batch_job.operation.capitalize()}...")
+        elif self.marked:
+            self.batch_label.config(text=f"{len(self.marked)} marked")
+        else:
+            self.batch_frame.pack_forget()
+            return
+
+        if not self.batch_frame.winfo_ismapped():
+            self.batch_frame.pack(side=tk.TOP, fill=tk.X, before=self.canvas)
+
+    def start_batch(self, operation, paths):
+        """Copy, move or delete paths in the background, copies and moves going to the current folder."""
+        if self.batch_job is not None:
+            messagebox.showwarning("Busy", "Wait for the running operation to finish.")
+            return
+        if operation != "delete" and self.listing.path is None:
+            messagebox.showwarning("No Folder", "Open the folder to copy or move the marked items to.")
+            return
+        if operation != "delete" and isinstance(self.listing, voicepack.PackListing):
+            messagebox.showinfo("Voice Pack", "Marked items cannot be copied or moved into a voice pack.")
+            return
+
+        self.batch_job = BatchJob(operation, sorted(paths), self.current_path)
+        self.batch_job.start()
+        logging.info(f"Started to {operation} {len(self.batch_job.paths)} items")
+
+        self.build_batch_bar()
+        for button in self.batch_buttons:
+            button.config(state=tk.DISABLED)
+        self.batch_cancel.config(text="Cancel", command=self.batch_job.cancel)
+        self.batch_progress.config(value=0, maximum=1)
+        self.batch_progress.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.update_batch_bar()
+        self.after(50, self.poll_batch)
+
+    def poll_batch(self):
+        job = self.batch_job
+        for event in job.ready():
+            if event is None:
+                self.finish_batch(job)
+                return
+            elif event[0] == "progress":
+                _, done, total, _ = event
+                self.batch_progress.config(value=done, maximum=max(1, total))
+            else:
+                _, source, destination, error = event
+                if error is None:
+                    self.apply_batch_result(job.operation, source, destination)
+
+        self.after(50, self.poll_batch)
+
+    def apply_batch_result(self, operation, source, destination):
+        """Update the cached listings from a finished item instead of relisting its folders."""
+        if operation != "copy":
+            self.apply_listing_change(os.path.dirname(source), removed=[os.path.basename(source)])
+            self.marked.discard(source)
+        if destination is not None:
+            self.apply_listing_change(os.path.dirname(destination), added=[os.path.basename(destination)])
+        if operation == "move":
+            self.bookmarks.moved(source, destination)
+
+    def finish_batch(self, job):
+        self.batch_job = None
+        failed = [(source, error) for source, _, error in job.results if error is not None]
+        logging.info(f"Finished to {job.operation} {len(job.results) - len(failed)} of {len(job.paths)} items")
+
+        for button in self.batch_buttons:
+            button.config(state=tk.NORMAL)
+        self.batch_cancel.config(text="Clear", command=self.clear_marks)
+        self.batch_progress.pack_forget()
+        if job.operation == "copy" and not failed and not job.cancelled:
+            self.marked.clear()
+
+        self.update_batch_bar()
+        if self.listing.path is None:
+            self.update_file_list()  # Search results and virtual folders are not updated in place
+        else:
+            self.update_canvas()
+
+        if failed and not job.cancelled:
+            messagebox.showerror("Error", f"Could not {job.operation} {len(failed)} items:\n" + "\n".join(
+                f"{os.path.basename(source)}: {error}" for source, error in failed[:5]))
+
+    def send_voice_file(self, path):
+        _, port_name = self.midi_port_names()
+        if port_name is None:
+            logging.error(f"No MIDI output for device {self.selected_midi_device.get()}, not sending {path}")
+            return
+
+        try:
+            # The tools daemon keeps the port open, otherwise start the tool
+            result = daemon.forward("send_file", path=path, port=port_name)
+            if result is daemon.NOT_RUNNING:
+                command = f"python -m tools.get_soundmondo_voice -m {shlex.quote(path)} -p {shlex.quote(port_name)}"
+                logging.debug(f"Executing command: {command}")
+                os.chdir(self.root_directory)
+                result = subprocess.call(command, shell=True)
+            else:
+                result = 0
+            self.record_send_latency()
+            if result == 0:
+                self.usage.record(path)
+        except Exception as e:
+             logging.error(f"Failed to execute command for file {path}: {e}")
+
+    def start_bookmark_search(self, path):
+        """Look for a moved bookmarked file in the background and send it when found."""
+        if self.bookmark_search is not None:
+            logging.info(f"Still looking for {self.bookmark_search.path}, ignoring {path}")
+            return
+
+        logging.info(f"Bookmarked file {path} is missing, looking for it")
+        self.bookmark_search = BookmarkResolver(self.bookmarks.path, path, [self.root_directory])
+        self.bookmark_search.start()
+        self.after(50, self.poll_bookmark_search)
+
+    def poll_bookmark_search(self):
+        search = self.bookmark_search
+        if search.is_alive():
+            self.after(50, self.poll_bookmark_search)
+            return
+
+        self.bookmark_search = None
+        if search.result is None:
+            messagebox.showwarning("Missing File", f"'{os.path.basename(search.path)}' was moved or deleted.")
+            return
+
+        if isinstance(self.listing, BookmarkListing):
+            self.update_file_list()
+        self.send_voice_file(search.result)
 
     def request_patch(self):
         os.chdir(self.root_directory)
-        midi_device = self.selected_midi_device.get()
-        port_number = self.midi_devices.index(midi_device) if midi_device in self.midi_devices else 0
+        input_name, output_name = self.midi_port_names()
+        if input_name is None or output_name is None:
+            messagebox.showerror("Error", f"No MIDI ports for {self.selected_midi_device.get()}.")
+            return
 
         folder = self.downloads_folder + "/"
 
-        command = f"python -m tools.request_patch -i {port_number} -o {port_number} -p {folder}"
-        logging.debug(f"Executing command: {command}")
-
         try:
-            subprocess.run(command, shell=True, check=True)
+            result = daemon.forward("request_patch", input_port=input_name, output_port=output_name, path=folder)
+            if result is daemon.NOT_RUNNING:
+                command = (f"python -m tools.request_patch -i {shlex.quote(input_name)} -o {shlex.quote(output_name)}"
+                           f" -p {shlex.quote(folder)}")
+                logging.debug(f"Executing command: {command}")
+                subprocess.run(command, shell=True, check=True)
             messagebox.showinfo("Success", "Patch saved to " + self.downloads_folder)
             logging.info("Patch request completed successfully.")
+        except daemon.PatchExistsError as e:
+            logging.warning(f"Patch request not saved: {e}")
+            messagebox.showwarning("Patch Exists", f"The patch was received, but '{os.path.basename(e.paths[0])}' already exists in Downloads.")
         except subprocess.CalledProcessError as e:
+            if e.returncode == EXIT_PATCH_EXISTS:
+                logging.warning("Patch request not saved: the output file exists.")
+                messagebox.showwarning("Patch Exists", "The patch was received, but a file of its name already exists in Downloads.")
+            else:
+                logging.error(f"Failed to execute patch request: {e}")
+                messagebox.showerror("Error", f"Failed to request patch: {e}")
+        except daemon.DaemonError as e:
             logging.error(f"Failed to execute patch request: {e}")
             messagebox.showerror("Error", f"Failed to request patch: {e}")
 
@@ -542,10 +1644,16 @@ class FileSelector(tk.Tk):
             return
 
         selected_file = self.file_names[self.selected_index]
-        selected_file_path = self.file_paths[self.selected_index]
-        bookmark_type = "folder" if os.path.isdir(selected_file_path) else "file"
-
-        folders = [name for name in os.listdir(self.bookmarks_folder) if os.path.isdir(os.path.join(self.bookmarks_folder, name))]
+        selected_file_path = self.view.path_of(self.selected_index)
+        bookmark_type = "folder" if self.view.is_dir(self.selected_index) else "file"
+        folders = self.bookmarks.folders()
+        paths = sorted(self.marked) if self.marked else [selected_file_path]
+
+        # Voices in a pack have no file of their own to refer to
+        in_pack = [path for path in paths if (voicepack.split_pack_path(path) or ("", ""))[1]]
+        if in_pack:
+            messagebox.showinfo("Voice Pack", f"'{os.path.basename(in_pack[0])}' is in a voice pack and cannot be bookmarked.")
+            return
 
         def show_folders_dialog():
             dialog = tk.Toplevel(self)
@@ -585,28 +1693,20 @@ class FileSelector(tk.Tk):
             if not new_folder_name:
                 return
 
-            folder_path = os.path.join(self.bookmarks_folder, new_folder_name)
-            os.makedirs(folder_path, exist_ok=True)
             save_bookmark(new_folder_name)
 
         def save_bookmark(folder_name):
-            folder_path = os.path.join(self.bookmarks_folder, folder_name)
-            os.makedirs(folder_path, exist_ok=True)
-
             try:
-                link_name = os.path.join(folder_path, os.path.basename(selected_file))
-                if not os.path.exists(link_name):
-                    if bookmark_type == "file":
-                        shutil.copy(selected_file_path, link_name)
-                    elif bookmark_type == "folder":
-                        # Create a symlink if possible
-                        if hasattr(os, 'symlink'):
-                            os.symlink(selected_file_path, link_name)
-                        else:
-                            shutil.copytree(selected_file_path, link_name)
-
+                added = sum(self.bookmarks.add(path, folder_name) for path in paths)
+                if added:
                     self.last_bookmark_folder = folder_name
-                    messagebox.showinfo("Success", f"{selected_file} bookmarked in {folder_name}.")
+                    if isinstance(self.listing, BookmarkListing):
+                        self.update_file_list()
+                    if self.marked:
+                        messagebox.showinfo("Success", f"{added} items bookmarked in {folder_name}.")
+                        self.clear_marks()
+                    else:
+                        messagebox.showinfo("Success", f"{selected_file} bookmarked in {folder_name}.")
                 else:
                     messagebox.showwarning("Warning", "Bookmark already exists.")
             except Exception as e:
@@ -620,12 +1720,15 @@ class FileSelector(tk.Tk):
         self.wait_window(dialog)
         return dialog.result
 
-    def populate_files(self, files):
-        self.file_names = [os.path.basename(fp) for fp in files]
-        self.file_paths = files
+    def populate_files(self, listing):
+        if self.loader is not None and listing is not self.loader.listing:
+            self.cancel_loading()
+
+        self.set_listing(listing)
         self.selected_index = 0
         self.offset_y = 0
-        logging.debug(f"Files populated: {self.file_names}, Paths: {self.file_paths}")
+        self.build_jump_table()
+        logging.debug(f"Files populated: {len(self.file_names)} entries")
 
 
 class InputDialog(tk.Toplevel):
@@ -730,6 +1833,70 @@ class Keyboard(tk.Toplevel):
         self.geometry(f"{width}x{height}+{x}+{y}")
 
 
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Touchscreen SysEx browser for the Reface DX.")
+    parser.add_argument(
+        "-r",
+        "--renderer",
+        choices=sorted(RENDERERS),
+        default="canvas",
+        help="Wheel renderer backend (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-s",
+        "--stats",
+        action="store_true",
+        help="Record frame times and tap-to-send latency (toggle the overlay with F2)",
+    )
+    parser.add_argument(
+        "--stats-file",
+        metavar="PATH",
+        default="midipi-stats.txt",
+        help="File to append the statistics summary to on exit (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-t",
+        "--thumbnails",
+        action="store_true",
+        help="Show algorithm and envelope thumbnails next to voice files",
+    )
+    parser.add_argument(
+        "--session-file",
+        metavar="PATH",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "midipi-session.json"),
+        help="File to save the view in and restore it from at the next start (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-session",
+        action="store_true",
+        help="Start in Home without restoring or saving the last session",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print how long each startup phase took until the first frame was shown",
+    )
+    parser.add_argument("path", nargs="?", help="Folder to start browsing in (default: the last session, or Home)")
+    args = parser.parse_args(args)
+
+    if args.renderer == "skia" and import_skia() is None:
+        parser.error("the skia renderer requires the skia-python package")
+
+    profile = None
+    if args.profile_startup:
+        profile = PhaseTimer(STARTED)
+        profile.mark("imports")
+
+    stats = None
+    if args.stats:
+        stats = FrameStats()
+        atexit.register(stats.dump, os.path.abspath(args.stats_file))
+
+    file_selector = FileSelector(renderer=args.renderer, start_path=args.path and os.path.abspath(args.path), stats=stats,
+                                 thumbnails=args.thumbnails, session_file=None if args.no_session else args.session_file,
+                                 profile=profile)
+    file_selector.mainloop()
+
+
 if __name__ == '__main__':
-    file_selector = FileSelector()
-    file_selector.mainloop()
\ No newline at end of file
+    main()
\ No newline at end of file
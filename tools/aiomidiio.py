@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+# tools/aiomidiio.py
+"""Asyncio interface to the Reface DX.
+
+AsyncRefaceDX is the awaitable counterpart of midiio.RefaceDX. Messages
+arriving on the rtmidi callback thread are handed to the event loop, where
+every bulk dump is routed by its address to the oldest future waiting for
+that address. Requests therefore need no thread blocked on a queue, can be
+cancelled or time out without leaving stale replies behind, and several of
+them can be awaited at once, e.g. a patch request while sending program
+changes.
+
+SysEx messages no future waits for are put into the ``unsolicited`` queue,
+dropping the oldest once it is full.
+
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+from collections import deque
+
+from rtmidi import RtMidiError
+from rtmidi.midiconstants import PROGRAM_CHANGE, SYSTEM_EXCLUSIVE
+from rtmidi.midiutil import open_midiinput, open_midioutput
+
+from .constants import ADDRESS_HEADER, ADDRESSES_VOICE_BLOCK, DUMP_REQUEST
+from .midiio import TimeoutError
+from .util import get_patch_name, is_reface_dx_bulk_dump, split_sysex
+from .voicepack import read_file
+
+
+log = logging.getLogger(__name__)
+
+UNSOLICITED_QUEUE_SIZE = 64
+
+
+class AsyncRefaceDX:
+    """A Reface DX on an rtmidi input and output, driven from an asyncio event loop.
+
+    Create it in a coroutine, or pass the loop the futures should belong
+    to. The input's callback is taken over until close() is called.
+
+    """
+
+    def __init__(self, midiin=None, midiout=None, device=0, channel=0, timeout=5.0, loop=None, debug=False):
+        self.loop = loop or asyncio.get_running_loop()
+        self.device = device
+        self.channel = channel
+        self.timeout = timeout
+        self.debug = debug
+        self.midiout = midiout
+        self.unsolicited = asyncio.Queue(UNSOLICITED_QUEUE_SIZE)
+        self._pending = {}      # Address -> deque of futures, oldest first
+        self._send_lock = asyncio.Lock()
+        self._midiin = None
+        self.midiin = midiin
+
+    @property
+    def midiin(self):
+        return self._midiin
+
+    @midiin.setter
+    def midiin(self, value):
+        if self._midiin:
+            self._midiin.cancel_callback()
+        self._midiin = value
+        if self._midiin:
+            self._midiin.ignore_types(sysex=False)
+            self._midiin.set_callback(self._msg_callback)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop listening to the input and cancel all pending requests."""
+        self.midiin = None
+        for futures in self._pending.values():
+            for future in futures:
+                future.cancel()
+        self._pending.clear()
+
+    def _msg_callback(self, event, data):
+        # Runs on the rtmidi thread
+        msg, delta = event
+        if msg[0] == SYSTEM_EXCLUSIVE:
+            try:
+                self.loop.call_soon_threadsafe(self._dispatch, bytes(msg))
+            except RuntimeError:
+                # The loop was closed
+                pass
+
+    def _dispatch(self, msg):
+        if self.debug:
+            log.debug("MIDI RECV: %r", msg)
+
+        if is_reface_dx_bulk_dump(msg):
+            # Done futures are removed by their done callback
+            for future in self._pending.get(tuple(msg[8:11]), ()):
+                if not future.done():
+                    future.set_result(msg)
+                    return
+
+        if self.unsolicited.full():
+            self.unsolicited.get_nowait()
+        self.unsolicited.put_nowait(msg)
+
+    def expect(self, address):
+        """Return a future for the next bulk dump with address, a tuple of three bytes.
+
+        Register futures before sending the request that makes the device
+        answer, so the reply cannot arrive first.
+
+        """
+        future = self.loop.create_future()
+        self._pending.setdefault(tuple(address), deque()).append(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        for address, futures in list(self._pending.items()):
+            if future in futures:
+                futures.remove(future)
+                if not futures:
+                    del self._pending[address]
+                return
+
+    def _send(self, msg):
+        if self.debug:
+            log.debug("MIDI SEND: %r", msg)
+        if self.midiout:
+            self.midiout.send_message(msg)
+
+    async def dump_request(self, address=ADDRESS_HEADER, device=None):
+        if device is None:
+            device = self.device
+        msg = bytearray(DUMP_REQUEST)
+        msg[2] |= device
+        msg[6:9] = address
+        async with self._send_lock:
+            self._send(msg)
+
+    async def patch_request(self, device=None, timeout=None):
+        """Request the edit buffer and return the voice's bulk dump messages joined.
+
+        Raises midiio.TimeoutError if the voice was not received completely
+        within timeout seconds (default: the instance's timeout).
+
+        """
+        timeout = self.timeout if timeout is None else timeout
+        parts = [self.expect(address) for address in ADDRESSES_VOICE_BLOCK]
+        try:
+            await self.dump_request(ADDRESS_HEADER, device)
+            _, missing = await asyncio.wait(parts, timeout=timeout)
+        finally:
+            for part in parts:
+                part.cancel()
+
+        if missing:
+            raise TimeoutError("No valid patch received within timeout (%s sec.)" % timeout)
+        return b"".join(part.result() for part in parts)
+
+    async def send_patch(self, data, delay=0.0):
+        """Send the SysEx messages in data, delay seconds apart, without interleaving other sends."""
+        async with self._send_lock:
+            for i, msg in enumerate(split_sysex(data)):
+                if i and delay:
+                    await asyncio.sleep(delay)
+                self._send(msg)
+
+    async def send_patchfile(self, path, delay=0.0):
+        await self.send_patch(read_file(path), delay)
+
+    async def send_program_change(self, program, channel=None):
+        if channel is None:
+            channel = self.channel
+        async with self._send_lock:
+            self._send([PROGRAM_CHANGE | (channel & 0xF), program & 0x7F])
+
+
+async def run(args):
+    midiin, _ = open_midiinput(args.input_port, interactive=False)
+    midiout, _ = open_midioutput(args.output_port, interactive=False)
+    try:
+        async with AsyncRefaceDX(midiin, midiout, channel=args.channel - 1, timeout=args.timeout,
+                                 debug=args.debug) as reface:
+            for path in args.files:
+                log.info("Sending '%s'...", path)
+                await reface.send_patchfile(path, args.delay / 1000)
+
+            if args.program:
+                await reface.send_program_change(args.program - 1)
+
+            if args.request:
+                patch = await reface.patch_request(args.device)
+                print(get_patch_name(patch))
+                if args.request != "-":
+                    with open(args.request, "wb") as fp:
+                        fp.write(patch)
+    finally:
+        midiin.close_port()
+        midiout.close_port()
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-c", "--channel", type=int, default=1, help="MIDI channel (1-16, default: %(default)s)")
+    ap.add_argument("-d", "--delay", type=int, default=10, metavar="MS",
+                    help="Delay between SysEx messages sent in milliseconds (default: %(default)s)")
+    ap.add_argument("-D", "--device", type=int, default=1, help="Device number of dump requests (default: %(default)s)")
+    ap.add_argument("-i", "--input-port", default="reface DX",
+                    help="MIDI input port number or name sub-string (default: '%(default)s')")
+    ap.add_argument("-o", "--output-port", default="reface DX",
+                    help="MIDI output port number or name sub-string (default: '%(default)s')")
+    ap.add_argument("-p", "--program", type=int, help="Select program 1-32 after sending the files")
+    ap.add_argument("-r", "--request", metavar="FILE",
+                    help="Request the edit buffer last, print its name and save it to FILE ('-' to only print it)")
+    ap.add_argument("-t", "--timeout", type=float, default=5.0,
+                    help="Seconds to wait for a patch dump (default: %(default)s)")
+    ap.add_argument("-v", "--debug", action="store_true", help="Enable debug logging")
+    ap.add_argument("files", nargs="*", metavar="FILE", help="SysEx files to send")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format="%(levelname)s: %(message)s")
+
+    try:
+        asyncio.run(run(args))
+    except (OSError, RtMidiError, TimeoutError) as exc:
+        log.error("%s", exc)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# tools/batchops.py
+"""Copy, move and delete files and folders in a background thread."""
+
+import logging
+import os
+import shutil
+import threading
+
+from queue import Empty, Queue
+
+
+log = logging.getLogger(__name__)
+
+OPERATIONS = ("copy", "move", "delete")
+
+
+class Cancelled(Exception):
+    pass
+
+
+def unique_path(folder, name):
+    """Return a path for name in folder that does not exist yet, e.g. 'Pad (1).syx'."""
+    path = os.path.join(folder, name)
+    stem, ext = os.path.splitext(name)
+    counter = 1
+    while os.path.lexists(path):
+        path = os.path.join(folder, f"{stem} ({counter}){ext}")
+        counter += 1
+    return path
+
+
+class BatchJob(threading.Thread):
+    """Apply one operation to a list of paths, reporting progress on a queue.
+
+    Progress is reported as ("progress", done, total, path) events, with
+    done counting the files and links handled so far and total the number
+    found when the job started. Each path that was handled is reported as a
+    ("result", source, destination, error) event, destination being None
+    for deletions and on errors, error None on success. None on the queue
+    marks the end of the job.
+
+    The job checks for cancellation between files, so deleting or copying
+    a large folder stops promptly, leaving it partly copied or deleted.
+
+    """
+
+    def __init__(self, operation, paths, destination=None):
+        if operation not in OPERATIONS:
+            raise ValueError("Unknown batch operation: %r" % operation)
+
+        super().__init__(name="batch-%s" % operation, daemon=True)
+        self.operation = operation
+        self.paths = list(paths)
+        self.destination = destination
+        self.done = 0
+        self.total = 0
+        self.results = []
+        self.events = Queue()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self):
+        try:
+            self.total = sum(count_files(path) for path in self.paths)
+            self.events.put(("progress", 0, self.total, None))
+
+            for path in self.paths:
+                if self.cancelled:
+                    break
+
+                destination = error = None
+                try:
+                    destination = getattr(self, "_%s_path" % self.operation)(path)
+                except Cancelled:
+                    error = "cancelled"
+                except OSError as exc:
+                    log.error("Could not %s '%s': %s", self.operation, path, exc)
+                    error = str(exc)
+
+                self.results.append((path, destination, error))
+                self.events.put(("result", path, destination, error))
+        finally:
+            self.events.put(None)
+
+    def ready(self):
+        """Yield the events queued since the last call, without blocking."""
+        while True:
+            try:
+                yield self.events.get_nowait()
+            except Empty:
+                return
+
+    def _step(self, path, files=1):
+        if self.cancelled:
+            raise Cancelled()
+        self._advance(path, files)
+
+    def _advance(self, path, files=1):
+        self.done += files
+        self.events.put(("progress", self.done, self.total, path))
+
+    def _copy_file(self, source, destination, follow_symlinks=True):
+        self._step(source)
+        return shutil.copy2(source, destination, follow_symlinks=follow_symlinks)
+
+    def _copy_path(self, path):
+        destination = unique_path(self.destination, os.path.basename(path))
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.copytree(path, destination, symlinks=True, copy_function=self._copy_file)
+        else:
+            self._copy_file(path, destination, follow_symlinks=False)
+        return destination
+
+    def _move_path(self, path):
+        destination = unique_path(self.destination, os.path.basename(path))
+        files = count_files(path)
+        try:
+            os.rename(path, destination)
+        except OSError:
+            # Another filesystem, copy and delete
+            shutil.move(path, destination, copy_function=self._copy_file)
+        else:
+            self._advance(path, files)
+        return destination
+
+    def _delete_path(self, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            for root, dirnames, filenames in os.walk(path, topdown=False):
+                for name in filenames:
+                    self._step(os.path.join(root, name))
+                    os.remove(os.path.join(root, name))
+                for name in dirnames:
+                    dirpath = os.path.join(root, name)
+                    if os.path.islink(dirpath):
+                        self._step(dirpath)
+                        os.unlink(dirpath)
+                    else:
+                        os.rmdir(dirpath)
+            os.rmdir(path)
+        else:
+            self._step(path)
+            os.unlink(path)
+
+
+def count_files(path):
+    """Return the number of files and links at or below path."""
+    if not os.path.isdir(path) or os.path.islink(path):
+        return 1
+
+    count = 0
+    for root, dirnames, filenames in os.walk(path):
+        links = [name for name in dirnames if os.path.islink(os.path.join(root, name))]
+        count += len(filenames) + len(links)
+    return count
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+#
+# tools/bookmarks.py
+"""Bookmarks stored as references to files and folders in an SQLite database.
+
+Each bookmark records the path, content hash, size, modification time and
+type flags of its target plus the bookmark folder it was filed under, so
+bookmark folders can be listed without touching the filesystem. Bookmarked
+files that were moved or renamed outside the browser are found again by
+their size and content hash, looking near their old folder first. Content
+hashes are kept in an index keyed by path and checked against the inode,
+size and mtime of the file, so each file is only hashed again once it
+changed.
+
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+from .listing import IS_DIR, IS_LINK, PathListing, path_info
+
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS bookmarks (
+    id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL,
+    path TEXT NOT NULL,
+    hash TEXT,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    flags INTEGER NOT NULL,
+    UNIQUE (folder, path)
+);
+CREATE INDEX IF NOT EXISTS bookmarks_path ON bookmarks (path);
+CREATE INDEX IF NOT EXISTS bookmarks_hash ON bookmarks (hash, size);
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hashes_hash ON hashes (hash, size);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def file_hash(path):
+    """Return the hex BLAKE2b digest of the contents of the file at path."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def files_of_size(root, size, skip=()):
+    """Yield the paths of all files below root with the given size, skipping hidden folders and those in skip."""
+    try:
+        with os.scandir(root) as entries:
+            entries = list(entries)
+    except OSError:
+        return
+
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith(".") and entry.path not in skip:
+                    yield from files_of_size(entry.path, size, skip)
+            elif entry.is_file() and entry.stat().st_size == size:
+                yield entry.path
+        except OSError:
+            continue
+
+
+def is_below(path, folder):
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
+def search_tiers(path, roots):
+    """Return the lists of folders to search for a file that was at path, nearest first.
+
+    The file's old folder comes first, then the other folders next to it,
+    then the roots. Folders outside the roots are left out.
+
+    """
+    parent = os.path.dirname(path)
+    grandparent = os.path.dirname(parent)
+    tiers = []
+    if any(is_below(parent, root) for root in roots):
+        tiers.append([parent])
+        if grandparent != parent and any(is_below(grandparent, root) for root in roots):
+            try:
+                with os.scandir(grandparent) as entries:
+                    siblings = sorted(entry.path for entry in entries if entry.path != parent
+                                      and not entry.name.startswith(".") and entry.is_dir(follow_symlinks=False))
+            except OSError:
+                siblings = []
+            if siblings:
+                tiers.append(siblings)
+    tiers.append(list(roots))
+    return tiers
+
+
+class BookmarkListing(PathListing):
+    """The bookmarks in one bookmark folder, listed from the store."""
+
+    def __init__(self, folder, paths, infos):
+        super().__init__(paths, title=folder or "Bookmarks", infos=infos)
+        self.folder = folder
+
+
+class BookmarkStore:
+    """Bookmarks filed under named folders, "" being the top-level folder."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @property
+    def imported(self):
+        return self.db.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone() is not None
+
+    def folders(self):
+        return [name for name, in self.db.execute("SELECT name FROM folders ORDER BY name")]
+
+    def add_folder(self, name):
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO folders (name) VALUES (?)", (name,))
+
+    def rename_folder(self, old, new):
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO folders (name) VALUES (?)", (new,))
+            self.db.execute("UPDATE OR REPLACE bookmarks SET folder = ? WHERE folder = ?", (new, old))
+            self.db.execute("DELETE FROM folders WHERE name = ?", (old,))
+
+    def remove_folder(self, name):
+        with self.db:
+            self.db.execute("DELETE FROM bookmarks WHERE folder = ?", (name,))
+            self.db.execute("DELETE FROM folders WHERE name = ?", (name,))
+
+    def add(self, path, folder=""):
+        """Bookmark the file or folder at path, returning False if it already is in folder."""
+        path = os.path.abspath(path)
+        flags, size, mtime = path_info(path)
+        digest = None if flags & IS_DIR else self.hash_of(path)
+
+        with self.db:
+            if folder:
+                self.db.execute("INSERT OR IGNORE INTO folders (name) VALUES (?)", (folder,))
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO bookmarks (folder, path, hash, size, mtime, flags) VALUES (?, ?, ?, ?, ?, ?)",
+                (folder, path, digest, size, mtime, flags))
+        return cursor.rowcount == 1
+
+    def remove(self, path, folder=""):
+        with self.db:
+            self.db.execute("DELETE FROM bookmarks WHERE folder = ? AND path = ?", (folder, path))
+
+    def entries(self, folder=""):
+        """Return the (path, flags, size, mtime) of the bookmarks in folder."""
+        return self.db.execute("SELECT path, flags, size, mtime FROM bookmarks WHERE folder = ?",
+                               (folder,)).fetchall()
+
+    def listing(self, folder, root):
+        """Return a listing of the bookmarks in folder.
+
+        The bookmark folders are listed as subfolders of root in the top-level
+        folder.
+
+        """
+        rows = self.entries(folder)
+        paths = [path for path, _, _, _ in rows]
+        infos = [(flags, size, mtime) for _, flags, size, mtime in rows]
+
+        if not folder:
+            for name in self.folders():
+                paths.append(os.path.join(root, name))
+                infos.append((IS_DIR, 0, 0.0))
+
+        return BookmarkListing(folder, paths, infos)
+
+    def moved(self, old, new):
+        """Update bookmarks of old, or of anything below it, to point to new."""
+        prefix = old.rstrip(os.sep) + os.sep
+        with self.db:
+            for table in ("bookmarks", "hashes"):
+                self.db.execute("UPDATE OR REPLACE %s SET path = ? WHERE path = ?" % table, (new, old))
+                self.db.execute("UPDATE OR REPLACE %s SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?"
+                                % table, (new.rstrip(os.sep) + os.sep, len(prefix) + 1, len(prefix), prefix))
+
+    def hash_of(self, path, commit=True):
+        """Return the content hash of the file at path, from the index if the file did not change since."""
+        st = os.stat(path)
+        row = self.db.execute("SELECT inode, size, mtime_ns, hash FROM hashes WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[:3] == (st.st_ino, st.st_size, st.st_mtime_ns):
+            return row[3]
+
+        digest = file_hash(path)
+        self.db.execute("INSERT OR REPLACE INTO hashes (path, inode, size, mtime_ns, hash) VALUES (?, ?, ?, ?, ?)",
+                        (path, st.st_ino, st.st_size, st.st_mtime_ns, digest))
+        if commit:
+            self.db.commit()
+        return digest
+
+    def indexed(self, digest, size):
+        """Return the paths of the files in the hash index that still have the given hash and size."""
+        paths = []
+        for path, inode, mtime_ns in self.db.execute(
+                "SELECT path, inode, mtime_ns FROM hashes WHERE hash = ? AND size = ?", (digest, size)).fetchall():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (st.st_ino, st.st_size, st.st_mtime_ns) == (inode, size, mtime_ns):
+                paths.append(path)
+        return paths
+
+    def resolve(self, path, roots, cancelled=None):
+        """Return where the bookmarked file at path is now, searching the given roots.
+
+        The index is asked first, then files with the bookmarked size are
+        compared by content hash: in the file's old folder, in the folders
+        next to it and then in the rest of the roots, those with the same
+        name and the nearest to the old path first. All bookmarks of path are updated to the new location.
+        Returns None if the file was not found or cancelled() returned True.
+
+        """
+        row = self.db.execute("SELECT hash, size FROM bookmarks WHERE path = ? AND hash IS NOT NULL",
+                              (path,)).fetchone()
+        if row is None:
+            return None
+
+        digest, size = row
+        name = os.path.basename(path)
+
+        def nearness(candidate):
+            # Same name first, then the candidates sharing the longest part of the old path
+            return os.path.basename(candidate) != name, -len(os.path.commonpath([candidate, path]))
+
+        known = self.indexed(digest, size)
+        searched = set()
+
+        for tier in search_tiers(path, roots):
+            found = [candidate for candidate in known if any(is_below(candidate, folder) for folder in tier)]
+            if not found:
+                candidates = [candidate for folder in tier for candidate in files_of_size(folder, size, searched)]
+                candidates.sort(key=nearness)
+                searched.update(tier)
+                try:
+                    for candidate in candidates:
+                        if cancelled is not None and cancelled():
+                            return None
+                        try:
+                            if self.hash_of(candidate, commit=False) == digest:
+                                found.append(candidate)
+                                break
+                        except OSError:
+                            continue
+                finally:
+                    self.db.commit()
+
+            if found:
+                found.sort(key=nearness)
+                log.info("Bookmarked file '%s' found at '%s'.", path, found[0])
+                self.moved(path, found[0])
+                return found[0]
+
+        return None
+
+    def import_tree(self, root):
+        """Bookmark the files and links in a folder tree of bookmark copies.
+
+        The top-level subfolders of root become bookmark folders. Links are
+        bookmarked by their target, copied files where they are.
+
+        """
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            relative = os.path.relpath(dirpath, root)
+            folder = "" if relative == os.curdir else relative.split(os.sep)[0]
+
+            names = filenames + [name for name in dirnames if os.path.islink(os.path.join(dirpath, name))]
+            dirnames[:] = [name for name in dirnames if name not in names]
+            if folder:
+                self.add_folder(folder)
+
+            for name in names:
+                path = os.path.join(dirpath, name)
+                target = os.path.realpath(path) if path_info(path)[0] & IS_LINK else path
+                try:
+                    count += self.add(target, folder)
+                except OSError as exc:
+                    log.warning("Could not import bookmark '%s': %s", path, exc)
+
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', ?)", (root,))
+        log.info("Imported %i bookmarks from '%s'.", count, root)
+        return count
+
+
+class BookmarkResolver(threading.Thread):
+    """Look for a moved bookmarked file in a thread with its own connection to the store.
+
+    The new path, or None, is in result once the thread has finished.
+
+    """
+
+    def __init__(self, db_path, path, roots):
+        super().__init__(name="bookmark-resolver", daemon=True)
+        self.db_path = db_path
+        self.path = path
+        self.roots = list(roots)
+        self.result = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        store = BookmarkStore(self.db_path)
+        try:
+            self.result = store.resolve(self.path, self.roots, self._cancelled.is_set)
+        except (OSError, sqlite3.Error) as exc:
+            log.error("Could not look for bookmarked file '%s': %s", self.path, exc)
+        finally:
+            store.close()
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-i", "--import", dest="import_root", metavar="FOLDER",
+                    help="Import a folder tree of bookmark copies first")
+    ap.add_argument("database", nargs="?", default="midipi-bookmarks.db", help="Bookmark database (default: %(default)s)")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    store = BookmarkStore(args.database)
+
+    if args.import_root:
+        store.import_tree(args.import_root)
+
+    for folder in [""] + store.folders():
+        print("%s:" % (folder or "(top)"))
+        for path, flags, _, _ in sorted(store.entries(folder)):
+            print("  %s%s" % (path, os.sep if flags & IS_DIR else ""))
+
+    store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
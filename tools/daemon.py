@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+#
+# tools/daemon.py
+"""Resident daemon sending and requesting patches and downloading voices.
+
+Running ``tools.get_soundmondo_voice`` or ``tools.request_patch`` imports
+requests, cachecontrol and rtmidi and opens the MIDI ports on every call.
+The daemon does that once and then serves commands sent to a Unix socket,
+one line of JSON per connection, answered with one line of JSON:
+
+    {"command": "send_file", "path": "/home/pi/Pad.syx", "port": "reface DX"}
+    {"ok": true, "result": null}
+
+Commands are ``ping``, ``send_file``, ``request_patch``, ``download_voice``
+and ``stop``. Ports are given as a number or a name sub-string, like on the
+command line of the tools, and are kept open between commands.
+
+This module only imports the standard library, so clients using call() or
+forward() stay cheap to start. The tools forward their work to the daemon
+whenever it is running.
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+
+
+log = logging.getLogger(__name__)
+
+COMMANDS = ("ping", "send_file", "request_patch", "download_voice", "stop")
+MAX_REQUEST_SIZE = 64 * 1024
+
+# Returned by forward() when no daemon is running
+NOT_RUNNING = object()
+
+
+class DaemonError(Exception):
+    """Raised when the daemon could not carry out a command."""
+    pass
+
+
+class PatchExistsError(DaemonError):
+    """Raised when requested patches were received but not saved, because their files exist."""
+
+    def __init__(self, msg, paths):
+        super().__init__(msg)
+        self.paths = paths
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, "midipi-tools-%i.sock" % os.getuid())
+
+
+def _connect(socket_path, timeout):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path or default_socket_path())
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _exchange(sock, command, params):
+    request = dict(params, command=command)
+    sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+    with sock.makefile("rb") as fp:
+        line = fp.readline()
+
+    try:
+        response = json.loads(line)
+    except ValueError:
+        raise DaemonError("Invalid response from the tools daemon: %r" % line[:80])
+
+    if not response.get("ok"):
+        if "exists" in response:
+            raise PatchExistsError(response.get("error"), response["exists"])
+        raise DaemonError(response.get("error") or "Unknown error")
+    return response.get("result")
+
+
+def call(command, socket_path=None, timeout=300.0, **params):
+    """Run command with params in the daemon and return its result.
+
+    Raises OSError if the daemon is not running and DaemonError if the
+    command failed.
+
+    """
+    with _connect(socket_path, timeout) as sock:
+        return _exchange(sock, command, params)
+
+
+def forward(command, socket_path=None, timeout=300.0, **params):
+    """Like call(), but return NOT_RUNNING if no daemon is listening."""
+    try:
+        sock = _connect(socket_path, timeout)
+    except OSError:
+        return NOT_RUNNING
+
+    with sock:
+        return _exchange(sock, command, params)
+
+
+def is_running(socket_path=None):
+    return forward("ping", socket_path, timeout=1.0) is not NOT_RUNNING
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline(MAX_REQUEST_SIZE)
+        if not line:
+            return
+
+        try:
+            request = json.loads(line)
+            command = request.pop("command")
+            if command not in COMMANDS:
+                raise ValueError("Unknown command: %r" % command)
+        except (ValueError, KeyError, AttributeError) as exc:
+            response = {"ok": False, "error": "Invalid request: %s" % exc}
+        else:
+            log.debug("Command %s: %r", command, request)
+            try:
+                response = {"ok": True, "result": getattr(self.server, "do_" + command)(**request)}
+            except Exception as exc:
+                log.error("Command %s failed: %s", command, exc)
+                response = {"ok": False, "error": str(exc) or exc.__class__.__name__}
+                if isinstance(exc, PatchExistsError):
+                    response["exists"] = exc.paths
+
+        try:
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        except OSError as exc:
+            log.debug("Could not send response: %s", exc)
+
+
+class ToolsDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server keeping the tool modules imported and the MIDI ports open.
+
+    Commands run in a thread per connection. Downloads run concurrently,
+    everything talking to MIDI ports is serialised.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        # Import everything up front, so the first command is as quick as the others
+        from . import get_soundmondo_voice, request_patch
+        from .midiio import RefaceDX
+
+        self.soundmondo = get_soundmondo_voice
+        self.patches = request_patch
+        self.refacedx_class = RefaceDX
+        self.socket_path = socket_path
+        self.midi_lock = threading.Lock()
+        self.outputs = {}       # Port spec -> (MidiOut, port name)
+        self.inputs = {}        # Port spec -> (MidiIn, port name)
+        self.refaces = {}       # (input spec, output spec) -> RefaceDX
+
+        self.remove_stale_socket()
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, CommandHandler)
+        finally:
+            os.umask(old_umask)
+
+    def remove_stale_socket(self):
+        if not os.path.exists(self.socket_path):
+            return
+
+        if is_running(self.socket_path):
+            raise DaemonError("A tools daemon is already listening on '%s'." % self.socket_path)
+
+        os.unlink(self.socket_path)
+
+    def output(self, port):
+        key = str(port)
+        if key not in self.outputs:
+            midiout, name = self.patches.open_midioutput(port, interactive=False)
+            log.info("Opened MIDI output '%s'.", name)
+            self.outputs[key] = (midiout, name)
+        return self.outputs[key]
+
+    def reface(self, input_port, output_port):
+        key = (str(input_port), str(output_port))
+        if key not in self.refaces:
+            if key[0] not in self.inputs:
+                midiin, name = self.patches.open_midiinput(input_port, interactive=False)
+                log.info("Opened MIDI input '%s'.", name)
+                self.inputs[key[0]] = (midiin, name)
+
+            # A RefaceDX takes over the callback of its input, so only one may use it
+            for other in [other for other in self.refaces if other[0] == key[0]]:
+                del self.refaces[other]
+            self.refaces[key] = self.refacedx_class(self.inputs[key[0]][0], self.output(output_port)[0])
+        return self.refaces[key]
+
+    def close_ports(self):
+        with self.midi_lock:
+            for midiobj, name in list(self.inputs.values()) + list(self.outputs.values()):
+                log.debug("Closing MIDI port '%s'.", name)
+                midiobj.close_port()
+            self.inputs.clear()
+            self.outputs.clear()
+            self.refaces.clear()
+
+    def forget_port(self, port):
+        """Close an output whose device went away, so it is opened again next time."""
+        entry = self.outputs.pop(str(port), None)
+        if entry is not None:
+            entry[0].close_port()
+        for key in [key for key in self.refaces if key[1] == str(port)]:
+            del self.refaces[key]
+
+    def do_ping(self):
+        return os.getpid()
+
+    def do_stop(self):
+        # shutdown() waits for serve_forever() to return, which runs in another thread
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def do_send_file(self, path, port="reface DX", delay=10):
+        with self.midi_lock:
+            midiout, name = self.output(port)
+            try:
+                self.soundmondo.send_sysex_file(path, midiout, name, delay)
+            except self.soundmondo.rtmidi.RtMidiError:
+                self.forget_port(port)
+                raise
+
+    def do_request_patch(self, patches=(), input_port="reface DX", output_port="reface DX", channel=1, device=1,
+                         path=".", output_path="{name}.syx", replace=False):
+        with self.midi_lock:
+            reface = self.reface(input_port, output_port)
+            reface.channel = max(1, min(16, channel)) - 1
+            # Drop replies to earlier requests that timed out
+            while not reface.queue.empty():
+                reface.queue.get_nowait()
+
+            written, existing = self.patches.save_patches(reface, patches, device, path, output_path, replace)
+
+        if not written and existing:
+            raise PatchExistsError("Patch received, but not saved, '%s' exists." % existing[0], existing)
+        if not written:
+            raise DaemonError("No patch was received.")
+        return written
+
+    def do_download_voice(self, voice_id, output_path="{name}.syx", replace=False, send=False, port="reface DX",
+                          delay=10):
+        """Download a voice, save it unless output_path is None and return the path saved to."""
+        data = self.soundmondo.download_voice(voice_id)
+        data.update(self.soundmondo.parse_timestamp(data.get("updated")))
+
+        voice_path = None
+        if output_path is not None:
+            try:
+                voice_path = self.soundmondo.save_voice(data, output_path, replace)
+            finally:
+                self.soundmondo.get_user_cache().save()
+
+        if send:
+            with self.midi_lock:
+                midiout, name = self.output(port)
+                log.info("Sending voice '%s' SysEx data to '%s'.", data["name"], name)
+                try:
+                    self.soundmondo.send_messages(midiout, data["messages"], delay)
+                except self.soundmondo.rtmidi.RtMidiError:
+                    self.forget_port(port)
+                    raise
+
+        return voice_path
+
+    def server_close(self):
+        super().server_close()
+        self.close_ports()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def serve(socket_path=None):
+    server = ToolsDaemon(socket_path or default_socket_path())
+
+    def stop(signum, frame):
+        server.do_stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    log.info("Tools daemon listening on '%s'.", server.socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        log.info("Tools daemon stopped.")
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-d", "--delay", type=int, default=10, metavar="MS",
+                    help="Delay between SysEx messages sent in milliseconds (default: %(default)s)")
+    ap.add_argument("-p", "--port", default="reface DX",
+                    help="MIDI output port number or name sub-string for 'send' (default: '%(default)s')")
+    ap.add_argument("-s", "--socket", metavar="PATH", help="Unix socket (default: %s)" % default_socket_path())
+    ap.add_argument("-v", "--debug", action="store_true", help="Enable debug logging")
+    ap.add_argument("command", nargs="?", default="serve", choices=("serve", "status", "stop", "send"),
+                    help="Run the daemon, check whether it runs, stop it or send a SysEx file through it "
+                    "(default: %(default)s)")
+    ap.add_argument("file", nargs="?", help="SysEx file for 'send'")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format="%(levelname)s: %(message)s")
+
+    try:
+        if args.command == "serve":
+            serve(args.socket)
+        elif args.command == "status":
+            result = forward("ping", args.socket, timeout=1.0)
+            if result is NOT_RUNNING:
+                print("Not running.")
+                return 1
+            print("Running, pid %i." % result)
+        elif args.command == "stop":
+            if forward("stop", args.socket, timeout=1.0) is NOT_RUNNING:
+                print("Not running.")
+                return 1
+        elif not args.file:
+            ap.error("'send' requires a SysEx file")
+        else:
+            call("send_file", args.socket, path=os.path.abspath(args.file), port=args.port, delay=args.delay)
+    except (OSError, DaemonError) as exc:
+        log.error("%s", exc)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+#
+# tools/emulator.py
+"""Reface DX emulator for testing and benchmarking without the synth.
+
+RefaceDXEmulator keeps an edit buffer and 32 voice slots and speaks the
+SysEx dialect of the Reface DX: dump requests for the voice are answered
+with checksummed bulk dumps of the edit buffer, received voice bulk dumps
+and parameter changes modify the edit buffer, and program changes load a
+slot into it. Replies are sent from a thread of their own after a
+configurable latency and jitter, like the callbacks of a real input port.
+
+The emulator can be reached in two ways:
+
+* loopback() returns an in-memory input and output with the part of the
+  rtmidi MidiIn/MidiOut interface the tools use, to pass to midiio.RefaceDX,
+  aiomidiio.AsyncRefaceDX or send_sysex_file() in the same process.
+* open_virtual_ports() opens virtual ALSA/JACK ports named 'reface DX', so
+  the browser and the command line tools find the emulator like the synth.
+
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from collections import Counter, deque
+from queue import Queue
+
+from .constants import (ADDRESS_FOOTER, ADDRESS_HEADER, ADDRESS_SYSTEM, ADDRESS_VOICE_COMMON, ADDRESSES_VOICE_BLOCK,
+                        REFACE_DX_MODEL_ID, YAMAHA_MANUFACTURER_ID)
+from . import voicepack
+
+
+log = logging.getLogger(__name__)
+
+SLOT_COUNT = 32
+COMMON_DATA_LENGTH = 38
+OPERATOR_DATA_LENGTH = 28
+SYSTEM_DATA_LENGTH = 32
+DUMP_HEADER_LENGTH = 11         # F0 43 0n 7F 1C bh bl 05 ah am al
+PROGRAM_CHANGE = 0xC0
+SYSTEM_EXCLUSIVE = 0xF0
+END_OF_EXCLUSIVE = 0xF7
+DATA_LENGTHS = {
+    ADDRESS_HEADER: 0,
+    ADDRESS_VOICE_COMMON: COMMON_DATA_LENGTH,
+    (0x31, 0, 0): OPERATOR_DATA_LENGTH,
+    (0x31, 1, 0): OPERATOR_DATA_LENGTH,
+    (0x31, 2, 0): OPERATOR_DATA_LENGTH,
+    (0x31, 3, 0): OPERATOR_DATA_LENGTH,
+    ADDRESS_FOOTER: 0,
+}
+
+
+def checksum(msg):
+    """Return the checksum of a bulk dump: the model ID, address and data bytes sum to 0 with it."""
+    return -sum(msg[7:-2]) & 0x7F
+
+
+def bulk_dump(address, data=b"", device=0):
+    """Return a bulk dump message of data at address."""
+    count = 4 + len(data)       # Model ID, address and data
+    msg = bytearray([SYSTEM_EXCLUSIVE, YAMAHA_MANUFACTURER_ID, device & 0x0F, 0x7F, 0x1C, count >> 7, count & 0x7F,
+                     REFACE_DX_MODEL_ID, *address])
+    msg += data
+    msg += b"\0\xF7"
+    msg[-2] = checksum(msg)
+    return bytes(msg)
+
+
+def voice_messages(voice_data, device=0):
+    """Return the seven bulk dumps of a voice given as {address: data}."""
+    return [bulk_dump(address, voice_data.get(address, b""), device) for address in ADDRESSES_VOICE_BLOCK]
+
+
+def parse_voice(data):
+    """Return {address: data} of the common and operator data in a voice file's contents, or None."""
+    parts = {}
+    start = 0
+    for address in ADDRESSES_VOICE_BLOCK:
+        start = data.find(SYSTEM_EXCLUSIVE, start)
+        end = data.find(END_OF_EXCLUSIVE, start)
+        if start < 0 or end < 0:
+            return None
+
+        msg = data[start:end + 1]
+        if tuple(msg[8:11]) != address or len(msg) != DUMP_HEADER_LENGTH + DATA_LENGTHS[address] + 2:
+            return None
+        parts[address] = bytearray(msg[DUMP_HEADER_LENGTH:-2])
+        start = end + 1
+
+    return parts
+
+
+def init_voice(name="Init Voice"):
+    """Return {address: data} of an empty voice with only its name set, for slots nothing was loaded into."""
+    common = bytearray(COMMON_DATA_LENGTH)
+    common[:10] = name.ljust(10)[:10].encode("ascii")
+    voice = {ADDRESS_VOICE_COMMON: common}
+    for op in range(4):
+        voice[(0x31, op, 0)] = bytearray(OPERATOR_DATA_LENGTH)
+    return voice
+
+
+def load_voices(sources):
+    """Return the voices of folders of SysEx files and voice packs as {address: data} dicts, in order."""
+    voices = []
+    for source in sources:
+        if source.endswith(voicepack.PACK_EXTENSION):
+            pack = voicepack.open_pack(source)
+            datas = [pack.voice(index) for index in range(len(pack))]
+        else:
+            datas = []
+            for dirpath, dirnames, filenames in os.walk(source):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.lower().endswith(".syx"):
+                        with open(os.path.join(dirpath, name), "rb") as fp:
+                            datas.append(fp.read())
+
+        voices += [voice for voice in map(parse_voice, datas) if voice is not None]
+    return voices
+
+
+class RefaceDXEmulator:
+    """Edit buffer, voice slots and MIDI behaviour of a Reface DX.
+
+    receive() takes the messages sent to the synth. Replies are passed to
+    the functions registered with connect() on the reply thread, latency
+    plus up to jitter seconds later and in order. channel is the receive
+    channel of program changes (0-15, None for all), device the device
+    number dump requests must have (None for any).
+
+    """
+
+    def __init__(self, voices=(), channel=0, device=None, latency=0.0, jitter=0.0, seed=None):
+        self.slots = [dict(voice) for voice in list(voices)[:SLOT_COUNT]]
+        self.slots += [init_voice("Init %02i" % (slot + 1)) for slot in range(len(self.slots), SLOT_COUNT)]
+        self.program = 0
+        self.edit = self._copy(self.slots[0])
+        self.system = bytearray(SYSTEM_DATA_LENGTH)
+        self.channel = channel
+        self.device = device
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self._listeners = []
+        self._incoming = None       # Parts of a voice bulk dump being received
+        self._lock = threading.Lock()
+        self._replies = Queue()
+        self._last_due = 0.0
+        self._thread = threading.Thread(target=self._send_replies, name="reface-emulator", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _copy(voice):
+        return {address: bytearray(data) for address, data in voice.items()}
+
+    def connect(self, send):
+        """Call send(msg) with every message the emulator sends."""
+        self._listeners.append(send)
+
+    def disconnect(self, send):
+        self._listeners.remove(send)
+
+    def close(self):
+        self._replies.put(None)
+        self._thread.join()
+
+    def voice_name(self, voice=None):
+        common = (voice or self.edit)[ADDRESS_VOICE_COMMON]
+        return common[:10].decode("ascii", "replace").rstrip()
+
+    def edit_voice(self, device=0):
+        """Return the edit buffer as the contents of a voice file."""
+        with self._lock:
+            return b"".join(voice_messages(self.edit, device))
+
+    def store(self, slot):
+        """Store the edit buffer in a slot (0-31), like the STORE button."""
+        with self._lock:
+            self.slots[slot] = self._copy(self.edit)
+
+    def receive(self, msg):
+        """Handle a message sent to the synth."""
+        msg = bytes(msg)
+        if not msg:
+            return
+
+        with self._lock:
+            if msg[0] & 0xF0 == PROGRAM_CHANGE:
+                self._program_change(msg)
+            elif (msg[0] == SYSTEM_EXCLUSIVE and len(msg) >= 10 and msg[1] == YAMAHA_MANUFACTURER_ID
+                  and msg[3:5] == b"\x7F\x1C" and msg[-1] == END_OF_EXCLUSIVE):
+                kind = msg[2] & 0xF0
+                if kind == 0x20:
+                    self._dump_request(msg)
+                elif kind == 0x10:
+                    self._parameter_change(msg)
+                elif kind == 0x00:
+                    self._bulk_dump(msg)
+            else:
+                self.stats["ignored"] += 1
+
+    def _program_change(self, msg):
+        if len(msg) < 2 or (self.channel is not None and msg[0] & 0x0F != self.channel):
+            self.stats["ignored"] += 1
+            return
+
+        if msg[1] < SLOT_COUNT:
+            self.program = msg[1]
+            self.edit = self._copy(self.slots[self.program])
+            self.stats["program changes"] += 1
+            log.debug("Program %i: %s", self.program + 1, self.voice_name())
+
+    def _dump_request(self, msg):
+        device = msg[2] & 0x0F
+        address = tuple(msg[6:9])
+        if msg[5] != REFACE_DX_MODEL_ID or (self.device is not None and device != self.device):
+            self.stats["ignored"] += 1
+        elif address == ADDRESS_HEADER:
+            self.stats["dump requests"] += 1
+            self._reply(voice_messages(self.edit, device))
+        elif address == ADDRESS_SYSTEM:
+            self.stats["dump requests"] += 1
+            self._reply([bulk_dump(ADDRESS_SYSTEM, self.system, device)])
+        else:
+            log.debug("Dump request for unknown address %r.", address)
+            self.stats["ignored"] += 1
+
+    def _parameter_change(self, msg):
+        address = tuple(msg[6:9])
+        data = msg[9:-1]
+        high, mid, offset = address
+        if address[:2] == (0x30, 0):
+            target, length = self.edit[ADDRESS_VOICE_COMMON], COMMON_DATA_LENGTH
+        elif high == 0x31 and mid < 4:
+            target, length = self.edit[(0x31, mid, 0)], OPERATOR_DATA_LENGTH
+        elif address[:2] == (0, 0):
+            target, length = self.system, SYSTEM_DATA_LENGTH
+        else:
+            target = None
+
+        if msg[5] != REFACE_DX_MODEL_ID or target is None or offset + len(data) > length:
+            log.debug("Ignoring parameter change at %r.", address)
+            self.stats["ignored"] += 1
+            return
+
+        target[offset:offset + len(data)] = data
+        self.stats["parameter changes"] += 1
+
+    def _bulk_dump(self, msg):
+        address = tuple(msg[8:11])
+        count = (msg[5] << 7) | msg[6]
+        if (msg[7] != REFACE_DX_MODEL_ID or address not in DATA_LENGTHS or count != len(msg) - 9
+                or len(msg) != DUMP_HEADER_LENGTH + DATA_LENGTHS[address] + 2):
+            self.stats["ignored"] += 1
+            return
+
+        if msg[-2] != checksum(msg):
+            log.debug("Checksum error in bulk dump at %r, dropping the voice.", address)
+            self.stats["checksum errors"] += 1
+            self._incoming = None
+            return
+
+        if address == ADDRESS_HEADER:
+            self._incoming = {}
+        elif self._incoming is None:
+            # A part without the header before it
+            self.stats["ignored"] += 1
+        elif address == ADDRESS_FOOTER:
+            if len(self._incoming) == len(ADDRESSES_VOICE_BLOCK) - 2:
+                self.edit = self._incoming
+                self.stats["voices received"] += 1
+                log.debug("Received voice '%s'.", self.voice_name())
+            else:
+                self.stats["ignored"] += 1
+            self._incoming = None
+        else:
+            self._incoming[address] = bytearray(msg[DUMP_HEADER_LENGTH:-2])
+
+    def _reply(self, messages):
+        now = time.monotonic()
+        due = max(self._last_due, now + self.latency + self.random.uniform(0, self.jitter))
+        self._last_due = due
+        self._replies.put((due, messages))
+
+    def _send_replies(self):
+        while True:
+            item = self._replies.get()
+            if item is None:
+                return
+
+            due, messages = item
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            for msg in messages:
+                for send in list(self._listeners):
+                    send(list(msg))
+                self.stats["messages sent"] += 1
+
+
+class LoopbackMidiIn:
+    """In-memory input receiving what an emulator sends, with the MidiIn methods the tools use."""
+
+    def __init__(self, emulator, name="reface DX emulator"):
+        self.emulator = emulator
+        self.name = name
+        self._callback = None
+        self._data = None
+        self._ignore_sysex = True
+        self._messages = deque(maxlen=1024)
+        self._last = None
+        emulator.connect(self._deliver)
+
+    def _deliver(self, msg):
+        if self._ignore_sysex and msg[0] == SYSTEM_EXCLUSIVE:
+            return
+
+        now = time.monotonic()
+        delta = 0.0 if self._last is None else now - self._last
+        self._last = now
+        if self._callback is not None:
+            self._callback((msg, delta), self._data)
+        else:
+            self._messages.append((msg, delta))
+
+    def ignore_types(self, sysex=True, timing=True, active_sense=True):
+        self._ignore_sysex = sysex
+
+    def set_callback(self, func, data=None):
+        self._callback = func
+        self._data = data
+
+    def cancel_callback(self):
+        self._callback = None
+
+    def get_message(self):
+        return self._messages.popleft() if self._messages else None
+
+    def get_port_name(self, port=0):
+        return self.name
+
+    def is_port_open(self):
+        return self._deliver in self.emulator._listeners
+
+    def close_port(self):
+        if self.is_port_open():
+            self.emulator.disconnect(self._deliver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close_port()
+
+
+class LoopbackMidiOut:
+    """In-memory output passing messages to an emulator, with the MidiOut methods the tools use."""
+
+    def __init__(self, emulator, name="reface DX emulator"):
+        self.emulator = emulator
+        self.name = name
+        self._open = True
+
+    def send_message(self, message):
+        if self._open:
+            self.emulator.receive(message)
+
+    def get_port_name(self, port=0):
+        return self.name
+
+    def is_port_open(self):
+        return self._open
+
+    def close_port(self):
+        self._open = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close_port()
+
+
+def loopback(emulator):
+    """Return an in-memory (midiin, midiout) pair connected to the emulator."""
+    return LoopbackMidiIn(emulator), LoopbackMidiOut(emulator)
+
+
+def open_virtual_ports(emulator, name="reface DX"):
+    """Open virtual rtmidi ports called name for the emulator and return (midiin, midiout)."""
+    import rtmidi
+
+    midiin = rtmidi.MidiIn(name=name + " emulator")
+    midiin.ignore_types(sysex=False)
+    midiin.set_callback(lambda event, data: emulator.receive(event[0]))
+    midiin.open_virtual_port(name)
+
+    midiout = rtmidi.MidiOut(name=name + " emulator")
+    midiout.open_virtual_port(name)
+    emulator.connect(midiout.send_message)
+    return midiin, midiout
+
+
+def benchmark(emulator, count=100, voice=None):
+    """Time patch requests, voice sends and program changes through midiio.RefaceDX on a loopback."""
+    from .get_soundmondo_voice import send_messages
+    from .midiio import RefaceDX
+    from .util import split_sysex
+
+    midiin, midiout = loopback(emulator)
+    reface = RefaceDX(midiin, midiout, timeout=5.0)
+    messages = split_sysex(voice or emulator.edit_voice())
+    results = {}
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(count):
+        start = time.perf_counter()
+        reface.patch_request()
+        latencies.append(time.perf_counter() - start)
+    results["patch requests/s"] = count / (time.perf_counter() - started)
+    latencies.sort()
+    results["patch request p50 ms"] = latencies[len(latencies) // 2] * 1000
+    results["patch request p95 ms"] = latencies[int(len(latencies) * 0.95)] * 1000
+
+    started = time.perf_counter()
+    for _ in range(count):
+        send_messages(midiout, messages, delay=0)
+    results["voice sends/s"] = count / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for i in range(count):
+        reface.send_program_change(i % SLOT_COUNT)
+    results["program changes/s"] = count / (time.perf_counter() - started)
+
+    midiin.close_port()
+    return results
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-b", "--bench", action="store_true",
+                    help="Benchmark the MIDI tools against the emulator on a loopback instead of serving")
+    ap.add_argument("-c", "--channel", type=int, default=1,
+                    help="Receive channel of program changes, 0 for all (default: %(default)s)")
+    ap.add_argument("-D", "--device", type=int, help="Only answer dump requests for this device number (default: any)")
+    ap.add_argument("-j", "--jitter", type=float, default=0.0, metavar="MS",
+                    help="Random extra reply latency of up to MS milliseconds (default: %(default)s)")
+    ap.add_argument("-l", "--latency", type=float, default=0.0, metavar="MS",
+                    help="Reply latency in milliseconds (default: %(default)s)")
+    ap.add_argument("-n", "--count", type=int, default=200, help="Operations per benchmark (default: %(default)s)")
+    ap.add_argument("-p", "--port-name", default="reface DX", help="Name of the virtual ports (default: '%(default)s')")
+    ap.add_argument("-s", "--seed", type=int, help="Seed of the jitter")
+    ap.add_argument("-v", "--debug", action="store_true", help="Enable debug logging")
+    ap.add_argument("sources", nargs="*", metavar="SOURCE",
+                    help="Folders of voice files or voice packs to fill the slots from")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format="%(levelname)s: %(message)s")
+
+    try:
+        voices = load_voices(args.sources)
+    except (OSError, voicepack.PackError) as exc:
+        log.error("%s", exc)
+        return 1
+
+    emulator = RefaceDXEmulator(voices, None if args.channel == 0 else args.channel - 1, args.device,
+                                args.latency / 1000, args.jitter / 1000, args.seed)
+    log.info("Slots filled with %i voices, program 1 is '%s'.", min(len(voices), SLOT_COUNT), emulator.voice_name())
+
+    if args.bench:
+        for name, value in benchmark(emulator, args.count).items():
+            print("%-22s %10.2f" % (name, value))
+        emulator.close()
+        return
+
+    try:
+        midiin, midiout = open_virtual_ports(emulator, args.port_name)
+    except Exception as exc:
+        log.error("Cannot open virtual MIDI ports: %s", exc)
+        emulator.close()
+        return 1
+
+    log.info("Emulating a Reface DX on the virtual ports '%s'.", args.port_name)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        midiin.close_port()
+        midiout.close_port()
+        emulator.close()
+        log.info("%s", ", ".join("%s: %i" % item for item in sorted(emulator.stats.items())) or "No messages.")
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# tools/framestats.py
+"""Frame-time and input-latency statistics for the wheel browser."""
+
+import logging
+import time
+
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of values, or None if there are none."""
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[rank - 1]
+
+
+class FrameStats:
+    """Keep the most recent frame and latency samples in fixed-size ring buffers.
+
+    Durations are stored in seconds.
+
+    """
+
+    def __init__(self, size=1000):
+        self.frame_starts = deque(maxlen=size)
+        self.draw_times = deque(maxlen=size)
+        self.coalesced = deque(maxlen=size)
+        self.latencies = deque(maxlen=size)
+        self.frames = 0
+
+    def record_frame(self, start, duration, coalesced=0):
+        self.frame_starts.append(start)
+        self.draw_times.append(duration)
+        self.coalesced.append(coalesced)
+        self.frames += 1
+
+    def record_latency(self, seconds):
+        self.latencies.append(seconds)
+
+    def fps(self, window=1.0):
+        """Return the number of frames started within the last window seconds."""
+        if not self.frame_starts:
+            return 0.0
+
+        latest = self.frame_starts[-1]
+        count = 0
+        for start in reversed(self.frame_starts):
+            if latest - start > window:
+                break
+            count += 1
+
+        return count / window
+
+    def summary(self):
+        """Return a dict mapping each metric to its percentiles, in milliseconds where timed."""
+        return {
+            "draw_ms": {p: _scaled(percentile(self.draw_times, p), 1000) for p in PERCENTILES},
+            "coalesced_events": {p: percentile(self.coalesced, p) for p in PERCENTILES},
+            "tap_to_send_ms": {p: _scaled(percentile(self.latencies, p), 1000) for p in PERCENTILES},
+        }
+
+    def format_summary(self):
+        lines = ["frames recorded: %i (last %i kept)" % (self.frames, len(self.draw_times))]
+        for name, values in self.summary().items():
+            lines.append("%-18s %s" % (name, "  ".join(
+                "p%i=%s" % (p, "-" if v is None else "%.2f" % v) for p, v in values.items())))
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """Append a timestamped percentile summary to the file at path."""
+        try:
+            with open(path, "a") as fp:
+                fp.write("== %s ==\n%s\n\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), self.format_summary()))
+        except OSError as exc:
+            log.error("Could not write frame statistics to '%s': %s", path, exc)
+        else:
+            log.info("Frame statistics written to '%s'.", path)
+
+
+class PhaseTimer:
+    """Durations of consecutive phases, e.g. of starting up, measured from start."""
+
+    def __init__(self, start=None):
+        self.start = self.last = time.perf_counter() if start is None else start
+        self.phases = []
+
+    def mark(self, name):
+        """End the current phase, naming it name."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def format(self):
+        lines = ["%-22s %8.1f ms" % (name, duration * 1000) for name, duration in self.phases]
+        lines.append("%-22s %8.1f ms" % ("total", (self.last - self.start) * 1000))
+        return "\n".join(lines)
+
+
+def _scaled(value, factor):
+    return None if value is None else value * factor
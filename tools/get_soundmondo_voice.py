@@ -6,20 +6,26 @@ Optionally send it via MIDI to the Reface DX.
 """
 
 import argparse
+import json
 import logging
 import os
 import re
 import string
 import sys
+import threading
 import time
 
 from datetime import datetime
-from os.path import basename, dirname, exists, splitext, split as pathsplit
+from functools import lru_cache
+from operator import itemgetter
+from os.path import basename, exists, splitext, split as pathsplit
 from posixpath import join as pjoin
 
 import requests
 import rtmidi
+from requests.adapters import HTTPAdapter
 from rtmidi.midiutil import list_output_ports, open_midioutput
+from urllib3.util.retry import Retry
 
 try:
     import cachecontrol
@@ -28,8 +34,12 @@ except ImportError:
     cachecontrol = None
 else:
     from appdirs import user_cache_dir
+    from cachecontrol.adapter import CacheControlAdapter
     from cachecontrol.heuristics import ExpiresAfter
 
+from . import daemon
+from .voicepack import read_file
+
 
 __appname__ = "reface-dx-lib"
 __appauthor__ = "chrisarndt.de"
@@ -57,8 +67,13 @@ PATH_SUBST_KEYS = (
     "year",
 )
 DATE_KEYS = ("year", "month", "day", "hour", "minute", "second")
+# Connections kept open to each host, enough for the workers of a mirror
+HTTP_POOL_SIZE = 16
+HTTP_RETRIES = 3
+USER_CACHE_MAX_AGE = 30 * 24 * 3600
 
 _http_session = None
+_user_cache = None
 log = logging.getLogger("get-soundmondo-voice")
 
 
@@ -76,23 +91,51 @@ def build_path(path, **data):
     return path.format(**subst)
 
 
-def download_voice(voice_id):
-    voice_url = pjoin(API_BASE_URL, "voices", voice_id) + "/"
-    resp = get_http_session().get(voice_url, headers={"Accept": "application/json"})
+class DownloadError(IOError):
+    """Raised when the server answers with an error status."""
+
+    def __init__(self, msg, status=None):
+        super().__init__(msg)
+        self.status = status
+
+
+class OutputExistsError(FileExistsError):
+    """Raised by save_voice() when the output file exists."""
+
+    def __init__(self, msg, path):
+        super().__init__(msg)
+        self.path = path
+
+
+def request_voice(voice_id, session=None, base_url=API_BASE_URL, headers=None):
+    """Request a voice and return the response, raising DownloadError unless it is 200 OK."""
+    voice_url = pjoin(base_url, "voices", str(voice_id)) + "/"
+    headers = dict(headers or {}, Accept="application/json")
+    resp = (session or get_http_session()).get(voice_url, headers=headers)
 
     if resp.status_code != 200:
-        raise IOError(
-            "Failed to retrieve voice data from '%s': %s" % (voice_url, resp.reason)
+        raise DownloadError(
+            "Failed to retrieve voice data from '%s': %s" % (voice_url, resp.reason),
+            resp.status_code,
+        )
+
+    log_response_headers(resp)
+    return resp
+
+
+def log_response_headers(resp):
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(
+            "Response headers:\n%s",
+            "\n".join("%s: %s" % (name, value) for name, value in resp.headers.items()),
         )
 
-    log.debug(
-        "Response headers:\n%s",
-        "\n".join("%s: %s" % (name, value) for name, value in resp.headers.items()),
-    )
 
+def parse_voice_response(resp):
     try:
         data = resp.json()
-        log.debug("Response data:\n%s", format_reponse_log(data))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Response data:\n%s", format_reponse_log(data))
         messages = parse_sysex_messages(data["data"]["sysex"])
         del data["data"]
     except (KeyError, TypeError, ValueError) as exc:
@@ -103,37 +146,167 @@ def download_voice(voice_id):
     return data
 
 
+def download_voice(voice_id, session=None, base_url=API_BASE_URL):
+    return parse_voice_response(request_voice(voice_id, session, base_url))
+
+
+def http_retry():
+    """Retry connection errors and overloaded servers, backing off and obeying Retry-After."""
+    return Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+        raise_on_status=False,
+    )
+
+
+def mount_pooled_adapter(session, pool_size=HTTP_POOL_SIZE, adapter_class=HTTPAdapter, **kwargs):
+    """Mount a keep-alive adapter with pool_size connections per host and retries on session."""
+    adapter = adapter_class(pool_connections=4, pool_maxsize=pool_size, max_retries=http_retry(), **kwargs)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def make_http_session(cache_dir=None, pool_size=HTTP_POOL_SIZE):
+    """Return a new pooled session, caching responses in cache_dir if cachecontrol is installed."""
+    if cachecontrol and cache_dir:
+        return mount_pooled_adapter(
+            requests.session(),
+            pool_size,
+            adapter_class=CacheControlAdapter,
+            cache=FileCache(cache_dir, forever=True),
+            heuristic=ExpiresAfter(days=14),
+        )
+
+    return mount_pooled_adapter(requests.session(), pool_size)
+
+
 def get_http_session():
+    """Return the session shared by all downloads of the process."""
     global _http_session
 
     if _http_session is None:
-        _http_session = requests.session()
-
-        if cachecontrol:
-            _http_session = cachecontrol.CacheControl(
-                _http_session,
-                cache=FileCache(
-                    user_cache_dir(__appname__, __appauthor__), forever=True
-                ),
-                heuristic=ExpiresAfter(days=14),
-            )
+        _http_session = make_http_session(
+            user_cache_dir(__appname__, __appauthor__) if cachecontrol else None
+        )
 
     return _http_session
 
 
-def get_user_info(user_url):
-    resp = get_http_session().get(user_url, headers={"Accept": "application/json"})
+def default_user_cache_path():
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, __appname__, "soundmondo-users.json")
+
+
+class UserCache:
+    """Soundmondo user information by user URL, kept in memory and in a JSON file.
+
+    Every user is downloaded once per max_age, however many voices by them
+    are saved and however many threads ask for them at the same time. Call
+    save() to write new entries to the file.
+
+    """
+
+    def __init__(self, path=None, max_age=USER_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._users = {}        # URL -> (time fetched, user info)
+        self._lock = threading.Lock()
+        self._fetching = {}     # URL -> lock held while downloading it
+        self._dirty = False
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                users = json.load(fp)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            log.warning("Ignoring unreadable user cache '%s': %s", self.path, exc)
+            return
+
+        if isinstance(users, dict):
+            now = time.time()
+            self._users.update((url, tuple(entry)) for url, entry in users.items()
+                               if isinstance(entry, list) and len(entry) == 2 and now - entry[0] < self.max_age)
+
+    def save(self):
+        """Write the cache to its file if users were added since it was read."""
+        if not self.path or not self._dirty:
+            return
+
+        with self._lock:
+            users = dict(self._users)
+            self._dirty = False
+
+        tmp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w") as fp:
+                json.dump(users, fp, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except OSError as exc:
+            log.warning("Could not write user cache '%s': %s", self.path, exc)
+
+    def _cached(self, user_url):
+        entry = self._users.get(user_url)
+        if entry is not None and time.time() - entry[0] < self.max_age:
+            return entry[1]
+
+    def get(self, user_url, session=None):
+        """Return the user information at user_url, downloading it only if it is not cached."""
+        info = self._cached(user_url)
+        if info is not None:
+            self.hits += 1
+            return info
+
+        with self._lock:
+            fetching = self._fetching.setdefault(user_url, threading.Lock())
+
+        # Threads wanting the same user wait for the first one's download
+        with fetching:
+            info = self._cached(user_url)
+            if info is not None:
+                self.hits += 1
+                return info
+
+            info = get_user_info(user_url, session)
+            self.misses += 1
+            with self._lock:
+                self._users[user_url] = (time.time(), info)
+                self._dirty = True
+                self._fetching.pop(user_url, None)
+
+        return info
+
+
+def get_user_cache():
+    """Return the user cache shared by all downloads of the process."""
+    global _user_cache
+
+    if _user_cache is None:
+        _user_cache = UserCache(default_user_cache_path())
+
+    return _user_cache
+
+
+def get_user_info(user_url, session=None):
+    resp = (session or get_http_session()).get(user_url, headers={"Accept": "application/json"})
 
     if resp.status_code != 200:
-        raise IOError(
+        raise DownloadError(
             "Failed to retrieve user information from '%s': %s"
-            % (user_url, resp.reason)
+            % (user_url, resp.reason),
+            resp.status_code,
         )
 
-    log.debug(
-        "Response headers:\n%s",
-        "\n".join("%s: %s" % (name, value) for name, value in resp.headers.items()),
-    )
+    log_response_headers(resp)
 
     try:
         return resp.json()
@@ -142,20 +315,39 @@ def get_user_info(user_url):
 
 
 def format_reponse_log(data):
-    import copy
-    import json
-    data = copy.deepcopy(data)
-    data["data"]["sysex"] = ["..."]
+    # Only the SysEx data is left out, so a shallow copy of the two dicts does
+    data = dict(data, data=dict(data["data"], sysex=["..."]))
     return json.dumps(data, indent=2)
 
 
+@lru_cache(maxsize=None)
+def _dense_getter(size):
+    """Return a function picking the values of keys '0' to 'size - 1' of a dict as a tuple."""
+    if size < 2:
+        # itemgetter() with one key returns the value itself, with none it fails
+        return lambda part: (part["0"],) if size else ()
+    return itemgetter(*[str(i) for i in range(size)])
+
+
+def parse_sysex_message(part):
+    """Return the bytes of a SysEx message given as a dict of byte index strings to byte values.
+
+    Messages from Soundmondo have every index from '0' up, which are picked
+    out in one go. Other dicts are sorted by index.
+
+    """
+    try:
+        return bytearray(_dense_getter(len(part))(part))
+    except KeyError:
+        return bytearray(v for _, v in sorted(part.items(), key=lambda i: int(i[0])))
+
+
 def parse_sysex_messages(data):
-    messages = []
+    messages = [parse_sysex_message(part) for part in data]
 
-    for i, part in enumerate(data):
-        msg = bytearray(v for _, v in sorted(part.items(), key=lambda i: int(i[0])))
-        log.debug("SysEx msg #%02i: %s", i, " ".join("%02X" % b for b in msg))
-        messages.append(msg)
+    if log.isEnabledFor(logging.DEBUG):
+        for i, msg in enumerate(messages):
+            log.debug("SysEx msg #%02i: %s", i, msg.hex(" ").upper())
 
     return messages
 
@@ -188,44 +380,96 @@ def sanitize_fn(fn, subst="_"):
 def send_sysex_file(filename, midiout, portname, delay=50):
     """Send contents of SysEx file to given MIDI output.
 
-    Reads file given by filename and sends all consecutive SysEx messages found
-    in it to given midiout.
+    Reads file given by filename, which may be a voice in a voice pack, and
+    sends all consecutive SysEx messages found in it to given midiout.
 
     """
     bn = basename(filename)
 
-    with open(filename, "rb") as sysex_file:
-        data = sysex_file.read()
+    data = read_file(filename)
+
+    if data.startswith(SYSTEM_EXCLUSIVE):
+        sox = 0
+        i = 0
 
-        if data.startswith(SYSTEM_EXCLUSIVE):
-            sox = 0
-            i = 0
+        log.info("Sending SysEx file '%s' data to '%s'.", filename, portname)
+        while sox >= 0:
+            sox = data.find(SYSTEM_EXCLUSIVE, sox)
 
-            log.info("Sending SysEx file '%s' data to '%s'.", filename, portname)
-            while sox >= 0:
-                sox = data.find(SYSTEM_EXCLUSIVE, sox)
+            if sox >= 0:
+                eox = data.find(END_OF_EXCLUSIVE, sox)
 
-                if sox >= 0:
-                    eox = data.find(END_OF_EXCLUSIVE, sox)
+                if eox >= 0:
+                    sysex_msg = data[sox:eox + 1]
+                    # Python 2: convert data into list of integers
+                    if isinstance(sysex_msg, str):
+                        sysex_msg = [ord(c) for c in sysex_msg]
 
-                    if eox >= 0:
-                        sysex_msg = data[sox:eox + 1]
-                        # Python 2: convert data into list of integers
-                        if isinstance(sysex_msg, str):
-                            sysex_msg = [ord(c) for c in sysex_msg]
+                    log.debug("Sending '%s' message #%03i...", bn, i)
+                    midiout.send_message(sysex_msg)
+                    time.sleep(0.001 * delay)
 
-                        log.debug("Sending '%s' message #%03i...", bn, i)
-                        midiout.send_message(sysex_msg)
-                        time.sleep(0.001 * delay)
+                    i += 1
+                else:
+                    break
+
+                sox = eox + 1
+    else:
+        log.warning("File '%s' does not start with a SysEx message.", bn)
 
-                        i += 1
-                    else:
-                        break
 
-                    sox = eox + 1
+def save_voice(data, output_path, replace=False, session=None, user_cache=None):
+    """Write a downloaded voice to the file named by substituting data into output_path.
+
+    Returns the path of the file written. Raises OutputExistsError if it
+    exists and replace is false, IOError if the user information could not
+    be downloaded. User information comes from user_cache, by default the
+    one shared by the process.
+
+    """
+    if "{user" in output_path:
+        try:
+            user_info = (user_cache or get_user_cache()).get(data["user"], session)
+        except Exception as exc:
+            raise IOError("Error downloading user information: %s" % exc)
         else:
-            log.warning("File '%s' does not start with a SysEx message.", bn)
+            data["user"] = user_info.get(
+                "display_name", "user-{}".format(user_info["id"])
+            )
+            data["user_id"] = user_info["id"]
+
+    voice_path = build_path(output_path, **data)
+    log.debug("Output path (after substitution): %s", voice_path)
+
+    if not splitext(voice_path)[1]:
+        voice_path += ".syx"
+
+    if not replace and exists(voice_path):
+        raise OutputExistsError(
+            "Output path '%s' exist. Use option '-f/--force' to overwrite." % output_path,
+            voice_path,
+        )
+
+    head, tail = pathsplit(voice_path)
+    if head:
+        os.makedirs(head, exist_ok=True)
+
+    with open(voice_path, "wb") as fp:
+        log.info(
+            "Writing voice '%s' SysEx data to '%s'.",
+            data["name"],
+            voice_path,
+        )
+        write_sysex_to_file(fp, data["messages"])
+
+    return voice_path
+
 
+def send_messages(midiout, messages, delay=10):
+    for i, msg in enumerate(messages):
+        time.sleep(0.001 * delay)
+        log.debug("Sending message #%03i...", i)
+        midiout.send_message(msg)
 
 
 def write_sysex_to_file(fobj, messages):
@@ -233,6 +477,41 @@ def write_sysex_to_file(fobj, messages):
         fobj.write(msg)
 
 
+def forward_to_daemon(args):
+    """Hand the download or send given by the command line to a running tools daemon.
+
+    Returns the exit status, or None if no daemon is running.
+
+    """
+    if args.voice_id:
+        vid = parse_voice_id(args.voice_id)
+        if not vid:
+            return None
+
+        command = "download_voice"
+        params = dict(
+            voice_id=vid,
+            output_path=None if args.no_file_output else os.path.abspath(args.output_path),
+            replace=args.replace,
+            send=bool(args.send_midi),
+        )
+    else:
+        command = "send_file"
+        params = dict(path=os.path.abspath(args.send_midi))
+
+    try:
+        result = daemon.forward(command, port=args.port, delay=args.delay, **params)
+    except daemon.DaemonError as exc:
+        log.error(exc)
+        return 1
+
+    if result is daemon.NOT_RUNNING:
+        return None
+    if result:
+        log.info("Voice SysEx data written to '%s'.", result)
+    return 0
+
+
 def main(args=None):
     parser = argparse.ArgumentParser(description=__doc__)
     padd = parser.add_argument
@@ -266,6 +545,12 @@ def main(args=None):
         default="{name}.syx",
         help="Path of output file to write SysEx data to (default: '%(default)s')",
     )
+    padd(
+        "-n",
+        "--no-daemon",
+        action="store_true",
+        help="Don't hand the download or send to a running tools daemon",
+    )
     padd(
         "-O",
         "--no-file-output",
@@ -315,6 +600,11 @@ def main(args=None):
         parser.print_help()
         return 2
 
+    if not args.no_daemon and args.port is not None and args.output_path != "-":
+        status = forward_to_daemon(args)
+        if status is not None:
+            return status
+
     if args.voice_id:
         vid = parse_voice_id(args.voice_id)
         if not vid:
@@ -330,49 +620,21 @@ def main(args=None):
             data.update(parse_timestamp(data.get("updated")))
 
         if not args.no_file_output:
-            if "{user" in args.output_path:
-                try:
-                    user_info = get_user_info(data["user"])
-                except Exception as exc:
-                    log.error("Error downloading user information: %s", exc)
-                    return 1
-                else:
-                    data["user"] = user_info.get(
-                        "display_name", "user-{}".format(user_info["id"])
-                    )
-                    data["user_id"] = user_info["id"]
-
-            output_path = build_path(args.output_path, **data)
-            log.debug("Output path (after substitution): %s", output_path)
-
-            if output_path == "-":
+            if args.output_path == "-":
                 write_sysex_to_file(sys.stdout, data["messages"])
             else:
-                if not splitext(output_path)[1]:
-                    output_path += ".syx"
-
-                if not args.replace and exists(output_path):
-                    log.error(
-                        "Output path '%s' exist. Use option '-f/--force' to overwrite.",
-                        args.output_path,
-                    )
+                try:
+                    save_voice(data, args.output_path, args.replace)
+                except IOError as exc:
+                    log.error("%s", exc)
                     return 1
-                else:
-                    head, tail = pathsplit(output_path)
-                    if head and not exists(head):
-                        os.makedirs(dirname(head))
-
-                    with open(output_path, "wb") as fp:
-                        log.info(
-                            "Writing voice '%s' SysEx data to '%s'.",
-                            data["name"],
-                            output_path,
-                        )
-                        write_sysex_to_file(fp, data["messages"])
+                finally:
+                    get_user_cache().save()
 
     if args.send_midi:
         try:
-            midiout, portname = open_midioutput(args.port)
+            # Only ask for a port on a terminal, e.g. not when started by the browser
+            midiout, portname = open_midioutput(args.port, interactive=sys.stdin.isatty())
         except rtmidi.InvalidPortError:
             log.error("Invalid MIDI port number or name.")
             log.error("Use '-l' option to list MIDI ports.")
@@ -386,10 +648,7 @@ def main(args=None):
                 log.info(
                     "Sending voice '%s' SysEx data to '%s'.", data["name"], portname
                 )
-                for i, msg in enumerate(data["messages"]):
-                    time.sleep(0.001 * args.delay)
-                    log.debug("Sending message #%03i...", i)
-                    midiout.send_message(msg)
+                send_messages(midiout, data["messages"], args.delay)
         elif args.send_midi is not OPTION_DEFAULT:
             try:
                 with midiout:
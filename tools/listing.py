@@ -0,0 +1,654 @@
+# -*- coding: utf-8 -*-
+#
+# tools/listing.py
+"""Cached directory listings kept fresh by a directory watcher thread."""
+
+import abc
+import bisect
+import ctypes
+import ctypes.util
+import heapq
+import logging
+import os
+import re
+import select
+import stat
+import struct
+import threading
+
+from array import array
+from collections import OrderedDict
+from operator import attrgetter, itemgetter
+from queue import Empty, Queue
+
+
+log = logging.getLogger(__name__)
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CREATE | IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+              | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII")
+
+# Listing entry flags
+IS_DIR = 0x01
+IS_LINK = 0x02
+
+SORT_ORDERS = ("natural", "mtime", "recent", "patch")
+NATURAL_RX = re.compile(r"(\d+)")
+
+
+def natural_key(name):
+    """Sort key comparing runs of digits by value, e.g. 'DX11-2' before 'DX11-10'."""
+    return tuple(int(part) if i % 2 else part.lower() for i, part in enumerate(NATURAL_RX.split(name)))
+
+
+def read_patch_name(path):
+    """Return the voice name stored in a Reface DX SysEx file, or None."""
+    from .constants import PATCH_NAME_LENGTH, PATCH_NAME_OFFSET
+
+    if not path.lower().endswith(".syx"):
+        return None
+
+    try:
+        with open(path, "rb") as syx:
+            data = syx.read(PATCH_NAME_OFFSET + PATCH_NAME_LENGTH)
+    except OSError:
+        return None
+
+    if len(data) < PATCH_NAME_OFFSET + PATCH_NAME_LENGTH:
+        return None
+
+    return data[PATCH_NAME_OFFSET:].decode("ascii", "replace").rstrip()
+
+
+def entry_info(entry):
+    """Return (flags, size, mtime) of an os.DirEntry, following symlinks."""
+    flags = IS_LINK if entry.is_symlink() else 0
+    try:
+        st = entry.stat()
+    except OSError:
+        # Dangling symlink
+        return flags, 0, 0.0
+
+    if stat.S_ISDIR(st.st_mode):
+        flags |= IS_DIR
+    return flags, st.st_size, st.st_mtime
+
+
+def path_info(path):
+    """Return (flags, size, mtime) of a path, following symlinks."""
+    try:
+        flags = IS_LINK if stat.S_ISLNK(os.lstat(path).st_mode) else 0
+        st = os.stat(path)
+    except OSError:
+        return (IS_LINK if os.path.islink(path) else 0), 0, 0.0
+
+    if stat.S_ISDIR(st.st_mode):
+        flags |= IS_DIR
+    return flags, st.st_size, st.st_mtime
+
+
+class Listing:
+    """Entries of one directory, sorted by name.
+
+    The type flags, sizes and modification times of the entries are stored in
+    compact arrays parallel to the list of names, so nothing needs to be
+    stat'ed again after the directory was scanned once.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.title = os.path.basename(path) if path else ""
+        self.names = []
+        self.flags = array("B")
+        self.sizes = array("q")
+        self.mtimes = array("d")
+        self.key_cache = {}     # sort order -> {cache key: sort key}, see ListingView
+        self.keep_order = False
+
+    @classmethod
+    def scan(cls, path):
+        listing = cls(path)
+        with os.scandir(path) as entries:
+            for entry in sorted(entries, key=attrgetter("name")):
+                listing._append(entry.name, *entry_info(entry))
+        return listing
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return a listing saved with to_dict()."""
+        listing = cls(data["path"])
+        listing.names = list(data["names"])
+        listing.flags = array("B", data["flags"])
+        listing.sizes = array("q", data["sizes"])
+        listing.mtimes = array("d", data["mtimes"])
+        if not len(listing.names) == len(listing.flags) == len(listing.sizes) == len(listing.mtimes):
+            raise ValueError("Saved listing of '%s' is inconsistent." % data["path"])
+        return listing
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "names": self.names,
+            "flags": self.flags.tolist(),
+            "sizes": self.sizes.tolist(),
+            "mtimes": self.mtimes.tolist(),
+        }
+
+    def __len__(self):
+        return len(self.names)
+
+    def _append(self, name, flags, size, mtime):
+        self.names.append(name)
+        self.flags.append(flags)
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+
+    def index(self, name):
+        """Return the index of the entry called name, or -1."""
+        index = bisect.bisect_left(self.names, name)
+        if index < len(self.names) and self.names[index] == name:
+            return index
+        return -1
+
+    def is_dir(self, index):
+        return bool(self.flags[index] & IS_DIR)
+
+    def is_link(self, index):
+        return bool(self.flags[index] & IS_LINK)
+
+    def path_of(self, index):
+        return os.path.join(self.path, self.names[index])
+
+    def patch_name(self, index):
+        return read_patch_name(self.path_of(index))
+
+    def add(self, name):
+        """Insert or refresh the entry called name."""
+        self.put(name, *path_info(os.path.join(self.path, name)))
+
+    def put(self, name, flags, size, mtime):
+        """Insert or refresh the entry called name with the given type flags, size and mtime."""
+        index = bisect.bisect_left(self.names, name)
+
+        if index < len(self.names) and self.names[index] == name:
+            self.flags[index] = flags
+            self.sizes[index] = size
+            self.mtimes[index] = mtime
+        else:
+            self.names.insert(index, name)
+            self.flags.insert(index, flags)
+            self.sizes.insert(index, size)
+            self.mtimes.insert(index, mtime)
+
+    def remove(self, name):
+        index = self.index(name)
+        if index >= 0:
+            del self.names[index]
+            del self.flags[index]
+            del self.sizes[index]
+            del self.mtimes[index]
+
+    def merge(self, entries):
+        """Merge name-sorted (name, flags, size, mtime) tuples into the listing.
+
+        Entries already present are refreshed. The names list is updated in
+        place, so references to it stay valid.
+
+        """
+        if not entries:
+            return
+
+        names = []
+        flags = array("B")
+        sizes = array("q")
+        mtimes = array("d")
+
+        for name, flag, size, mtime in heapq.merge(zip(self.names, self.flags, self.sizes, self.mtimes), entries,
+                                                     key=itemgetter(0)):
+            if names and names[-1] == name:
+                flags[-1], sizes[-1], mtimes[-1] = flag, size, mtime
+                continue
+
+            names.append(name)
+            flags.append(flag)
+            sizes.append(size)
+            mtimes.append(mtime)
+
+        self.names[:] = names
+        self.flags = flags
+        self.sizes = sizes
+        self.mtimes = mtimes
+
+
+class PathListing(Listing):
+    """Entries from several directories, e.g. search results, in the given order.
+
+    With keep_order, the natural order of a view is the order of paths rather
+    than by name, e.g. for a list of recently used files. If the (flags, size,
+    mtime) of the paths are already known they can be passed as infos, so
+    the paths are not stat'ed.
+
+    """
+
+    def __init__(self, paths, title="Search Results", keep_order=False, infos=None):
+        super().__init__(None)
+        self.title = title
+        self.keep_order = keep_order
+        self.paths = list(paths)
+        if infos is None:
+            infos = map(path_info, self.paths)
+        for path, info in zip(self.paths, infos):
+            self._append(os.path.basename(path), *info)
+
+    def index(self, name):
+        try:
+            return self.names.index(name)
+        except ValueError:
+            return -1
+
+    def path_of(self, index):
+        return self.paths[index]
+
+
+class ListingView:
+    """A listing shown in one of the SORT_ORDERS.
+
+    The view only holds a permutation of the listing's entry indices plus the
+    names in that order. Sort keys are computed once per entry and kept in the
+    listing's key_cache, so switching orders or refreshing the view after the
+    listing changed just re-sorts an index array. recent maps paths to the
+    time they were last used.
+
+    """
+
+    def __init__(self, listing, order="natural", recent=None):
+        self.listing = listing
+        self.order = order
+        self.recent = {} if recent is None else recent
+        self.names = []
+        self.indices = array("I")
+        self.refresh()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def set_order(self, order):
+        self.order = order
+        self.refresh()
+
+    def refresh(self):
+        """Re-sort after the order or the listing changed."""
+        keys = self.sort_keys()
+        self.indices = array("I", sorted(range(len(keys)), key=keys.__getitem__))
+        names = self.listing.names
+        self.names[:] = [names[i] for i in self.indices]
+
+    def sort_keys(self):
+        listing = self.listing
+        natural = self._cached_keys("natural", listing.names, natural_key)
+
+        if self.order == "natural" and listing.keep_order:
+            return list(range(len(listing)))
+        elif self.order == "mtime":
+            return [(-mtime, key) for mtime, key in zip(listing.mtimes, natural)]
+        elif self.order == "recent":
+            if listing.path is None:
+                last_used = [self.recent.get(listing.path_of(i), 0) for i in range(len(listing))]
+            else:
+                by_name = {os.path.basename(path): used for path, used in self.recent.items()
+                           if os.path.dirname(path) == listing.path}
+                last_used = [by_name.get(name, 0) for name in listing.names]
+            return [(-used, key) for used, key in zip(last_used, natural)]
+        elif self.order == "patch":
+            # Patch names are read from the files, so they are cached per name and mtime
+            cache = listing.key_cache.setdefault("patch", {})
+            patch_keys = []
+            for i, entry in enumerate(zip(listing.names, listing.mtimes)):
+                key = cache.get(entry)
+                if key is None:
+                    key = cache[entry] = natural_key(listing.patch_name(i) or entry[0])
+                patch_keys.append(key)
+            return list(zip(patch_keys, natural))
+        else:
+            return natural
+
+    def _cached_keys(self, order, names, make_key):
+        cache = self.listing.key_cache.setdefault(order, {})
+        keys = []
+        for name in names:
+            key = cache.get(name)
+            if key is None:
+                key = cache[name] = make_key(name)
+            keys.append(key)
+        return keys
+
+    def index(self, name):
+        """Return the position of the entry called name in the view, or -1."""
+        try:
+            return self.names.index(name)
+        except ValueError:
+            return -1
+
+    def is_dir(self, position):
+        return self.listing.is_dir(self.indices[position])
+
+    def is_link(self, position):
+        return self.listing.is_link(self.indices[position])
+
+    def path_of(self, position):
+        return self.listing.path_of(self.indices[position])
+
+    def mtime(self, position):
+        return self.listing.mtimes[self.indices[position]]
+
+
+class ListingLoader(threading.Thread):
+    """Scan a directory on a worker thread, handing out the entries in chunks.
+
+    Each chunk is a name-sorted list of (name, flags, size, mtime) tuples to
+    be merged into the loader's listing by the consumer. The first chunk is
+    small so it arrives quickly, later ones double in size up to max_chunk.
+    None is queued after the last chunk; error holds the OSError if the scan
+    failed.
+
+    """
+
+    def __init__(self, path, first_chunk=32, max_chunk=4096):
+        super().__init__(name="listing-loader", daemon=True)
+        self.path = path
+        self.listing = Listing(path)
+        self.first_chunk = first_chunk
+        self.max_chunk = max_chunk
+        self.error = None
+        self.chunks = Queue()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        chunk = []
+        size = self.first_chunk
+
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if self._cancelled.is_set():
+                        return
+
+                    chunk.append((entry.name,) + entry_info(entry))
+                    if len(chunk) >= size:
+                        chunk.sort()
+                        self.chunks.put(chunk)
+                        chunk = []
+                        size = min(size * 2, self.max_chunk)
+        except OSError as exc:
+            self.error = exc
+
+        chunk.sort()
+        self.chunks.put(chunk)
+        self.chunks.put(None)
+
+    def ready(self):
+        """Yield the chunks queued since the last call, without blocking."""
+        while True:
+            try:
+                yield self.chunks.get_nowait()
+            except Empty:
+                return
+
+
+class ListingCache:
+    """Listings of recently visited directories.
+
+    At most max_dirs listings are kept, on_evict is called with the path of
+    each listing dropped from the cache.
+
+    """
+
+    def __init__(self, max_dirs=64, on_evict=None):
+        self.max_dirs = max_dirs
+        self.on_evict = on_evict
+        self._listings = OrderedDict()
+
+    def __contains__(self, path):
+        return path in self._listings
+
+    def get(self, path):
+        """Return the cached listing of path or None, without touching the file system."""
+        listing = self._listings.get(path)
+        if listing is not None:
+            self._listings.move_to_end(path)
+        return listing
+
+    def load(self, path):
+        """Scan path, cache and return its listing."""
+        listing = Listing.scan(path)
+        self.put(path, listing)
+        return listing
+
+    def put(self, path, listing):
+        self._listings[path] = listing
+        self._listings.move_to_end(path)
+
+        while len(self._listings) > self.max_dirs:
+            evicted, _ = self._listings.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(evicted)
+
+    def invalidate(self, path):
+        if self._listings.pop(path, None) is not None and self.on_evict:
+            self.on_evict(path)
+
+    def apply(self, path, added=(), removed=()):
+        """Update a cached listing in place and return it, or None if path is not cached."""
+        listing = self._listings.get(path)
+        if listing is None:
+            return None
+
+        for name in removed:
+            listing.remove(name)
+
+        for name in added:
+            listing.add(name)
+
+        return listing
+
+
+class DirectoryWatcher(threading.Thread, abc.ABC):
+    """Base class of the watcher threads reporting changes of watched directories.
+
+    Changes are queued as (path, added, removed) tuples of name sets. Files
+    that were written are reported as added again, so their size and mtime
+    are refreshed. Both sets are None if the directory must be listed again,
+    e.g. when it was removed or events were lost.
+
+    """
+
+    def __init__(self):
+        super().__init__(name=self.__class__.__name__, daemon=True)
+        self.changes = Queue()
+        self._stopped = threading.Event()
+
+    @abc.abstractmethod
+    def watch(self, path, names=None):
+        """Start reporting changes of the directory at path, currently holding names."""
+
+    @abc.abstractmethod
+    def unwatch(self, path):
+        """Stop reporting changes of the directory at path."""
+
+    def stop(self):
+        self._stopped.set()
+
+    def changed(self):
+        """Yield the changes queued since the last call, without blocking."""
+        while True:
+            try:
+                yield self.changes.get_nowait()
+            except Empty:
+                return
+
+
+class InotifyWatcher(DirectoryWatcher):
+    """Watch directories with Linux inotify."""
+
+    def __init__(self):
+        super().__init__()
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._lock = threading.Lock()
+        self._paths = {}    # watch descriptor -> path
+        self._wds = {}      # path -> watch descriptor
+
+    def watch(self, path, names=None):
+        with self._lock:
+            if path in self._wds:
+                return
+
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                log.warning("Cannot watch '%s': %s", path, os.strerror(ctypes.get_errno()))
+                return
+
+            self._wds[path] = wd
+            self._paths[wd] = path
+
+    def unwatch(self, path):
+        with self._lock:
+            wd = self._wds.pop(path, None)
+            if wd is not None:
+                self._paths.pop(wd, None)
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def run(self):
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([self._fd], [], [], 1.0)
+            if not readable:
+                continue
+
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                continue
+
+            for change in self._parse(data).items():
+                self.changes.put((change[0],) + change[1])
+
+        os.close(self._fd)
+
+    def _parse(self, data):
+        batch = {}
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0"))
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                with self._lock:
+                    for path in self._wds:
+                        batch[path] = (None, None)
+                continue
+
+            with self._lock:
+                path = self._paths.get(wd)
+                if mask & IN_IGNORED:
+                    self._paths.pop(wd, None)
+                    if self._wds.get(path) == wd:
+                        del self._wds[path]
+
+            if path is None:
+                continue
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                batch[path] = (None, None)
+                continue
+
+            added, removed = batch.setdefault(path, (set(), set()))
+            if added is None:
+                continue
+
+            if mask & (IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE):
+                # Files are usually created empty, their size and mtime are final once closed
+                added.add(name)
+                removed.discard(name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                removed.add(name)
+                added.discard(name)
+
+        return batch
+
+
+class PollingWatcher(DirectoryWatcher):
+    """Watch directories by comparing their modification times periodically."""
+
+    def __init__(self, interval=2.0):
+        super().__init__()
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._snapshots = {}    # path -> (mtime_ns, set of names)
+
+    def watch(self, path, names=None):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            names = set(os.listdir(path) if names is None else names)
+        except OSError as exc:
+            log.warning("Cannot watch '%s': %s", path, exc)
+            return
+
+        with self._lock:
+            self._snapshots[path] = (mtime, names)
+
+    def unwatch(self, path):
+        with self._lock:
+            self._snapshots.pop(path, None)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                snapshots = list(self._snapshots.items())
+
+            for path, (mtime, names) in snapshots:
+                try:
+                    current_mtime = os.stat(path).st_mtime_ns
+                    if current_mtime == mtime:
+                        continue
+                    current = set(os.listdir(path))
+                except OSError:
+                    self.unwatch(path)
+                    self.changes.put((path, None, None))
+                    continue
+
+                with self._lock:
+                    if path in self._snapshots:
+                        self._snapshots[path] = (current_mtime, current)
+
+                self.changes.put((path, current - names, names - current))
+
+
+def create_watcher(poll_interval=2.0):
+    """Return an inotify watcher where supported, otherwise a polling watcher."""
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError) as exc:
+        log.info("inotify not available (%s), polling directories instead.", exc)
+        return PollingWatcher(poll_interval)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# tools/ports.py
+"""Registry of the connected MIDI devices, kept up to date in the background.
+
+The ports are enumerated once with rtmidi and listed again whenever the ALSA
+sequencer announces that a client or port came or went, or, without the
+optional alsa-midi package, every few seconds. Each device gets a stable
+identity, its port name without the ALSA client and port numbers, which
+maps to its current input and output port names, so tools can be handed a
+port name that rtmidi finds for certain instead of an index into a list
+that may have changed.
+
+"""
+
+import argparse
+import logging
+import re
+import sys
+import threading
+import time
+
+from collections import namedtuple
+from queue import Empty, Queue
+
+
+log = logging.getLogger(__name__)
+
+ALSA_ADDRESS_RX = re.compile(r"\s+\d+:\d+$")
+ANNOUNCE_SETTLE_TIME = 0.2      # Devices announce several ports one after the other
+
+MidiDevice = namedtuple("MidiDevice", "identity input output")
+
+
+def port_identity(name):
+    """Return the name of a port without its ALSA address, e.g. 'reface DX:reface DX MIDI 1'."""
+    return ALSA_ADDRESS_RX.sub("", name)
+
+
+def build_devices(input_names, output_names):
+    """Return a dict of identity -> MidiDevice from lists of input and output port names.
+
+    Devices with the same name get numbered identities, e.g. 'reface DX #2'.
+
+    """
+    devices = {}
+    for direction, names in enumerate((input_names, output_names)):
+        seen = {}
+        for name in names:
+            identity = port_identity(name)
+            seen[identity] = count = seen.get(identity, 0) + 1
+            if count > 1:
+                identity = "%s #%i" % (identity, count)
+
+            device = devices.get(identity, MidiDevice(identity, None, None))
+            devices[identity] = device._replace(input=name) if direction == 0 else device._replace(output=name)
+
+    return devices
+
+
+class PortRegistry(threading.Thread):
+    """MIDI devices by identity, updated by a background thread.
+
+    Every time the set of ports changes, the list of device identities is
+    queued for changed(). Lookups by identity only read a dict, so they
+    can be done for every send.
+
+    """
+
+    def __init__(self, poll_interval=2.0, client_name="midipi"):
+        super().__init__(name="PortRegistry", daemon=True)
+        self.poll_interval = poll_interval
+        self.client_name = client_name
+        self.changes = Queue()
+        self._devices = {}
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def changed(self):
+        """Yield the device lists queued since the last call, without blocking."""
+        while True:
+            try:
+                yield self.changes.get_nowait()
+            except Empty:
+                return
+
+    def devices(self):
+        return list(self._devices)
+
+    def get(self, identity):
+        return self._devices.get(identity)
+
+    def input_name(self, identity):
+        device = self._devices.get(identity)
+        return device and device.input
+
+    def output_name(self, identity):
+        device = self._devices.get(identity)
+        return device and device.output
+
+    def run(self):
+        try:
+            import rtmidi
+            self._midiin = rtmidi.MidiIn(name=self.client_name + " ports")
+            self._midiout = rtmidi.MidiOut(name=self.client_name + " ports")
+        except Exception as exc:
+            log.error("Cannot list MIDI ports: %s", exc)
+            self.changes.put([])
+            return
+
+        self.rescan(force=True)
+        try:
+            self._wait_for_announcements()
+        except Exception as exc:
+            log.info("No ALSA sequencer announcements (%s), polling MIDI ports instead.", exc)
+            while not self._stopped.wait(self.poll_interval):
+                self.rescan()
+
+    def rescan(self, force=False):
+        own_port = self.client_name + " announcements:"
+        try:
+            devices = build_devices(self._midiin.get_ports(),
+                                    [name for name in self._midiout.get_ports() if not name.startswith(own_port)])
+        except Exception as exc:
+            log.error("Cannot list MIDI ports: %s", exc)
+            return
+
+        if force or devices != self._devices:
+            # Swapped as a whole, so lookups from other threads need no lock
+            self._devices = devices
+            log.debug("MIDI devices: %s", ", ".join(devices) or "none")
+            self.changes.put(list(devices))
+
+    def _wait_for_announcements(self):
+        from alsa_midi import SYSTEM_ANNOUNCE, WRITE_PORT, EventType, SequencerClient
+
+        announcements = (EventType.CLIENT_START, EventType.CLIENT_EXIT, EventType.PORT_START, EventType.PORT_EXIT,
+                         EventType.PORT_CHANGE)
+        client = SequencerClient(self.client_name + " announcements")
+        try:
+            port = client.create_port("announcements", caps=WRITE_PORT)
+            port.connect_from(SYSTEM_ANNOUNCE)
+            log.debug("Listening to ALSA sequencer announcements.")
+
+            while not self._stopped.is_set():
+                event = client.event_input(timeout=1.0)
+                if event is None or event.type not in announcements:
+                    continue
+
+                # Let the other ports of the device appear before listing them
+                time.sleep(ANNOUNCE_SETTLE_TIME)
+                client.drop_input()
+                self.rescan()
+        finally:
+            client.close()
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-w", "--watch", action="store_true", help="Keep listing the devices when they change")
+    ap.add_argument("-v", "--debug", action="store_true", help="Enable debug logging")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format="%(levelname)s: %(message)s")
+    registry = PortRegistry()
+    registry.start()
+
+    try:
+        while True:
+            identities = registry.changes.get()
+            for identity in identities:
+                device = registry.get(identity)
+                print("%s\n  in:  %s\n  out: %s" % (identity, device.input or "-", device.output or "-"))
+            if not identities:
+                print("No MIDI devices.")
+            if not args.watch:
+                break
+            print()
+    except KeyboardInterrupt:
+        pass
+    registry.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -14,11 +14,14 @@ import time
 from datetime import datetime
 from os.path import exists, join, splitext
 
+from rtmidi import RtMidiError
 from rtmidi.midiutil import open_midiinput, open_midioutput
 
+from . import daemon
 from .midiio import RefaceDX, TimeoutError
 from .util import get_patch_name
 
+
 log = logging.getLogger(__name__)
 
 ILLEGAL_CHARS = r'\/:*"<>|'
@@ -35,10 +38,15 @@ PATH_SUBST_KEYS = (
     "year",
 )
 DATE_KEYS = ("year", "month", "day", "hour", "minute", "second")
+# Exit status when patches were received but not saved, because their files exist
+# (argparse already uses 2 for usage errors)
+EXIT_PATCH_EXISTS = 3
+
 
 def sanitize_fn(fn, subst="_"):
     return "".join((c if c in ALLOWED_CHARS else "_") for c in fn)
 
+
 def build_path(path, **data):
     subst = {}
     for key in PATH_SUBST_KEYS:
@@ -52,6 +60,89 @@ def build_path(path, **data):
 
     return path.format(**subst)
 
+
+def parse_patches(specs):
+    """Return the sorted program numbers given as numbers or ranges (e.g. '9-16')."""
+    patches = set()
+    for patchspec in specs:
+        try:
+            if "-" in patchspec:
+                lo, hi = [int(i) for i in patchspec.split("-", 1)]
+                patches.update(range(lo, hi + 1))
+            else:
+                patches.add(int(patchspec))
+        except (TypeError, ValueError):
+            log.error("Invalid argument: %s", patchspec)
+
+    return sorted(patches)
+
+
+def save_patches(reface, patches, device=1, path=".", output_path="{name}.syx", replace=False):
+    """Request the given patches, or the edit buffer if there are none, and save them.
+
+    Returns the paths of the files written and those of the patches received
+    but not saved, because the file existed and replace was false.
+
+    """
+    written = []
+    existing = []
+    for patchno in patches or [None]:
+        if patchno is not None:
+            if 32 >= patchno >= 1:
+                log.info(
+                    "Sending program change #%i on channel %i...", patchno - 1, reface.channel + 1
+                )
+                reface.send_program_change(patchno - 1)
+                time.sleep(0.1)
+            else:
+                log.error(
+                    "Skipping patch number %i, which is out of range (1..32).", patchno
+                )
+                continue
+
+        try:
+            log.info("Sending patch dump request ...")
+            patch = reface.patch_request(device)
+        except TimeoutError:
+            log.error("Did not receive patch dump within timeout.")
+        else:
+            now = datetime.now()
+            data = {name: getattr(now, name) for name in DATE_KEYS}
+            data["name"] = get_patch_name(patch)
+
+            if patchno is not None:
+                data["program"] = patchno
+                data["slot"] = "{}-{}".format((patchno - 1) // 8 + 1, (patchno - 1) % 8 + 1)
+
+            # Combine the directory and the output path
+            output_file = build_path(output_path, **data)
+            patch_path = join(path, output_file)
+            log.info("Output path (after substitution): %s", patch_path)
+
+            if not splitext(patch_path)[1]:
+                patch_path += ".syx"
+
+            if exists(patch_path):
+                if replace:
+                    log.warn(
+                        "Existing output file '%s' will be overwritten.", patch_path
+                    )
+                else:
+                    log.warn(
+                        "Existing output file '%s' will not be overwritten.",
+                        patch_path,
+                    )
+                    existing.append(patch_path)
+                    continue
+
+            with open(patch_path, "wb") as sysex:
+                log.info("Writing patch '%s' to file '%s'...", data["name"], patch_path)
+                sysex.write(patch)
+            written.append(patch_path)
+
+    return written, existing
+
+
 def main(args=None):
     ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
     ap.add_argument(
@@ -104,6 +195,12 @@ def main(args=None):
         default="{name}.syx",
         help="Path of output file to write SysEx data to (default: '%(default)s')",
     )
+    ap.add_argument(
+        "-n",
+        "--no-daemon",
+        action="store_true",
+        help="Do not hand the request to a running tools daemon.",
+    )
     ap.add_argument(
         "-q",
         "--quiet",
@@ -130,80 +227,49 @@ def main(args=None):
         format="%(levelname)s - %(message)s",
     )
 
-    try:
-        midiin, midiin_name = open_midiinput(args.input_port)
-        midiout, midiout_name = open_midioutput(args.output_port)
-    except (EOFError, KeyboardInterrupt):
-        return 1
-
+    patches = parse_patches(args.patches)
     channel = max(1, min(16, args.channel))
-    reface = RefaceDX(midiin, midiout, channel=channel - 1)
-
-    if args.patches:
-        patches = set()
-        for patchspec in args.patches:
-            try:
-                if "-" in patchspec:
-                    lo, hi = [int(i) for i in patchspec.split("-", 1)]
-                    patches.update(range(lo, hi + 1))
-                else:
-                    patches.add(int(patchspec))
-            except (TypeError, ValueError):
-                log.error("Invalid argument: %s", patchspec)
-
-        args.patches = sorted(list(patches))
-
-    for patchno in args.patches or [None]:
-        if patchno is not None:
-            if 32 >= patchno >= 1:
-                log.info(
-                    "Sending program change #%i on channel %i...", patchno - 1, channel
-                )
-                reface.send_program_change(patchno - 1)
-                time.sleep(0.1)
-            else:
-                log.error(
-                    "Skipping patch number %i, which is out of range (1..32).", patchno
-                )
-                continue
 
+    if not args.no_daemon and args.input_port is not None and args.output_port is not None:
         try:
-            log.info("Sending patch dump request ...")
-            patch = reface.patch_request(args.device)
-        except TimeoutError:
-            log.error("Did not receive patch dump within timeout.")
-        else:
-            now = datetime.now()
-            data = {name: getattr(now, name) for name in DATE_KEYS}
-            data["name"] = get_patch_name(patch)
+            result = daemon.forward(
+                "request_patch",
+                patches=patches,
+                input_port=args.input_port,
+                output_port=args.output_port,
+                channel=channel,
+                device=args.device,
+                path=os.path.abspath(args.path),
+                output_path=args.output_path,
+                replace=args.replace,
+            )
+        except daemon.PatchExistsError as exc:
+            log.error("%s Use -r to replace it.", exc)
+            return EXIT_PATCH_EXISTS
+        except daemon.DaemonError as exc:
+            log.error("Patch request failed: %s", exc)
+            return 1
 
-            if patchno is not None:
-                data["program"] = patchno
-                data["slot"] = "{}-{}".format((patchno - 1) // 8 + 1, (patchno - 1) % 8 + 1)
-
-            # Combine the directory and the output path
-            output_file = build_path(args.output_path, **data)
-            output_path = join(args.path, output_file)
-            log.info("Output path (after substitution): %s", output_path)
-
-            if not splitext(output_path)[1]:
-                output_path += ".syx"
+        if result is not daemon.NOT_RUNNING:
+            for output_path in result:
+                log.info("Patch saved to '%s'.", output_path)
+            return 0
 
-            if exists(output_path):
-                if args.replace:
-                    log.warn(
-                        "Existing output file '%s' will be overwritten.", output_path
-                    )
-                else:
-                    log.warn(
-                        "Existing output file '%s' will not be overwritten.",
-                        output_path,
-                    )
-                    continue
+    # Only ask for ports on a terminal, e.g. not when started by the browser
+    interactive = sys.stdin.isatty()
+    try:
+        midiin, midiin_name = open_midiinput(args.input_port, interactive=interactive)
+        midiout, midiout_name = open_midioutput(args.output_port, interactive=interactive)
+    except RtMidiError as exc:
+        log.error("Cannot open MIDI port: %s", exc)
+        return 1
+    except (EOFError, KeyboardInterrupt):
+        return 1
 
-            with open(output_path, "wb") as sysex:
-                log.info("Writing patch '%s' to file '%s'...", data["name"], output_path)
-                sysex.write(patch)
+    reface = RefaceDX(midiin, midiout, channel=channel - 1)
+    written, existing = save_patches(reface, patches, args.device, args.path, args.output_path, args.replace)
+    if not written:
+        return EXIT_PATCH_EXISTS if existing else 1
 
 
 if __name__ == "__main__":
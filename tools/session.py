@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# tools/session.py
+"""Snapshot of the browser's view, restored at the next start.
+
+The session is kept in two JSON files: a small one with the folder, the
+selected item, sort order and MIDI device, which is written whenever the
+wheel settles, and one with the listing of the folder and the folder's
+modification time, which is only written when a folder was opened. The
+wheel is scrolled back to the selected item, so its offset is not saved.
+At startup the listing is shown from the snapshot straight away and checked
+against the folder's modification time afterwards.
+
+"""
+
+import json
+import logging
+import os
+
+from .listing import Listing
+
+
+log = logging.getLogger(__name__)
+
+SESSION_VERSION = 1
+
+
+def listing_file(session_file):
+    return os.path.splitext(session_file)[0] + "-listing.json"
+
+
+def write_json(path, data):
+    """Write data to path atomically, so a crash never leaves a truncated file."""
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w") as fp:
+            json.dump(data, fp, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        log.error("Could not write session file '%s': %s", path, exc)
+
+
+def read_json(path):
+    try:
+        with open(path) as fp:
+            data = json.load(fp)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        log.warning("Ignoring unreadable session file '%s': %s", path, exc)
+        return None
+
+    if not isinstance(data, dict) or data.get("version") != SESSION_VERSION:
+        return None
+    return data
+
+
+def save_view(session_file, state):
+    write_json(session_file, dict(state, version=SESSION_VERSION))
+
+
+def save_listing(session_file, listing):
+    """Save a directory listing together with the modification time of the directory."""
+    try:
+        mtime = os.stat(listing.path).st_mtime
+    except OSError:
+        return
+
+    write_json(listing_file(session_file), {"version": SESSION_VERSION, "mtime": mtime, "listing": listing.to_dict()})
+
+
+def load(session_file):
+    """Return (view state, listing, folder mtime) of the last session.
+
+    The listing is None unless it was saved for the folder of the view. The
+    state is None if there is no usable session.
+
+    """
+    state = read_json(session_file)
+    if state is None or not isinstance(state.get("path"), str):
+        return None, None, None
+
+    saved = read_json(listing_file(session_file))
+    if saved is None or saved.get("listing", {}).get("path") != state["path"]:
+        return state, None, None
+
+    try:
+        return state, Listing.from_dict(saved["listing"]), saved["mtime"]
+    except (KeyError, TypeError, ValueError) as exc:
+        log.warning("Ignoring saved listing: %s", exc)
+        return state, None, None
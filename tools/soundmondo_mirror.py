@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+#
+# tools/soundmondo_mirror.py
+"""Download ranges or lists of Soundmondo voices concurrently into SysEx files.
+
+Voices are fetched by a bounded pool of worker threads sharing one HTTP
+session with a keep-alive connection per worker, and requests to a host are
+spaced by a shared rate limit. User information for the ``{user}`` fields
+is looked up once per user and kept between runs.
+Files are named with the output path template of get_soundmondo_voice, e.g.
+``DX-{id:08}-{name}.syx``.
+
+Every finished voice is appended to a journal in the output folder, so an
+interrupted mirror started again with the same arguments skips the voices
+that were saved or do not exist and only retries the failed ones.
+
+The ``updated`` time, HTTP validators (ETag, Last-Modified), size and file of
+every voice are kept in an index in the output folder. With ``--sync`` the
+mirror is brought up to date instead: voices are requested conditionally
+and only rewritten if they changed, and IDs known to be missing are not
+asked for again. With ``--list`` only the voices that the paginated voice
+list shows as updated since the last sync are requested at all.
+
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from posixpath import join as pjoin
+from urllib.parse import urlsplit
+
+import requests
+
+from .get_soundmondo_voice import (API_BASE_URL, DownloadError, OutputExistsError, UserCache,
+                                   default_user_cache_path, mount_pooled_adapter, parse_timestamp,
+                                   parse_voice_response, request_voice, save_voice)
+
+
+log = logging.getLogger(__name__)
+
+JOURNAL_NAME = ".soundmondo-mirror.journal"
+SYNC_JOURNAL_NAME = ".soundmondo-sync.journal"
+INDEX_NAME = ".soundmondo-index.db"
+DONE_STATES = ("saved", "updated", "unchanged", "exists", "missing")
+PROGRESS_INTERVAL = 500
+INDEX_COMMIT_INTERVAL = 100
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS voices (
+    id INTEGER PRIMARY KEY,
+    updated TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    path TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# The last seen state of a voice, path is None if the voice does not exist
+IndexEntry = namedtuple("IndexEntry", "id updated etag last_modified size path")
+
+
+class RateLimiter:
+    """Space out requests to each host to at most rate per second, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = {}     # host -> earliest time of the next request
+
+    def wait(self, url):
+        if not self.interval:
+            return
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+
+class RateLimitedSession(requests.Session):
+    """Session waiting for the rate limiter before each request, counting requests and bytes received.
+
+    The session is shared by the workers, its connection pool keeps
+    pool_size connections to each host open.
+
+    """
+
+    def __init__(self, limiter, pool_size=1):
+        super().__init__()
+        self.limiter = limiter
+        self.requests = 0
+        self.received = 0
+        self._count_lock = threading.Lock()
+        mount_pooled_adapter(self, pool_size)
+
+    def request(self, method, url, *args, **kwargs):
+        self.limiter.wait(url)
+        resp = super().request(method, url, *args, **kwargs)
+        with self._count_lock:
+            self.requests += 1
+            self.received += len(resp.content)
+        return resp
+
+
+def parse_ids(specs):
+    """Return the voice IDs given as numbers or ranges (e.g. '1000-1999'), in order and without duplicates."""
+    ids = {}
+    for spec in specs:
+        try:
+            if "-" in spec:
+                lo, hi = [int(i) for i in spec.split("-", 1)]
+                ids.update(dict.fromkeys(range(lo, hi + 1)))
+            else:
+                ids[int(spec)] = None
+        except ValueError:
+            raise ValueError("Invalid voice ID or range: %s" % spec)
+
+    return list(ids)
+
+
+def read_id_file(path):
+    """Return the ID specs in a file, one or more per line, '#' starting a comment."""
+    with open(path) as fp:
+        return [spec for line in fp for spec in line.split("#", 1)[0].split()]
+
+
+def format_size(size):
+    if size < 1024:
+        return "%i bytes" % size
+    if size < 1024 * 1024:
+        return "%.1f KiB" % (size / 1024)
+    return "%.1f MiB" % (size / (1024 * 1024))
+
+
+def changed_voices(session, base_url, since=None):
+    """Yield (id, updated) of the voices updated after since, newest first.
+
+    Pages through the voice list ordered by update time, following the
+    'next' links of its paginated 'results'.
+
+    """
+    url = pjoin(base_url, "voices") + "/?ordering=-updated"
+    while url:
+        resp = session.get(url, headers={"Accept": "application/json"})
+        if resp.status_code != 200:
+            raise DownloadError("Failed to retrieve voice list from '%s': %s" % (url, resp.reason), resp.status_code)
+
+        try:
+            page = resp.json()
+            items = [(int(item["id"]), item["updated"]) for item in page["results"]]
+        except (KeyError, TypeError, ValueError) as exc:
+            raise IOError("Unexpected voice list format: %s" % exc)
+
+        for voice_id, updated in items:
+            if since is not None and updated <= since:
+                return
+            yield voice_id, updated
+        url = page.get("next")
+
+
+def conditional_headers(entry):
+    """Return the headers asking the server to answer 304 if the saved file of entry is current."""
+    headers = {}
+    if entry is not None and entry.path and os.path.exists(entry.path):
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+    return headers
+
+
+class Journal:
+    """Append-only record of the voices handled, one 'id<TAB>state<TAB>detail' line each."""
+
+    def __init__(self, path):
+        self.path = path
+        self.states = {}
+        try:
+            with open(path, encoding="utf-8") as fp:
+                for line in fp:
+                    fields = line.rstrip("\n").split("\t", 2)
+                    if len(fields) == 3 and fields[0].isdecimal():
+                        self.states[int(fields[0])] = fields[1]
+        except FileNotFoundError:
+            pass
+
+        self._fp = open(path, "a", encoding="utf-8")
+
+    def done(self, voice_id):
+        return self.states.get(voice_id) in DONE_STATES
+
+    def record(self, voice_id, state, detail=""):
+        self.states[voice_id] = state
+        self._fp.write("%i\t%s\t%s\n" % (voice_id, state, detail.replace("\n", " ")))
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class SyncIndex:
+    """The last seen state of each voice, kept in an SQLite database.
+
+    All entries are read into ``entries`` when the index is opened, so the
+    worker threads can look them up while only the main thread writes.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(INDEX_SCHEMA)
+        self.entries = {row[0]: IndexEntry(*row) for row in self.db.execute(
+            "SELECT id, updated, etag, last_modified, size, path FROM voices")}
+        self._uncommitted = 0
+
+    def get(self, voice_id):
+        return self.entries.get(voice_id)
+
+    def put(self, entry):
+        self.entries[entry.id] = entry
+        self.db.execute("INSERT OR REPLACE INTO voices (id, updated, etag, last_modified, size, path) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", entry)
+        self._uncommitted += 1
+        if self._uncommitted >= INDEX_COMMIT_INTERVAL:
+            self.commit()
+
+    def highest_id(self):
+        """Return the highest ID of a voice that exists."""
+        return max((entry.id for entry in self.entries.values() if entry.path), default=0)
+
+    @property
+    def synced_until(self):
+        """The newest update time in the voice list at the last complete sync."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'synced_until'").fetchone()
+        return row and row[0]
+
+    @synced_until.setter
+    def synced_until(self, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_until', ?)", (value,))
+        self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+class Mirror:
+    """Download voices with a pool of workers, recording the outcome of each in the journal and the index."""
+
+    def __init__(self, output_dir, output_path="DX-{id:08}-{name}.syx", base_url=API_BASE_URL, workers=4, rate=5.0,
+                 replace=False, journal=None, index=None, sync=False, user_cache=None):
+        self.output_dir = output_dir
+        self.output_path = output_path
+        self.base_url = base_url
+        self.workers = workers
+        self.replace = replace
+        self.sync = sync
+        self.limiter = RateLimiter(rate)
+        self.journal = Journal(journal or os.path.join(output_dir, SYNC_JOURNAL_NAME if sync else JOURNAL_NAME))
+        self.index = SyncIndex(index or os.path.join(output_dir, INDEX_NAME))
+        self.users = user_cache if user_cache is not None else UserCache(default_user_cache_path())
+        self.counts = dict.fromkeys(DONE_STATES + ("failed", "skipped"), 0)
+        self.bytes_saved = 0
+        self._session = RateLimitedSession(self.limiter, workers)
+
+    def session(self):
+        return self._session
+
+    @property
+    def requests(self):
+        return self._session.requests
+
+    @property
+    def received(self):
+        return self._session.received
+
+    def fetch(self, voice_id):
+        """Download and save one voice.
+
+        Returns (state, detail, new index entry or None, bytes saved by a
+        conditional request).
+
+        """
+        session = self.session()
+        known = self.index.get(voice_id)
+        headers = conditional_headers(known) if self.sync else None
+        while True:
+            try:
+                resp = request_voice(voice_id, session, self.base_url, headers)
+            except DownloadError as exc:
+                if exc.status == 304 and headers:
+                    if os.path.exists(known.path):
+                        return "unchanged", known.path, None, known.size
+                    # The file was deleted after the request was made
+                    headers = None
+                    continue
+                if exc.status == 404:
+                    return "missing", str(exc), IndexEntry(voice_id, None, None, None, 0, None), 0
+                raise
+            break
+
+        data = parse_voice_response(resp)
+        data.update(parse_timestamp(data.get("updated")))
+        data["id"] = voice_id
+        entry = IndexEntry(voice_id, data.get("updated"), resp.headers.get("ETag"), resp.headers.get("Last-Modified"),
+                           len(resp.content), None)
+
+        known_path = known.path if known is not None and known.path and os.path.exists(known.path) else None
+        if self.sync and known_path and known.updated == entry.updated:
+            return "unchanged", known_path, entry._replace(path=known_path), 0
+
+        try:
+            path = save_voice(data, os.path.join(self.output_dir, self.output_path),
+                              self.replace or (self.sync and known_path is not None), session, self.users)
+        except OutputExistsError as exc:
+            return "exists", exc.path, entry._replace(path=exc.path), 0
+
+        if known_path and known_path != path:
+            # The voice was renamed
+            os.remove(known_path)
+        return "updated" if known_path else "saved", path, entry._replace(path=path), 0
+
+    def _fetch(self, voice_id):
+        try:
+            return self.fetch(voice_id)
+        except Exception as exc:
+            return "failed", str(exc), None, 0
+
+    def select(self, voice_ids, recheck_missing=False):
+        """Return the IDs to request, leaving out those done before.
+
+        A sync also leaves out IDs that were missing below the highest
+        existing one, as new voices get higher IDs.
+
+        """
+        todo = [voice_id for voice_id in voice_ids if not self.journal.done(voice_id)]
+        if self.sync and not recheck_missing:
+            highest = self.index.highest_id()
+            entries = self.index.entries
+            todo = [voice_id for voice_id in todo
+                    if voice_id > highest or voice_id not in entries or entries[voice_id].path is not None]
+
+        self.skip(set(voice_ids).difference(todo))
+        return todo
+
+    def skip(self, voice_ids):
+        """Count voices that are not requested, because they are done or known to be unchanged."""
+        self.counts["skipped"] += len(voice_ids)
+        for voice_id in voice_ids:
+            entry = self.index.get(voice_id)
+            if entry is not None:
+                self.bytes_saved += entry.size
+
+    def run(self, voice_ids):
+        """Download the given voices. Returns the counts per state."""
+        log.info("%i voices to download, %i skipped.", len(voice_ids), self.counts["skipped"])
+
+        pending = {}
+        queue = iter(voice_ids)
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="mirror") as executor:
+            try:
+                while True:
+                    # Keep a few requests per worker queued instead of one future per voice
+                    for voice_id in queue:
+                        pending[executor.submit(self._fetch, voice_id)] = voice_id
+                        if len(pending) >= self.workers * 4:
+                            break
+
+                    if not pending:
+                        break
+
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        voice_id = pending.pop(future)
+                        state, detail, entry, saved = future.result()
+                        self.journal.record(voice_id, state, detail or "")
+                        if entry is not None:
+                            self.index.put(entry)
+                        self.counts[state] += 1
+                        self.bytes_saved += saved
+                        if state == "failed":
+                            log.error("Voice %i: %s", voice_id, detail)
+                        else:
+                            log.debug("Voice %i %s: %s", voice_id, state, detail)
+
+                        handled = sum(self.counts.values()) - self.counts["skipped"]
+                        if handled % PROGRESS_INTERVAL == 0:
+                            log.info("%i of %i voices handled.", handled, len(voice_ids))
+            except KeyboardInterrupt:
+                for future in pending:
+                    future.cancel()
+                raise
+
+        return self.counts
+
+    def close(self):
+        self.journal.close()
+        self.index.close()
+        self.users.save()
+        self._session.close()
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-b", "--base-url", default=API_BASE_URL, help="Soundmondo API base URL (default: %(default)s)")
+    ap.add_argument("-f", "--output-path", metavar="PATH", default="DX-{id:08}-{name}.syx",
+                    help="Path of the files written, relative to the output folder (default: '%(default)s')")
+    ap.add_argument("-i", "--id-file", metavar="FILE", action="append", default=[],
+                    help="Read voice IDs and ranges from FILE (may be given more than once)")
+    ap.add_argument("-I", "--index", metavar="FILE", help="Sync index (default: %s in the output folder)" % INDEX_NAME)
+    ap.add_argument("-j", "--journal", metavar="FILE",
+                    help="Resume journal (default: %s, or %s with --sync, in the output folder)"
+                    % (JOURNAL_NAME, SYNC_JOURNAL_NAME))
+    ap.add_argument("-l", "--list", action="store_true",
+                    help="With --sync, only request the voices the voice list shows as updated since the last sync")
+    ap.add_argument("-m", "--recheck-missing", action="store_true",
+                    help="With --sync, request IDs again that were missing before")
+    ap.add_argument("-o", "--output-dir", metavar="FOLDER", default=".", help="Folder to save voices to (default: current directory)")
+    ap.add_argument("-r", "--replace", action="store_true", help="Replace existing files (default: no)")
+    ap.add_argument("-R", "--rate", type=float, default=5.0,
+                    help="Maximum requests per second and host, 0 for no limit (default: %(default)s)")
+    ap.add_argument("-s", "--sync", action="store_true", help="Bring the mirror up to date, saving only new and changed voices")
+    ap.add_argument("-u", "--user-cache", metavar="FILE", default=default_user_cache_path(),
+                    help="File caching Soundmondo user information (default: %(default)s)")
+    ap.add_argument("-w", "--workers", type=int, default=4, help="Number of concurrent downloads (default: %(default)s)")
+    ap.add_argument("-v", "--debug", action="store_true", help="Enable debug logging")
+    ap.add_argument("ids", nargs="*", metavar="ID",
+                    help="Voice ID or ID range, e.g. 1000-1999 (default with --sync: the voices in the index)")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format="%(levelname)s: %(message)s")
+    if not args.debug:
+        # Not one line for every file written
+        logging.getLogger("get-soundmondo-voice").setLevel(logging.WARNING)
+
+    try:
+        specs = list(args.ids)
+        for path in args.id_file:
+            specs += read_id_file(path)
+        voice_ids = parse_ids(specs)
+    except (OSError, ValueError) as exc:
+        log.error("%s", exc)
+        return 2
+
+    if not voice_ids and not args.sync:
+        ap.error("no voice IDs given")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    mirror = Mirror(args.output_dir, args.output_path, args.base_url, max(1, args.workers), args.rate, args.replace,
+                    args.journal, args.index, args.sync, UserCache(args.user_cache))
+    given_ids = bool(voice_ids)
+    if not given_ids:
+        voice_ids = sorted(mirror.index.entries)
+
+    started = time.perf_counter()
+    synced_until = None
+    try:
+        if args.sync and args.list:
+            changed = {}
+            for voice_id, updated in changed_voices(mirror.session(), args.base_url, mirror.index.synced_until):
+                changed.setdefault(voice_id, updated)
+            synced_until = max(changed.values(), default=None)
+            log.info("%i voices were updated since the last sync.", len(changed))
+
+            if given_ids:
+                wanted = set(voice_ids)
+                changed = {voice_id: updated for voice_id, updated in changed.items() if voice_id in wanted}
+            else:
+                voice_ids = sorted(set(voice_ids).union(changed))
+            todo = [voice_id for voice_id in changed if not mirror.journal.done(voice_id)]
+            mirror.skip(set(voice_ids).difference(todo))
+        else:
+            todo = mirror.select(voice_ids, args.recheck_missing)
+
+        counts = mirror.run(todo)
+    except KeyboardInterrupt:
+        log.warning("Interrupted, run the same command again to continue.")
+        mirror.close()
+        return 1
+    except IOError as exc:
+        log.error("%s", exc)
+        mirror.close()
+        return 1
+
+    if args.sync and not counts["failed"]:
+        # Complete, the next sync starts afresh
+        if synced_until:
+            mirror.index.synced_until = synced_until
+        mirror.journal.remove()
+    mirror.close()
+
+    elapsed = time.perf_counter() - started
+    fetched = len(todo)
+    if mirror.users.hits or mirror.users.misses:
+        log.info("User information: %i downloaded, %i from the cache.", mirror.users.misses, mirror.users.hits)
+    log.info("%i saved, %i updated, %i unchanged, %i existed, %i missing, %i failed, %i skipped; %.1f voices/s.",
+             counts["saved"], counts["updated"], counts["unchanged"], counts["exists"], counts["missing"],
+             counts["failed"], counts["skipped"], fetched / elapsed if elapsed else 0.0)
+
+    if args.sync:
+        log.info("%i requests made, %s received. Saved %i requests and %s compared to downloading all %i voices.",
+                 mirror.requests, format_size(mirror.received), len(voice_ids) - fetched,
+                 format_size(mirror.bytes_saved), len(voice_ids))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+#
+# tools/soundmondo_standin.py
+"""Local stand-in for the Soundmondo voice API, serving our own SysEx files.
+
+Serves ``api/v1/voices/<id>/``, the paginated voice list ``api/v1/voices/``
+ordered by ``-updated`` and ``api/v1/users/<id>/`` in the format of the real
+site, so the downloader and the mirror can be tuned against it with ``-b``.
+Voices come from folders of SysEx files and voice packs. Files named like
+``DX-00000045-MotionPad.syx`` keep their Soundmondo ID, the others are
+numbered after the highest one; every voice is attributed to one of a few
+made-up users.
+
+Responses carry an ETag and Last-Modified and conditional requests are
+answered with 304. Latency, jitter, error responses and dropped connections
+can be injected to see how clients cope. ``/stats`` returns the counters of
+the requests served as JSON.
+
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from . import voicepack
+
+
+log = logging.getLogger(__name__)
+
+API_PREFIX = "/api/v1/"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+PAGE_SIZE = 100
+SYSTEM_EXCLUSIVE = 0xF0
+END_OF_EXCLUSIVE = 0xF7
+
+StandinVoice = namedtuple("StandinVoice", "id name data mtime")
+
+
+def split_messages(data):
+    """Return the SysEx messages in data."""
+    messages = []
+    start = data.find(SYSTEM_EXCLUSIVE)
+    while start >= 0:
+        end = data.find(END_OF_EXCLUSIVE, start)
+        if end < 0:
+            break
+        messages.append(data[start:end + 1])
+        start = data.find(SYSTEM_EXCLUSIVE, end + 1)
+    return messages
+
+
+def voice_name(filename):
+    name = os.path.splitext(filename)[0]
+    match = voicepack.SOUNDMONDO_ID_RX.match(name)
+    return name[match.end():] if match else name
+
+
+def load_voices(sources):
+    """Return a dict of ID -> StandinVoice of the SysEx files in folders and voice packs."""
+    found = []      # (Soundmondo ID or None, name, data, mtime)
+
+    for source in sources:
+        if source.endswith(voicepack.PACK_EXTENSION):
+            pack = voicepack.open_pack(source)
+            for index, path in enumerate(pack.paths):
+                found.append((pack.ids[index], voice_name(path.rpartition("/")[2]), bytes(pack.voice(index)),
+                              pack.mtimes[index]))
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(".syx"):
+                    continue
+
+                path = os.path.join(dirpath, filename)
+                try:
+                    with open(path, "rb") as fp:
+                        data = fp.read()
+                    mtime = os.path.getmtime(path)
+                except OSError as exc:
+                    log.warning("Skipping '%s': %s", path, exc)
+                    continue
+
+                match = voicepack.SOUNDMONDO_ID_RX.match(filename)
+                found.append((int(match.group(1)) if match else None, voice_name(filename), data, mtime))
+
+    voices = {}
+    next_id = max((voice_id for voice_id, _, _, _ in found if voice_id is not None), default=0) + 1
+    for voice_id, name, data, mtime in found:
+        if voice_id is None or voice_id in voices:
+            voice_id, next_id = next_id, next_id + 1
+        voices[voice_id] = StandinVoice(voice_id, name, data, mtime)
+
+    return voices
+
+
+def format_updated(mtime):
+    return datetime.fromtimestamp(mtime, timezone.utc).strftime(DATE_FORMAT)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive, like the real site, so clients can reuse their connections
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which Nagle's algorithm would delay
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            return self.send_json(200, server.snapshot())
+
+        server.count("requests")
+        server.delay()
+        if server.inject("reset_rate"):
+            # Drop the connection without an answer
+            server.count("reset")
+            self.close_connection = True
+            return
+        if server.inject("error_rate"):
+            return self.send_json(503, {"detail": "Service temporarily unavailable."})
+
+        parts = url.path[len(API_PREFIX):].strip("/").split("/") if url.path.startswith(API_PREFIX) else []
+        if parts == ["voices"]:
+            server.count("list")
+            return self.send_list(parse_qs(url.query))
+        if len(parts) == 2 and parts[1].isdecimal():
+            if parts[0] == "voices":
+                server.count("voice")
+                return self.send_voice(int(parts[1]))
+            if parts[0] == "users":
+                server.count("user")
+                user_id = int(parts[1])
+                if user_id < server.users:
+                    return self.send_json(200, {"id": user_id, "display_name": "Stand-in User %i" % user_id})
+
+        self.send_json(404, {"detail": "Not found."})
+
+    def send_voice(self, voice_id):
+        voice = self.server.voices.get(voice_id)
+        if voice is None:
+            return self.send_json(404, {"detail": "Not found."})
+
+        body, etag = self.server.voice_body(voice)
+        last_modified = formatdate(voice.mtime, usegmt=True)
+        if self.headers.get("If-None-Match") == etag:
+            self.server.count(304)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_body(200, body, {"ETag": etag, "Last-Modified": last_modified})
+
+    def send_list(self, query):
+        try:
+            page = max(1, int(query.get("page", ["1"])[0]))
+        except ValueError:
+            page = 1
+
+        ordered = self.server.by_updated()
+        items = ordered[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        next_url = None
+        if page * PAGE_SIZE < len(ordered):
+            next_url = "http://%s%svoices/?ordering=-updated&page=%i" % (self.headers["Host"], API_PREFIX, page + 1)
+
+        self.send_json(200, {
+            "count": len(ordered),
+            "next": next_url,
+            "results": [{"id": voice.id, "name": voice.name, "updated": format_updated(voice.mtime)}
+                        for voice in items],
+        })
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data).encode("utf-8"))
+
+    def send_body(self, status, body, headers=None):
+        if not self.path.startswith("/stats"):
+            self.server.count(status)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.server.max_age:
+            self.send_header("Cache-Control", "max-age=%i" % self.server.max_age)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandinServer(ThreadingHTTPServer):
+    """HTTP server answering like Soundmondo from a dict of StandinVoice.
+
+    latency and jitter are in seconds, error_rate and reset_rate are the
+    fractions of requests answered with 503 or dropped.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, voices, users=20, latency=0.0, jitter=0.0, error_rate=0.0, reset_rate=0.0,
+                 max_age=0, seed=None):
+        super().__init__(address, StandinHandler)
+        self.voices = voices
+        self.users = max(1, users)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.max_age = max_age
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._by_updated = None
+        self._bodies = {}       # (ID, mtime) -> (JSON body, ETag)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%i%s" % (host, port, API_PREFIX.rstrip("/"))
+
+    def count(self, key):
+        with self._lock:
+            self.stats[str(key)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                delay = self.latency + self.random.uniform(0, self.jitter)
+            time.sleep(delay)
+
+    def inject(self, rate_name):
+        rate = getattr(self, rate_name)
+        if not rate:
+            return False
+        with self._lock:
+            return self.random.random() < rate
+
+    def by_updated(self):
+        if self._by_updated is None:
+            self._by_updated = sorted(self.voices.values(), key=lambda voice: (voice.mtime, voice.id), reverse=True)
+        return self._by_updated
+
+    def voice_body(self, voice):
+        """Return the JSON body and the ETag of a voice, encoded once per version of the voice."""
+        key = (voice.id, voice.mtime)
+        cached = self._bodies.get(key)
+        if cached is None:
+            cached = self._bodies[key] = self.encode_voice(voice)
+        return cached
+
+    def encode_voice(self, voice):
+        messages = split_messages(voice.data)
+        updated = format_updated(voice.mtime)
+        body = json.dumps({
+            "id": voice.id,
+            "name": voice.name,
+            "updated": updated,
+            "user": "%s/users/%i/" % (self.url, voice.id % self.users),
+            "data": {"sysex": [{str(i): b for i, b in enumerate(msg)} for msg in messages]},
+        }).encode("utf-8")
+        etag = '"%s"' % hashlib.blake2b(voice.data + updated.encode("ascii"), digest_size=8).hexdigest()
+        return body, etag
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-a", "--address", default="127.0.0.1", help="Address to listen on (default: %(default)s)")
+    ap.add_argument("-e", "--error-rate", type=float, default=0.0, metavar="FRACTION",
+                    help="Fraction of requests answered with 503 (default: %(default)s)")
+    ap.add_argument("-j", "--jitter", type=float, default=0.0, metavar="MS",
+                    help="Random extra latency of up to MS milliseconds (default: %(default)s)")
+    ap.add_argument("-l", "--latency", type=float, default=0.0, metavar="MS",
+                    help="Latency added to every response in milliseconds (default: %(default)s)")
+    ap.add_argument("-m", "--max-age", type=int, default=0, metavar="SECONDS",
+                    help="Cache-Control max-age of the responses, 0 for none (default: %(default)s)")
+    ap.add_argument("-p", "--port", type=int, default=8000, help="Port to listen on, 0 for any (default: %(default)s)")
+    ap.add_argument("-r", "--reset-rate", type=float, default=0.0, metavar="FRACTION",
+                    help="Fraction of connections dropped without an answer (default: %(default)s)")
+    ap.add_argument("-s", "--seed", type=int, help="Seed of the injected latency and errors")
+    ap.add_argument("-u", "--users", type=int, default=20, help="Number of users the voices are by (default: %(default)s)")
+    ap.add_argument("-v", "--debug", action="store_true", help="Enable debug logging")
+    ap.add_argument("sources", nargs="*", metavar="SOURCE", default=["Sysex"],
+                    help="Folder of SysEx files or voice pack to serve (default: Sysex)")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format="%(levelname)s: %(message)s")
+
+    try:
+        voices = load_voices(args.sources)
+        server = StandinServer((args.address, args.port), voices, args.users, args.latency / 1000,
+                               args.jitter / 1000, args.error_rate, args.reset_rate, args.max_age, args.seed)
+    except (OSError, voicepack.PackError) as exc:
+        log.error("%s", exc)
+        return 1
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, which runs in this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    # The first line of output tells scripts where to find the server
+    print(server.url, flush=True)
+    log.info("Serving %i voices at %s.", len(voices), server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        log.info("Requests served: %s", ", ".join("%s %i" % item for item in sorted(server.snapshot().items())))
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# tools/sprites.py
+"""Pre-rasterised text label sprites for the wheel browser."""
+
+import logging
+import threading
+
+from collections import OrderedDict
+from queue import Empty, Queue
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+log = logging.getLogger(__name__)
+
+FONT_FILES = {
+    False: ("DejaVuSans.ttf", "LiberationSans-Regular.ttf", "FreeSans.ttf", "arial.ttf"),
+    True: ("DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf", "FreeSansBold.ttf", "arialbd.ttf"),
+}
+
+_fonts = {}
+_fonts_lock = threading.Lock()
+
+
+class SpriteCache:
+    """Least-recently-used cache bounded by the approximate memory of its values."""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, nbytes):
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+
+        self._entries[key] = (value, nbytes)
+        self.bytes += nbytes
+
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+
+def load_font(pixels, bold=False):
+    """Return a TrueType font of the given pixel size, falling back to PIL's default font."""
+    key = (pixels, bold)
+
+    with _fonts_lock:
+        if key not in _fonts:
+            for filename in FONT_FILES[bold]:
+                try:
+                    _fonts[key] = ImageFont.truetype(filename, pixels)
+                    break
+                except OSError:
+                    continue
+            else:
+                log.warning("No TrueType font found, using PIL default font.")
+                _fonts[key] = ImageFont.load_default()
+
+        return _fonts[key]
+
+
+def render_label(text, pixels, bold, color):
+    """Rasterise text into a tightly cropped RGBA image.
+
+    color is an (r, g, b) tuple.
+
+    """
+    font = load_font(pixels, bold)
+    left, top, right, bottom = font.getbbox(text or " ")
+    image = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), color + (0,))
+    ImageDraw.Draw(image).text((-left, -top), text, font=font, fill=color + (255,))
+    return image
+
+
+class SpriteWarmer(threading.Thread):
+    """Background thread rasterising labels ahead of them being drawn.
+
+    Requests are (key, text, pixels, bold, color) tuples, finished labels are
+    put on the results queue as (key, image) for the GUI thread to pick up.
+
+    """
+
+    def __init__(self):
+        super().__init__(name="sprite-warmer", daemon=True)
+        self.requests = Queue()
+        self.results = Queue()
+
+    def run(self):
+        while True:
+            key, text, pixels, bold, color = self.requests.get()
+            try:
+                self.results.put((key, render_label(text, pixels, bold, color)))
+            except Exception as exc:
+                log.debug("Could not pre-render label %r: %s", text, exc)
+
+    def finished(self):
+        """Yield the labels rendered since the last call, without blocking."""
+        while True:
+            try:
+                yield self.results.get_nowait()
+            except Empty:
+                return
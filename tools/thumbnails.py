@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+#
+# tools/thumbnails.py
+"""Algorithm and envelope thumbnails of Reface DX voice files.
+
+A thumbnail shows the FM algorithm of the voice on the left, carriers on the
+bottom row, and the envelope of its first carrier on the right. Thumbnails
+are rendered on a background thread, kept in a memory-bounded LRU cache and
+saved as PNG files named by a hash of the voice data they show, so a voice is
+only decoded once, whatever it is called or wherever it is moved. Only the
+algorithm and the operator data up to the output levels are read from a
+voice file.
+
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import threading
+
+from queue import Empty, Queue
+
+from PIL import Image, ImageDraw
+
+from .sprites import SpriteCache
+from .voicepack import read_file, split_pack_path
+
+
+log = logging.getLogger(__name__)
+
+VOICE_SIZE = 241
+COMMON_DATA_OFFSET = 24     # Voice common data in a voice file
+OPERATOR_DATA_OFFSET = 75   # Operator 1 data, every operator message is 41 bytes long
+OPERATOR_MESSAGE_SIZE = 41
+ALGORITHM_OFFSET = 0x10     # In the voice common data
+EG_RATE_OFFSET = 1          # In the operator data, followed by the four EG levels
+OUTPUT_LEVEL_OFFSET = 0x12
+
+# Modulator -> modulated operator connections of the 12 algorithms. Operators
+# that do not modulate another one are carriers. Every operator has its own
+# feedback, so feedback loops are not part of the table.
+ALGORITHMS = (
+    ((4, 3), (3, 2), (2, 1)),           # 1: one stack
+    ((4, 2), (3, 2), (2, 1)),           # 2: two modulators on 2
+    ((4, 1), (3, 2), (2, 1)),           # 3: a stack and a modulator on 1
+    ((4, 1), (3, 1), (2, 1)),           # 4: three modulators on 1
+    ((4, 3), (4, 2), (3, 1), (2, 1)),   # 5: 4 on both modulators of 1
+    ((4, 3), (3, 2)),                   # 6: a stack on 2, 1 on its own
+    ((4, 2), (3, 2)),                   # 7: two modulators on 2, 1 on its own
+    ((4, 3), (2, 1)),                   # 8: two stacks
+    ((4, 3), (4, 2), (4, 1)),           # 9: 4 on three carriers
+    ((4, 3), (4, 2)),                   # 10: 4 on two carriers, 1 on its own
+    ((4, 3),),                          # 11: one pair, 1 and 2 on their own
+    (),                                 # 12: four carriers
+)
+# Where the voice data a thumbnail is drawn from is in a voice file:
+# (offset, length) of the algorithm and of the operator data up to the output level
+VOICE_PARTS = ((COMMON_DATA_OFFSET + ALGORITHM_OFFSET, 1),) + tuple(
+    (OPERATOR_DATA_OFFSET + op * OPERATOR_MESSAGE_SIZE, OUTPUT_LEVEL_OFFSET + 1) for op in range(4))
+
+
+def is_voice(data):
+    return len(data) == VOICE_SIZE and data[0] == 0xF0 and data[1] == 0x43
+
+
+def voice_parts(data):
+    """Return the parts of a voice file's contents a thumbnail is drawn from, joined."""
+    return b"".join(data[offset:offset + length] for offset, length in VOICE_PARTS)
+
+
+def read_voice_parts(path):
+    """Return voice_parts() of the voice file at path, or None if it is no voice, reading only those parts."""
+    if split_pack_path(path) is not None:
+        data = read_file(path)
+        return voice_parts(data) if is_voice(data) else None
+
+    with open(path, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size != VOICE_SIZE or fp.read(2) != b"\xF0\x43":
+            return None
+
+        parts = []
+        for offset, length in VOICE_PARTS:
+            fp.seek(offset)
+            parts.append(fp.read(length))
+    return b"".join(parts)
+
+
+def parse_parts(parts):
+    """Return (algorithm, operators) of the voice parts returned by voice_parts(), or None.
+
+    algorithm is an index into ALGORITHMS, operators a list of four
+    (eg_rates, eg_levels, output_level) tuples.
+
+    """
+    if len(parts) != 1 + 4 * (OUTPUT_LEVEL_OFFSET + 1) or parts[0] >= len(ALGORITHMS):
+        return None
+
+    operators = []
+    for op in range(4):
+        offset = 1 + op * (OUTPUT_LEVEL_OFFSET + 1)
+        operators.append((
+            tuple(parts[offset + EG_RATE_OFFSET:offset + EG_RATE_OFFSET + 4]),
+            tuple(parts[offset + EG_RATE_OFFSET + 4:offset + EG_RATE_OFFSET + 8]),
+            parts[offset + OUTPUT_LEVEL_OFFSET],
+        ))
+
+    return parts[0], operators
+
+
+def parse_voice(data):
+    """Return (algorithm, operators) of a Reface DX voice file's contents, or None, see parse_parts()."""
+    return parse_parts(voice_parts(data)) if is_voice(data) else None
+
+
+def carriers(algorithm):
+    modulators = {source for source, _ in ALGORITHMS[algorithm]}
+    return [op for op in range(1, 5) if op not in modulators]
+
+
+def operator_rows(algorithm):
+    """Return the row of every operator, counting up from the carriers in row 0."""
+    connections = ALGORITHMS[algorithm]
+    rows = {}
+
+    def row(op):
+        if op not in rows:
+            targets = [target for source, target in connections if source == op]
+            rows[op] = 1 + max(row(target) for target in targets) if targets else 0
+        return rows[op]
+
+    for op in range(1, 5):
+        row(op)
+    return rows
+
+
+def render_thumbnail(voice, size=(44, 26), color=(129, 162, 184)):
+    """Draw the algorithm and first carrier envelope of a parsed voice into an RGBA image."""
+    algorithm, operators = voice
+    width, height = size
+    image = Image.new("RGBA", size, color + (0,))
+    draw = ImageDraw.Draw(image)
+    fill = color + (255,)
+    dim = color + (110,)
+
+    # Algorithm: one box per operator, carriers on the bottom row
+    rows = operator_rows(algorithm)
+    row_count = max(rows.values()) + 1
+    per_row = {}
+    for op in range(1, 5):
+        per_row.setdefault(rows[op], []).append(op)
+
+    box = 4
+    area = width // 2 - 2
+    centers = {}
+    for row, ops in per_row.items():
+        y = height - 3 - row * (height - 6) // max(1, row_count - 1) if row_count > 1 else height // 2
+        for i, op in enumerate(ops):
+            centers[op] = ((i + 1) * area // (len(ops) + 1), y)
+
+    for source, target in ALGORITHMS[algorithm]:
+        draw.line((centers[source], centers[target]), fill=dim)
+    for op, (x, y) in centers.items():
+        level = operators[op - 1][2]
+        draw.rectangle((x - box // 2, y - box // 2, x + box // 2, y + box // 2),
+                       outline=fill, fill=fill if level else None)
+
+    # Envelope of the first carrier: attack, decay 1 and 2 with the given
+    # rates, a fixed-length sustain at level 3 and the release to level 4
+    rates, levels, _ = operators[carriers(algorithm)[0] - 1]
+    x0 = width // 2 + 2
+    span = width - x0 - 1
+    durations = [(128 - rate) / 128 for rate in rates[:3]] + [0.6, (128 - rates[3]) / 128]
+    scale = span / sum(durations)
+
+    def level_y(level):
+        return height - 2 - level * (height - 4) / 127
+
+    points = [(x0, level_y(levels[3]))]
+    for duration, level in zip(durations, levels[:3] + (levels[2], levels[3])):
+        points.append((points[-1][0] + duration * scale, level_y(level)))
+    draw.line(points, fill=fill)
+
+    return image
+
+
+def voice_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ThumbnailCache:
+    """Thumbnails of voice files, rendered on demand by a background thread.
+
+    get() returns a thumbnail as (hash, image) if it is ready and otherwise
+    queues it. collect() moves the finished thumbnails into the cache and
+    returns whether there were any, i.e. whether the wheel needs a redraw.
+    Files that are no Reface DX voices are remembered and not read again.
+
+    """
+
+    def __init__(self, folder, size=(44, 26), color=(129, 162, 184), max_bytes=2 * 1024 * 1024):
+        self.folder = folder
+        self.size = size
+        self.color = color
+        self.images = SpriteCache(max_bytes)
+        self.hashes = {}        # (path, mtime) -> content hash, or None for no voice
+        self.pending = set()
+        self.requests = Queue()
+        self.results = Queue()
+        os.makedirs(folder, exist_ok=True)
+        self.worker = threading.Thread(target=self.run, name="thumbnails", daemon=True)
+        self.worker.start()
+
+    def get(self, path, mtime):
+        key = (path, mtime)
+        digest = self.hashes.get(key, "")
+        if digest is None:
+            return None
+
+        image = self.images.get(digest) if digest else None
+        if image is not None:
+            return digest, image
+
+        if key not in self.pending:
+            self.pending.add(key)
+            self.requests.put(key)
+        return None
+
+    def collect(self):
+        arrived = False
+        while True:
+            try:
+                key, digest, image = self.results.get_nowait()
+            except Empty:
+                return arrived
+
+            self.pending.discard(key)
+            self.hashes[key] = digest
+            if image is not None:
+                self.images.put(digest, image, image.width * image.height * 4)
+                arrived = True
+
+    def run(self):
+        while True:
+            key = self.requests.get()
+            digest = image = None
+            try:
+                digest, image = self.load(key[0])
+            except Exception as exc:
+                log.debug("Could not make a thumbnail of '%s': %s", key[0], exc)
+            self.results.put((key, digest, image))
+
+    def load(self, path):
+        """Return (hash, thumbnail) of the voice file at path, from disk if rendered before.
+
+        The hash is the one of the voice data the thumbnail is drawn from, so
+        voices that only differ in other parameters share a thumbnail.
+
+        """
+        parts = read_voice_parts(path)
+        voice = None if parts is None else parse_parts(parts)
+        if voice is None:
+            return None, None
+
+        digest = voice_hash(parts)
+        filename = os.path.join(self.folder, "%s-%ix%i.png" % (digest, *self.size))
+        try:
+            with Image.open(filename) as cached:
+                return digest, cached.convert("RGBA")
+        except OSError:
+            pass
+
+        image = render_thumbnail(voice, self.size, self.color)
+        try:
+            image.save(filename + ".tmp", "PNG")
+            os.replace(filename + ".tmp", filename)
+        except OSError as exc:
+            log.warning("Could not save thumbnail '%s': %s", filename, exc)
+        return digest, image
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-s", "--scale", type=int, default=4, help="Scale factor of the saved image (default: %(default)s)")
+    ap.add_argument("voice", help="Reface DX voice file (.syx)")
+    ap.add_argument("output", help="Image file to write")
+    args = ap.parse_args(args)
+
+    with open(args.voice, "rb") as fp:
+        voice = parse_voice(fp.read(VOICE_SIZE + 1))
+
+    if voice is None:
+        return "Not a Reface DX voice file: %s" % args.voice
+
+    image = render_thumbnail(voice)
+    image.resize((image.width * args.scale, image.height * args.scale), Image.NEAREST).save(args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# tools/usagelog.py
+"""Append-only log of sent voice files, backing the Recent and Most played folders.
+
+Every send appends one binary record to the log: a little-endian timestamp
+(double), a 64-bit BLAKE2b hash of the path and the UTF-8 encoded path,
+prefixed by its length. The hash lets a torn record at the end of the log
+(e.g. after a power cut) be detected and cut off.
+
+Once the log grows past ``compact_bytes`` it is folded into a JSON snapshot
+holding the play count and last play time of at most ``max_paths`` files and
+a new, empty log segment is started. Loading therefore reads one bounded
+snapshot and one bounded log segment, however many plays were recorded.
+
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import time
+
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"MPUL"
+HEADER = struct.Struct("<4sI")      # Magic, generation
+RECORD = struct.Struct("<dQH")      # Timestamp, path hash, path length
+
+
+def path_hash(encoded_path):
+    return int.from_bytes(hashlib.blake2b(encoded_path, digest_size=8).digest(), "little")
+
+
+class UsageLog:
+    """Play counts and last play times of files, persisted in an append-only log.
+
+    ``last_played`` maps paths to the time they were last recorded and
+    ``counts`` maps them to the number of times they were recorded.
+
+    """
+
+    def __init__(self, path, snapshot_path=None, compact_bytes=64 * 1024, max_paths=1000):
+        self.path = path
+        self.snapshot_path = snapshot_path or os.path.splitext(path)[0] + ".json"
+        self.compact_bytes = compact_bytes
+        self.max_paths = max_paths
+        self.generation = 0
+        self.last_played = {}
+        self.counts = {}
+        self._fp = None
+
+    def load(self):
+        """Read the snapshot and replay the current log segment."""
+        self.last_played.clear()
+        self.counts.clear()
+
+        try:
+            with open(self.snapshot_path) as fp:
+                snapshot = json.load(fp)
+            self.generation = snapshot["generation"]
+            for path, count, last in snapshot["paths"]:
+                self.counts[path] = count
+                self.last_played[path] = last
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            log.warning("Ignoring unreadable usage snapshot '%s': %s", self.snapshot_path, exc)
+
+        try:
+            with open(self.path, "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            data = b""
+
+        if len(data) >= HEADER.size:
+            magic, generation = HEADER.unpack_from(data)
+            if magic != MAGIC:
+                log.warning("'%s' is not a usage log, starting a new one.", self.path)
+                data = b""
+            elif generation < self.generation:
+                # Compaction was interrupted after the snapshot was written,
+                # so everything in this segment is already counted.
+                data = b""
+            else:
+                self.generation = generation
+        else:
+            data = b""
+
+        end = self._replay(data) if data else 0
+        self._open(truncate_at=end)
+
+        if end - HEADER.size > self.compact_bytes:
+            self.compact()
+        return self
+
+    def _replay(self, data):
+        """Apply the records in data and return the offset after the last intact one."""
+        offset = HEADER.size
+        while offset + RECORD.size <= len(data):
+            timestamp, digest, length = RECORD.unpack_from(data, offset)
+            start = offset + RECORD.size
+            encoded = data[start:start + length]
+            if len(encoded) < length or path_hash(encoded) != digest:
+                break
+
+            self._count(encoded.decode("utf-8", "surrogateescape"), timestamp)
+            offset = start + length
+
+        if offset != len(data):
+            log.warning("Dropping %i bytes of torn records from '%s'.", len(data) - offset, self.path)
+        return offset
+
+    def _open(self, truncate_at=0):
+        if truncate_at < HEADER.size:
+            with open(self.path, "wb") as fp:
+                fp.write(HEADER.pack(MAGIC, self.generation))
+        else:
+            os.truncate(self.path, truncate_at)
+
+        self._fp = open(self.path, "ab")
+
+    def _count(self, path, timestamp):
+        self.counts[path] = self.counts.get(path, 0) + 1
+        if timestamp >= self.last_played.get(path, 0):
+            self.last_played[path] = timestamp
+
+    def record(self, path, timestamp=None):
+        """Append a play of path to the log, compacting it when it grew too long."""
+        if timestamp is None:
+            timestamp = time.time()
+
+        self._count(path, timestamp)
+        if self._fp is None:
+            return
+
+        encoded = path.encode("utf-8", "surrogateescape")
+        try:
+            self._fp.write(RECORD.pack(timestamp, path_hash(encoded), len(encoded)) + encoded)
+            self._fp.flush()
+            if self._fp.tell() - HEADER.size > self.compact_bytes:
+                self.compact()
+        except OSError as exc:
+            log.error("Could not write to usage log '%s': %s", self.path, exc)
+
+    def recent(self, limit=50):
+        """Return up to limit paths, most recently played first."""
+        return sorted(self.last_played, key=self.last_played.__getitem__, reverse=True)[:limit]
+
+    def most_played(self, limit=50):
+        """Return up to limit paths, most often played first."""
+        return sorted(self.counts, key=lambda path: (self.counts[path], self.last_played.get(path, 0)),
+                      reverse=True)[:limit]
+
+    def prune(self):
+        """Forget all but the max_paths most recent and most played paths."""
+        if len(self.counts) <= self.max_paths:
+            return
+
+        keep = set(self.recent(self.max_paths)) | set(self.most_played(self.max_paths))
+        for path in list(self.counts):
+            if path not in keep:
+                del self.counts[path]
+                self.last_played.pop(path, None)
+
+    def compact(self):
+        """Fold the log into the snapshot and start a new, empty log segment."""
+        self.prune()
+        generation = self.generation + 1
+        snapshot = {
+            "generation": generation,
+            "paths": [[path, count, self.last_played.get(path, 0)] for path, count in self.counts.items()],
+        }
+
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fp:
+                json.dump(snapshot, fp)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as exc:
+            log.error("Could not write usage snapshot '%s': %s", self.snapshot_path, exc)
+            return
+
+        self.close()
+        self.generation = generation
+        self._open()
+        log.debug("Compacted usage log '%s' to %i paths.", self.path, len(self.counts))
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-n", "--limit", type=int, default=20, help="Number of entries to list (default: %(default)s)")
+    ap.add_argument("-c", "--compact", action="store_true", help="Compact the log after reading it")
+    ap.add_argument("logfile", nargs="?", default="midipi-usage.log", help="Usage log (default: %(default)s)")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    usage = UsageLog(args.logfile).load()
+
+    print("Recent:")
+    for path in usage.recent(args.limit):
+        print("  %s  %s" % (time.strftime("%Y-%m-%d %H:%M", time.localtime(usage.last_played[path])), path))
+
+    print("Most played:")
+    for path in usage.most_played(args.limit):
+        print("  %5i  %s" % (usage.counts[path], path))
+
+    if args.compact:
+        usage.compact()
+    usage.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+#
+# tools/voicepack.py
+"""Pack folders of Reface DX voice files into a single memory-mapped file.
+
+A voice pack (``.dxpack``) holds every 241-byte voice of a folder tree as a
+fixed-size record, followed by a zlib-compressed JSON index of the relative
+path, Soundmondo ID, patch name and modification time of each record. Thousands
+of voices take one file instead of thousands of tiny ones, which are mostly
+block overhead and slow to list on an SD card.
+
+Files inside a pack are addressed like files in a folder, e.g.
+``Sysex/soundmondo.dxpack/DX/SYX/DX-00000045-MotionPad.syx``, so the browser
+lists the folders of a pack like real ones and read_file() returns a voice
+straight from the mapping of its pack.
+
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+
+from .listing import IS_DIR, Listing
+
+
+log = logging.getLogger(__name__)
+
+PACK_EXTENSION = ".dxpack"
+PACK_MAGIC = b"RDXPACK\0"
+PACK_VERSION = 1
+RECORD_SIZE = 241
+# Magic, version, record size, record count, index offset, index size
+HEADER = struct.Struct("<8sHHIQI4x")
+SOUNDMONDO_ID_RX = re.compile(r"^DX-(\d+)-")
+
+
+class PackError(ValueError):
+    """Raised for files that are no valid voice packs."""
+    pass
+
+
+def is_voice(data):
+    return len(data) == RECORD_SIZE and data[0] == 0xF0 and data[1] == 0x43 and data[-1] == 0xF7
+
+
+def split_pack_path(path):
+    """Return (pack file, path inside the pack) of a path in a pack, or None.
+
+    The path inside the pack is '' for the pack itself.
+
+    """
+    if PACK_EXTENSION not in path:
+        return None
+
+    parts = path.split(os.sep)
+    for i, part in enumerate(parts):
+        if part.endswith(PACK_EXTENSION):
+            pack_file = os.sep.join(parts[:i + 1])
+            if os.path.isfile(pack_file):
+                return pack_file, "/".join(parts[i + 1:])
+    return None
+
+
+def is_pack_folder(path):
+    """Return whether path is a pack or a folder in one."""
+    split = split_pack_path(path)
+    if split is None:
+        return False
+
+    try:
+        return open_pack(split[0]).is_folder(split[1])
+    except (OSError, PackError):
+        return False
+
+
+def exists(path):
+    """Like os.path.exists(), but also true for the files and folders in a pack."""
+    if os.path.exists(path):
+        return True
+
+    split = split_pack_path(path)
+    if split is None:
+        return False
+
+    try:
+        pack = open_pack(split[0])
+    except (OSError, PackError):
+        return False
+    return pack.find(split[1]) >= 0 or pack.is_folder(split[1])
+
+
+def read_file(path):
+    """Return the contents of a file, reading voices in a pack from the pack's mapping."""
+    split = split_pack_path(path)
+    if split is None:
+        with open(path, "rb") as fp:
+            return fp.read()
+
+    pack = open_pack(split[0])
+    index = pack.find(split[1])
+    if index < 0:
+        raise FileNotFoundError("No voice '%s' in pack '%s'." % (split[1], split[0]))
+    return pack.voice(index)
+
+
+class VoicePack:
+    """A voice pack mapped into memory.
+
+    Records are only read from the mapping when a voice is asked for, the
+    index is decoded once when the pack is opened.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fp:
+            st = os.fstat(fp.fileno())
+            if st.st_size < HEADER.size:
+                raise PackError("'%s' is too short for a voice pack." % path)
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.stamp = (st.st_mtime_ns, st.st_size)
+        try:
+            self._read_index()
+        except Exception:
+            self.mmap.close()
+            raise
+
+    def _read_index(self):
+        magic, version, record_size, count, index_offset, index_size = HEADER.unpack_from(self.mmap, 0)
+        if magic != PACK_MAGIC:
+            raise PackError("'%s' is no voice pack." % self.path)
+        if version != PACK_VERSION or record_size != RECORD_SIZE:
+            raise PackError("Voice pack '%s' has unsupported version %i." % (self.path, version))
+        if HEADER.size + count * RECORD_SIZE > index_offset or index_offset + index_size > len(self.mmap):
+            raise PackError("Voice pack '%s' is truncated." % self.path)
+
+        try:
+            entries = json.loads(zlib.decompress(self.mmap[index_offset:index_offset + index_size]))
+        except (zlib.error, ValueError) as exc:
+            raise PackError("Voice pack '%s' has a corrupt index: %s" % (self.path, exc))
+        if len(entries) != count:
+            raise PackError("Voice pack '%s' has a corrupt index." % self.path)
+
+        # Entries are [path, Soundmondo ID or None, patch name, mtime] in the order of the records
+        self.paths = [entry[0] for entry in entries]
+        self.ids = [entry[1] for entry in entries]
+        self.patch_names = [entry[2] for entry in entries]
+        self.mtimes = [entry[3] for entry in entries]
+        self._by_path = {path: index for index, path in enumerate(self.paths)}
+
+        # Folder -> {name: record index, or None for a subfolder}
+        self.folders = {"": {}}
+        for index, path in enumerate(self.paths):
+            folder, _, name = path.rpartition("/")
+            self._add_folder(folder)[name] = index
+
+    def _add_folder(self, folder):
+        if folder not in self.folders:
+            parent, _, name = folder.rpartition("/")
+            self._add_folder(parent)[name] = None
+            self.folders[folder] = {}
+        return self.folders[folder]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def close(self):
+        self.mmap.close()
+
+    def find(self, path):
+        """Return the record index of the voice at path inside the pack, or -1."""
+        return self._by_path.get(path.strip("/"), -1)
+
+    def is_folder(self, path):
+        return path.strip("/") in self.folders
+
+    def voice(self, index):
+        offset = HEADER.size + index * RECORD_SIZE
+        return self.mmap[offset:offset + RECORD_SIZE]
+
+    def listing(self, folder=""):
+        """Return a listing of a folder of the pack."""
+        return PackListing(self, folder.strip("/"))
+
+
+class PackListing(Listing):
+    """The voices and subfolders of a folder in a voice pack."""
+
+    def __init__(self, pack, folder=""):
+        super().__init__(os.path.join(pack.path, *folder.split("/")) if folder else pack.path)
+        self.pack = pack
+        self.folder = folder
+        for name, index in sorted(pack.folders[folder].items()):
+            if index is None:
+                self._append(name, IS_DIR, 0, 0.0)
+            else:
+                self._append(name, 0, RECORD_SIZE, pack.mtimes[index])
+
+    def record(self, index):
+        return self.pack.find(self.folder + "/" + self.names[index] if self.folder else self.names[index])
+
+    def patch_name(self, index):
+        record = self.record(index)
+        return self.pack.patch_names[record] if record >= 0 else None
+
+
+_packs = {}
+_packs_lock = threading.Lock()
+
+
+def open_pack(path):
+    """Return the open VoicePack of path, opening it again if the file was replaced."""
+    st = os.stat(path)
+    with _packs_lock:
+        pack = _packs.get(path)
+        if pack is None or pack.stamp != (st.st_mtime_ns, st.st_size):
+            pack = _packs[path] = VoicePack(path)
+        return pack
+
+
+def pack_listing(path):
+    """Return the listing of a pack or a folder in a pack."""
+    split = split_pack_path(path)
+    if split is None:
+        raise PackError("'%s' is not in a voice pack." % path)
+
+    pack = open_pack(split[0])
+    if not pack.is_folder(split[1]):
+        raise FileNotFoundError("No folder '%s' in pack '%s'." % (split[1], split[0]))
+    return pack.listing(split[1])
+
+
+def pack_folder(folder, pack_path):
+    """Pack the voice files below folder into pack_path and return (voices packed, files skipped).
+
+    Files that are no single Reface DX voice, e.g. banks or text sidecars,
+    are skipped.
+
+    """
+    from .constants import PATCH_NAME_LENGTH, PATCH_NAME_OFFSET
+
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+        paths += [os.path.join(dirpath, name) for name in filenames]
+    paths.sort()
+
+    entries = []
+    skipped = 0
+    tmp_path = pack_path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        fp.write(bytes(HEADER.size))
+
+        for path in paths:
+            try:
+                if os.path.getsize(path) != RECORD_SIZE:
+                    skipped += 1
+                    continue
+                with open(path, "rb") as voice:
+                    data = voice.read()
+                mtime = os.path.getmtime(path)
+            except OSError as exc:
+                log.warning("Skipping '%s': %s", path, exc)
+                skipped += 1
+                continue
+
+            if not is_voice(data):
+                skipped += 1
+                continue
+
+            relpath = os.path.relpath(path, folder).replace(os.sep, "/")
+            match = SOUNDMONDO_ID_RX.match(os.path.basename(relpath))
+            patch_name = data[PATCH_NAME_OFFSET:PATCH_NAME_OFFSET + PATCH_NAME_LENGTH].decode("ascii", "replace")
+            entries.append([relpath, int(match.group(1)) if match else None, patch_name.rstrip(), mtime])
+            fp.write(data)
+
+        index = zlib.compress(json.dumps(entries, separators=(",", ":")).encode("utf-8"), 9)
+        index_offset = fp.tell()
+        fp.write(index)
+        fp.seek(0)
+        fp.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, RECORD_SIZE, len(entries), index_offset, len(index)))
+
+    os.replace(tmp_path, pack_path)
+    return len(entries), skipped
+
+
+def unpack(pack_path, folder, replace=False):
+    """Write the voices of a pack into files below folder and return (written, existing)."""
+    pack = VoicePack(pack_path)
+    written = existing = 0
+    try:
+        for index, relpath in enumerate(pack.paths):
+            path = os.path.join(folder, *relpath.split("/"))
+            if not replace and os.path.exists(path):
+                existing += 1
+                continue
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as fp:
+                fp.write(pack.voice(index))
+            os.utime(path, (pack.mtimes[index], pack.mtimes[index]))
+            written += 1
+    finally:
+        pack.close()
+
+    return written, existing
+
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-r", "--replace", action="store_true", help="Replace existing files when unpacking (default: no)")
+    ap.add_argument("-v", "--debug", action="store_true", help="Enable debug logging")
+    ap.add_argument("command", choices=("pack", "unpack", "list"),
+                    help="Pack a folder, unpack a pack into a folder or list the voices in a pack")
+    ap.add_argument("pack", help="Voice pack file (%s)" % PACK_EXTENSION)
+    ap.add_argument("folder", nargs="?", help="Folder to pack or unpack into")
+    args = ap.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format="%(levelname)s: %(message)s")
+
+    if args.command != "list" and not args.folder:
+        ap.error("'%s' requires a folder" % args.command)
+
+    try:
+        if args.command == "pack":
+            if not args.pack.endswith(PACK_EXTENSION):
+                ap.error("the pack file name must end with '%s'" % PACK_EXTENSION)
+            packed, skipped = pack_folder(args.folder, args.pack)
+            log.info("Packed %i voices into '%s', skipped %i other files.", packed, args.pack, skipped)
+        elif args.command == "unpack":
+            written, existing = unpack(args.pack, args.folder, args.replace)
+            log.info("Wrote %i voice files, %i existed already.", written, existing)
+        else:
+            pack = VoicePack(args.pack)
+            for relpath, voice_id, patch_name in zip(pack.paths, pack.ids, pack.patch_names):
+                print("%s\t%s\t%s" % (relpath, "" if voice_id is None else voice_id, patch_name))
+            pack.close()
+    except (OSError, PackError) as exc:
+        log.error("%s", exc)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)